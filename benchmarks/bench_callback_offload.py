@@ -0,0 +1,107 @@
+"""
+回调处理CPU卸载基准测试
+
+模拟并发到达的企业微信回调，对比 inline / thread / process 三种模式下
+单条回调的 p50/p99 延迟，以及事件循环心跳（模拟 /health 与 WebSocket ping）的延迟。
+
+用法:
+    python -m benchmarks.bench_callback_offload --callbacks 2000 --rate 1000
+"""
+import argparse
+import asyncio
+import random
+import string
+import time
+from typing import Dict, List
+
+from chatapp.callback.WXBizMsgCrypt3 import WXBizMsgCrypt
+from chatapp.config import settings
+from chatapp.utils.cpu_offload import CPUOffloader
+from chatapp.utils.wework_crypto import decrypt_and_parse
+
+MESSAGE_TEMPLATE = """<xml><ToUserName><![CDATA[{corp}]]></ToUserName>
+<FromUserName><![CDATA[customer_{idx}]]></FromUserName>
+<CreateTime>{ts}</CreateTime><MsgType><![CDATA[text]]></MsgType>
+<Content><![CDATA[{content}]]></Content><MsgId>{idx}</MsgId><AgentID>1000002</AgentID></xml>"""
+
+
+def build_requests(count: int) -> List[Dict[str, str]]:
+    """生成加密后的回调请求"""
+    wxcrypt = WXBizMsgCrypt(settings.WEWORK_TOKEN, settings.WEWORK_ENCODING_AES_KEY, settings.WEWORK_CORP_ID)
+    requests = []
+    for idx in range(count):
+        nonce = "".join(random.choices(string.ascii_letters, k=10))
+        timestamp = str(int(time.time()))
+        content = "请问这个楼盘的首付比例和学区情况怎么样？" * random.randint(1, 20)
+        xml = MESSAGE_TEMPLATE.format(corp=settings.WEWORK_CORP_ID, idx=idx, ts=timestamp, content=content)
+        _, encrypted = wxcrypt.EncryptMsg(xml, nonce, timestamp)
+        signature = encrypted.split("<MsgSignature><![CDATA[")[1].split("]]>")[0]
+        requests.append({"signature": signature, "timestamp": timestamp, "nonce": nonce, "xml": encrypted})
+    return requests
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run_mode(mode: str, requests: List[Dict[str, str]], rate: float, workers: int) -> Dict[str, float]:
+    offloader = CPUOffloader(mode=mode, max_workers=workers, max_pending=len(requests) + 1)
+    latencies: List[float] = []
+    heartbeat_lags: List[float] = []
+    done = asyncio.Event()
+
+    async def heartbeat():
+        while not done.is_set():
+            expected = time.perf_counter() + 0.01
+            await asyncio.sleep(0.01)
+            heartbeat_lags.append((time.perf_counter() - expected) * 1000)
+
+    async def callback(request: Dict[str, str], arrival: float):
+        await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+        ret, message = await offloader.run(
+            decrypt_and_parse, request["signature"], request["timestamp"], request["nonce"], request["xml"]
+        )
+        assert ret == 0 and message, f"decrypt failed: {ret}"
+        # 延迟从计划到达时刻算起，包含在事件循环中排队的时间
+        latencies.append((time.perf_counter() - arrival) * 1000)
+
+    # 预热执行器
+    await offloader.run(decrypt_and_parse, requests[0]["signature"], requests[0]["timestamp"],
+                        requests[0]["nonce"], requests[0]["xml"])
+
+    probe = asyncio.create_task(heartbeat())
+    base = time.perf_counter()
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(callback(r, base + i / rate) for i, r in enumerate(requests)))
+    wall = time.perf_counter() - wall_start
+    done.set()
+    await probe
+    offloader.shutdown()
+
+    return {
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "heartbeat_p99_lag_ms": percentile(heartbeat_lags, 99) if heartbeat_lags else 0.0,
+        "throughput_rps": len(requests) / wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Callback CPU offload benchmark")
+    parser.add_argument("--callbacks", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=1000, help="回调到达速率（条/秒）")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modes", default="inline,thread,process")
+    args = parser.parse_args()
+
+    requests = build_requests(args.callbacks)
+    print(f"{'mode':<8} {'p50(ms)':>10} {'p99(ms)':>10} {'hb p99 lag(ms)':>16} {'rps':>10}")
+    for mode in args.modes.split(","):
+        result = asyncio.run(run_mode(mode, requests, args.rate, args.workers))
+        print(f"{mode:<8} {result['p50_ms']:>10.2f} {result['p99_ms']:>10.2f} "
+              f"{result['heartbeat_p99_lag_ms']:>16.2f} {result['throughput_rps']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
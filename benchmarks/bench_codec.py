@@ -0,0 +1,117 @@
+"""
+Redis值编码基准测试
+
+对比各编码方式下一个会话（字符串存储的整段上下文 / 列表存储的逐条消息）
+以及一条AI结果的字节数与编解码耗时：
+    json            - 原有格式 json.dumps(ensure_ascii=False)
+    msgpack         - msgpack二进制
+    compact         - 紧凑消息元组 + msgpack
+    *+zstd          - 超过阈值的值再经zstd压缩
+
+不需要Redis，只测量序列化本身。需要安装 msgpack 与 zstandard。
+
+用法:
+    python -m benchmarks.bench_codec --sessions 2000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from chatapp.utils.codec import RedisCodec
+
+PHRASES = [
+    "您好，请问这个小区还有三室两厅的房源吗？", "首付大概需要多少？", "我们预算在三百万左右",
+    "离地铁站远不远", "周末可以过来看房吗", "好的，我跟家里人商量一下", "学区是哪所小学",
+    "物业费每平米多少钱", "可以帮我算一下月供吗？贷款三十年，利率按现在的LPR", "车位是租还是卖",
+]
+
+CODECS = [
+    ("json", 0),
+    ("msgpack", 0),
+    ("compact", 0),
+    ("json", 256),
+    ("compact", 256),
+]
+
+
+def make_session(rng: random.Random, messages: int) -> List[Dict[str, Any]]:
+    start = datetime.now() - timedelta(minutes=30)
+    context = []
+    for i in range(messages):
+        content = "".join(rng.choice(PHRASES) for _ in range(rng.randint(1, 4)))
+        message = {"content": content, "from_customer": i % 2 == 0, "msg_type": "text",
+                   "timestamp": (start + timedelta(seconds=37 * i, microseconds=rng.randint(0, 999999))).isoformat()}
+        context.append(message)
+    return context
+
+
+def make_result(rng: random.Random, context: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "session_id": "agent01:wmCustomer01",
+        "customer_id": "wmCustomer01",
+        "agent_id": "agent01",
+        "customer_message": context[-1]["content"],
+        "suggestions": ["".join(rng.choice(PHRASES) for _ in range(3)) for _ in range(3)],
+        "knowledge_results": [{"content": "".join(rng.choice(PHRASES) for _ in range(6)), "score": 0.8}] * 3,
+        "context_length": len(context),
+        "timestamp": "1700000000",
+        "timings": {"context": {"start_ms": 0.1, "duration_ms": 1.2}, "total": {"start_ms": 0.0, "duration_ms": 900}},
+    }
+
+
+def bench(codec: RedisCodec, sessions: List[List[Dict[str, Any]]], results: List[Dict[str, Any]]) -> Dict[str, float]:
+    start = time.perf_counter()
+    encoded_contexts = [codec.encode_context(context) for context in sessions]
+    encoded_items = [[codec.encode_message(dict(message)) for message in context] for context in sessions]
+    encoded_results = [codec.encode(result) for result in results]
+    encode_us = (time.perf_counter() - start) / len(sessions) * 1e6
+
+    start = time.perf_counter()
+    for value in encoded_contexts:
+        codec.decode(value)
+    for items in encoded_items:
+        codec.decode_context_items(items)
+    for value in encoded_results:
+        codec.decode(value)
+    decode_us = (time.perf_counter() - start) / len(sessions) * 1e6
+
+    def size(value) -> int:
+        return len(value.encode("utf-8")) if isinstance(value, str) else len(value)
+
+    return {
+        "string_bytes": sum(map(size, encoded_contexts)) / len(sessions),
+        "list_bytes": sum(size(item) for items in encoded_items for item in items) / len(sessions),
+        "result_bytes": sum(map(size, encoded_results)) / len(sessions),
+        "encode_us": encode_us,
+        "decode_us": decode_us,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redis value codec benchmark")
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=10, help="每个会话的消息数")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sessions = [make_session(rng, args.messages) for _ in range(args.sessions)]
+    results = [make_result(rng, context) for context in sessions]
+
+    print(f"{'codec':<16}{'string B/sess':>14}{'list B/sess':>13}{'result B':>10}"
+          f"{'encode us':>11}{'decode us':>11}")
+    baseline = None
+    for name, threshold in CODECS:
+        codec = RedisCodec(name, threshold)
+        stats = bench(codec, sessions, results)
+        baseline = baseline or stats
+        label = f"{name}+zstd" if threshold else name
+        print(f"{label:<16}{stats['string_bytes']:>14.0f}{stats['list_bytes']:>13.0f}{stats['result_bytes']:>10.0f}"
+              f"{stats['encode_us']:>11.1f}{stats['decode_us']:>11.1f}"
+              f"   ({stats['string_bytes'] / baseline['string_bytes']:.0%} of json)")
+
+
+if __name__ == "__main__":
+    main()
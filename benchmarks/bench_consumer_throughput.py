@@ -0,0 +1,81 @@
+"""
+任务消费吞吐量对比：Celery prefork 模型 vs 原生 asyncio 消费者
+
+每个任务模拟一次I/O等待（RAGFlow + OpenAI 调用），时长由 --latency 指定。
+    prefork - N 个进程各自串行执行任务（与 celery -P prefork -c N 的执行模型一致）
+    asyncio - 单进程 AsyncStreamConsumer，经由真实的 Redis Stream 收发任务
+
+需要可用的 Redis（使用 chatapp.config 中的连接配置）。
+
+用法:
+    python -m benchmarks.bench_consumer_throughput --tasks 2000 --latency 0.5 --processes 16 --concurrency 200
+"""
+import argparse
+import asyncio
+import multiprocessing
+import resource
+import time
+
+from chatapp.config import settings
+from chatapp.utils.redis_client import get_async_redis
+from chatapp.workers.async_consumer import AsyncStreamConsumer, enqueue_message
+
+
+def _blocking_task(latency: float) -> None:
+    time.sleep(latency)
+
+
+def bench_prefork(tasks: int, latency: float, processes: int) -> float:
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        pool.map(_blocking_task, [latency] * tasks, chunksize=1)
+    return tasks / (time.perf_counter() - start)
+
+
+async def bench_asyncio(tasks: int, latency: float, concurrency: int) -> float:
+    settings.STREAM_TASK_KEY = f"bench_tasks:{int(time.time())}"
+    redis_client = get_async_redis()
+    done = asyncio.Event()
+    completed = 0
+
+    async def handler(message_data):
+        nonlocal completed
+        await asyncio.sleep(latency)
+        completed += 1
+        if completed >= tasks:
+            done.set()
+
+    consumer = AsyncStreamConsumer(handler=handler, concurrency=concurrency, consumer_name="bench")
+    for i in range(tasks):
+        await enqueue_message({"msg_id": str(i), "msg_type": "text", "content": "首付比例是多少"})
+
+    start = time.perf_counter()
+    runner = asyncio.create_task(consumer.run())
+    await done.wait()
+    elapsed = time.perf_counter() - start
+    consumer.stop()
+    await runner
+    await redis_client.delete(settings.STREAM_TASK_KEY)
+    return tasks / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consumer throughput benchmark")
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.5, help="单任务I/O等待秒数")
+    parser.add_argument("--processes", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    prefork_tps = bench_prefork(args.tasks, args.latency, args.processes)
+    asyncio_tps = asyncio.run(bench_asyncio(args.tasks, args.latency, args.concurrency))
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"prefork ({args.processes} processes): {prefork_tps:10.1f} tasks/s")
+    print(f"asyncio (1 process, concurrency={args.concurrency}): {asyncio_tps:10.1f} tasks/s, "
+          f"max RSS {rss_mb:.1f} MB")
+    print(f"prefork processes needed to match asyncio: {asyncio_tps * args.latency:.0f}")
+
+
+if __name__ == "__main__":
+    main()
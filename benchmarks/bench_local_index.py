@@ -0,0 +1,74 @@
+"""
+本地知识索引基准测试
+
+按不同语料规模构建字符n-gram/BM25索引（合成的房产问答分块），
+测量构建耗时、索引文件大小，以及mmap加载后的单次查询延迟（p50/p95/max）。
+
+用法:
+    python -m benchmarks.bench_local_index --sizes 1000 10000 100000 --queries 500
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+from chatapp.utils.ngram_index import NGramIndex, build_index
+
+TOPICS = ["首付比例", "贷款年限", "学区划分", "地铁站点", "物业费用", "车位租售", "户型朝向", "交房时间",
+          "公积金贷款", "装修标准", "容积率", "绿化率", "商业配套", "医院距离", "契税", "产权年限"]
+FILLER = "本项目位于城市核心区域周边交通便利配套齐全适合家庭居住购房者可以预约现场看房了解详细信息价格优惠"
+QUESTIONS = ["首付多少", "贷款可以贷几年", "学区是哪个小学", "离地铁站远吗", "物业费怎么收",
+             "有没有车位", "户型朝南吗", "什么时候交房", "能用公积金吗", "是精装修吗"]
+
+
+def make_corpus(size: int, rng: random.Random) -> List[Dict[str, str]]:
+    corpus = []
+    for i in range(size):
+        topic = rng.choice(TOPICS)
+        start = rng.randrange(len(FILLER) - 30)
+        corpus.append({
+            "id": str(i),
+            "content": f"{topic}：{FILLER[start:start + rng.randint(20, 30)]}，{rng.choice(TOPICS)}详见销售中心",
+        })
+    return corpus
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local knowledge index benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'docs':>8}{'build s':>9}{'size KB':>10}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            path = os.path.join(tmp_dir, f"bench_{size}.idx")
+            started_at = time.perf_counter()
+            build_index(make_corpus(size, rng), path)
+            build_s = time.perf_counter() - started_at
+
+            index = NGramIndex(path)
+            index.search(QUESTIONS[0], args.top_k)  # 预热页缓存
+            latencies = []
+            for i in range(args.queries):
+                started_at = time.perf_counter()
+                index.search(QUESTIONS[i % len(QUESTIONS)], args.top_k)
+                latencies.append((time.perf_counter() - started_at) * 1000)
+            index.close()
+
+            print(f"{size:>8}{build_s:>9.2f}{os.path.getsize(path) / 1024:>10.0f}"
+                  f"{percentile(latencies, 50):>9.3f}{percentile(latencies, 95):>9.3f}{max(latencies):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Worker事件循环与长连接基准测试
+
+对比两种任务执行方式的单任务开销：
+    per-task   - 每个任务 asyncio.run + 新建 httpx.AsyncClient（原有方式）
+    persistent - WorkerLoop 长期事件循环 + 复用的长连接客户端
+
+上游使用本地 HTTP/1.1 keep-alive 服务模拟（每个任务发起两次请求，对应RAGFlow与OpenAI）。
+传入 --url 可改为对真实上游（如 https 端点）测试，此时还包含TLS握手开销。
+
+用法:
+    python -m benchmarks.bench_worker_loop --tasks 500
+"""
+import argparse
+import asyncio
+import threading
+import time
+import httpx
+
+from chatapp.utils.http_transport import HTTPTransport, UpstreamConfig
+from chatapp.workers.runtime import WorkerLoop
+
+RESPONSE = (b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            b"Content-Length: 11\r\nConnection: keep-alive\r\n\r\n{\"data\":[]}")
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            headers = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in headers.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            if length:
+                await reader.readexactly(length)
+            writer.write(RESPONSE)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+
+def start_local_server() -> str:
+    """在后台线程中启动本地上游服务，返回URL"""
+    ready = threading.Event()
+    address = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(asyncio.start_server(_handle, "127.0.0.1", 0))
+        address["port"] = server.sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{address['port']}"
+
+
+async def task_body(client: httpx.AsyncClient, url: str):
+    await client.post(f"{url}/api/v1/retrieval", json={"query": "首付比例"})
+    await client.post(f"{url}/chat/completions", json={"messages": []})
+
+
+def bench_per_task(url: str, tasks: int) -> float:
+    async def one():
+        async with httpx.AsyncClient() as client:
+            await task_body(client, url)
+
+    start = time.perf_counter()
+    for _ in range(tasks):
+        asyncio.run(one())
+    return (time.perf_counter() - start) / tasks * 1000
+
+
+def bench_persistent(url: str, tasks: int) -> float:
+    worker_loop = WorkerLoop(persistent=True)
+    transport = HTTPTransport(UpstreamConfig(
+        name="bench", connect_timeout=5, read_timeout=30,
+        max_connections=10, max_keepalive_connections=10
+    ))
+
+    async def one():
+        await transport.request("POST", f"{url}/api/v1/retrieval", json={"query": "首付比例"})
+        await transport.request("POST", f"{url}/chat/completions", json={"messages": []})
+
+    worker_loop.register_shutdown(transport.aclose)
+    worker_loop.run(one())  # 预热
+    start = time.perf_counter()
+    for _ in range(tasks):
+        worker_loop.run(one())
+    elapsed = (time.perf_counter() - start) / tasks * 1000
+    worker_loop.shutdown()
+    print(f"pooled transport stats: {transport.stats()}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker event loop benchmark")
+    parser.add_argument("--tasks", type=int, default=500)
+    parser.add_argument("--url", default=None, help="上游地址，默认使用本地模拟服务")
+    args = parser.parse_args()
+
+    url = args.url or start_local_server()
+    per_task = bench_per_task(url, args.tasks)
+    persistent = bench_persistent(url, args.tasks)
+
+    print(f"per-task loop + new client : {per_task:8.3f} ms/task")
+    print(f"persistent loop + pooled   : {persistent:8.3f} ms/task")
+    print(f"overhead saved             : {per_task - persistent:8.3f} ms/task")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+多节点WebSocket投递压测
+
+在一个进程内模拟N个Web节点（各自的ConnectionManager + NodeEventListener，共用同一个Redis），
+坐席随机连接到各节点，运行过程中一部分坐席重连到其他节点（--reconnect-gap秒后才连上），
+统计投递成功率与端到端延迟（p50/p95/max）。投递路径：
+    channel - worker按坐席发布事件，经登记表转发到坐席所在节点的频道（重连间隙内的事件丢失）
+    stream  - worker写入结果流，各节点的AgentResultConsumer以消费者组分摊读取并转发；
+              重连间隙内未送达的条目留在待确认列表，由认领（_claim_stale）重新投递，仍未送达时保存
+需要可用的Redis（REDIS_HOST/REDIS_PORT等配置）。
+
+用法:
+    python -m benchmarks.bench_ws_fanout --nodes 1 2 4 8 --agents 500 --messages 5000 --moves 0.1
+    python -m benchmarks.bench_ws_fanout --paths stream --reconnect-gap 0.5 --claim-idle-ms 1000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List, Set
+
+from chatapp.main import ConnectionManager
+from chatapp.services.connection_registry import ConnectionRegistry
+from chatapp.services.result_delivery import AgentResultConsumer, NodeEventListener, ResultPublisher
+from chatapp.utils.redis_client import close_async_redis, get_async_redis
+
+
+class FakeWebSocket:
+    """记录收到的压测事件"""
+
+    def __init__(self, received: Dict[int, float]):
+        self.received = received
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        event = json.loads(message)
+        self.received.setdefault(event["seq"], (time.perf_counter() - event["sent"]) * 1000)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed = True
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run(path: str, n_nodes: int, args: argparse.Namespace, rng: random.Random) -> Dict[str, float]:
+    run_id = f"bench-{int(time.time() * 1000)}"
+    stream_key = f"{run_id}:results"
+    managers = [ConnectionManager(ConnectionRegistry(node_id=f"{run_id}-{i}")) for i in range(n_nodes)]
+    listeners = [
+        NodeEventListener(manager.registry, manager.send_personal_message, manager.evict, manager.local_connections)
+        for manager in managers
+    ]
+    stored: Set[int] = set()
+
+    async def store(agent_id: str, customer_id: str, msg_id: str, result_data: Dict):
+        stored.add(result_data["seq"])
+
+    consumers = [
+        AgentResultConsumer(manager.deliver, stream_key, block_ms=100, group=f"{run_id}-group",
+                            consumer=manager.registry.node_id, claim_idle_ms=args.claim_idle_ms, store=store)
+        for manager in managers
+    ] if path == "stream" else []
+    for forwarder in listeners + consumers:
+        await forwarder.start()
+    await asyncio.sleep(0.2)  # 等待订阅及消费者组建立
+
+    agents = [f"{run_id}-agent-{i}" for i in range(args.agents)]
+    placement: Dict[str, int] = {}
+    conn_ids: Dict[str, str] = {}
+    received: Dict[int, float] = {}
+    for agent_id in agents:
+        placement[agent_id] = rng.randrange(n_nodes)
+        conn_ids[agent_id] = await managers[placement[agent_id]].connect(FakeWebSocket(received), agent_id)
+
+    worker_registry = ConnectionRegistry(node_id=f"{run_id}-worker")
+    publisher = ResultPublisher(stream_key if path == "stream" else None, worker_registry)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    moved: Set[str] = set()
+
+    async def publish(seq: int):
+        async with semaphore:
+            agent_id = rng.choice(agents)
+            if path == "stream":
+                await publisher.publish_result(agent_id, str(seq), {"seq": seq, "sent": time.perf_counter()},
+                                               customer_id="bench")
+            else:
+                await publisher.publish(agent_id, {"type": "bench", "seq": seq, "sent": time.perf_counter()})
+
+    async def move_agent(agent_id: str, target: int):
+        if args.reconnect_gap > 0:
+            # 断线后间隔一段时间才在其他节点重连
+            await managers[placement[agent_id]].disconnect(agent_id, conn_ids[agent_id])
+            await asyncio.sleep(args.reconnect_gap)
+        placement[agent_id] = target
+        conn_ids[agent_id] = await managers[target].connect(FakeWebSocket(received), agent_id)
+
+    async def move_agents():
+        # 一部分坐席重连到其他节点（旧节点上的连接被关闭）
+        await asyncio.sleep(0.05)
+        if n_nodes < 2:
+            return
+        moves = []
+        for agent_id in rng.sample(agents, int(len(agents) * args.moves)):
+            moved.add(agent_id)
+            moves.append(move_agent(agent_id, (placement[agent_id] + rng.randrange(1, n_nodes)) % n_nodes))
+        await asyncio.gather(*moves)
+
+    started_at = time.perf_counter()
+    mover = asyncio.ensure_future(move_agents())
+    await asyncio.gather(*(publish(seq) for seq in range(args.messages)))
+    publish_s = time.perf_counter() - started_at
+    await mover
+
+    deadline = time.monotonic() + args.drain_timeout
+    while len(received.keys() | stored) < args.messages and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+    for forwarder in listeners + consumers:
+        await forwarder.stop()
+    await get_async_redis().delete(stream_key,
+                                   *(managers[0].registry.get_owner_key(agent_id) for agent_id in agents))
+
+    latencies = list(received.values()) or [0.0]
+    return {
+        "delivered": len(received) / args.messages,
+        "stored": len(stored - received.keys()) / args.messages,
+        "throughput": args.messages / publish_s,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "max": max(latencies),
+        "moved": len(moved),
+        "evicted": sum(listener.evicted for listener in listeners),
+        "rerouted": sum(listener.rerouted for listener in listeners),
+        "reclaimed": sum(consumer.reclaimed for consumer in consumers),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Multi-node WebSocket fan-out benchmark")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--agents", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--paths", nargs="+", choices=["channel", "stream"], default=["channel", "stream"])
+    parser.add_argument("--moves", type=float, default=0.1, help="运行中重连到其他节点的坐席比例")
+    parser.add_argument("--reconnect-gap", type=float, default=0.0, help="断线到在其他节点重连之间的秒数")
+    parser.add_argument("--claim-idle-ms", type=int, default=1000, help="stream路径：未确认条目被认领前的空闲时长")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发发布数（需小于REDIS_MAX_CONNECTIONS减去节点数）")
+    parser.add_argument("--drain-timeout", type=float, default=5.0, help="stream路径需大于认领空闲时长")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'path':>8}{'nodes':>6}{'deliv %':>9}{'store %':>9}{'msg/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'max ms':>9}{'moved':>7}{'evict':>7}{'reroute':>9}{'reclaim':>9}")
+    for path in args.paths:
+        for n_nodes in args.nodes:
+            r = await run(path, n_nodes, args, rng)
+            print(f"{path:>8}{n_nodes:>6}{r['delivered'] * 100:>9.2f}{r['stored'] * 100:>9.2f}"
+                  f"{r['throughput']:>9.0f}{r['p50']:>9.2f}{r['p95']:>9.2f}{r['max']:>9.2f}"
+                  f"{r['moved']:>7}{r['evicted']:>7}{r['rerouted']:>9}{r['reclaimed']:>9}")
+    await close_async_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
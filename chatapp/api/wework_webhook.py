@@ -2,11 +2,15 @@
 
 from fastapi import APIRouter, Request, HTTPException, Query
 from fastapi.responses import PlainTextResponse
-from chatapp.config import Settings
-from chatapp.utils.wework_crypto import WeWorkOfficialCrypto
-from chatapp.utils.wework_message_parser import WeWorkMessageParser
+from chatapp.config import Settings, settings
+from chatapp.services.message_dedup import MessageDeduplicator
+from chatapp.utils.wework_crypto import WeWorkOfficialCrypto, decrypt_and_parse
+from chatapp.utils.cpu_offload import CPUOffloader, OffloadQueueFullError
+from chatapp.utils.metrics import metrics
 from chatapp.utils.logger import logger
 from chatapp.workers.ai_worker import process_message
+from chatapp.workers.dispatcher import CeleryBatchDispatcher
+from chatapp.workers.async_consumer import enqueue_message
 import time
 
 router = APIRouter()
@@ -14,6 +18,28 @@ router = APIRouter()
 # 初始化官方加密工具
 crypto = WeWorkOfficialCrypto()
 
+# 签名校验/解密/XML解析的CPU卸载执行器
+cpu_offloader = CPUOffloader(
+    mode=settings.CALLBACK_CPU_OFFLOAD_MODE,
+    max_workers=settings.CALLBACK_CPU_OFFLOAD_WORKERS,
+    max_pending=settings.CALLBACK_CPU_OFFLOAD_MAX_PENDING
+)
+metrics.register_provider("callback_cpu_offload", cpu_offloader.stats)
+
+# 重试回调去重
+deduplicator = MessageDeduplicator()
+metrics.register_provider("callback_dedup", deduplicator.stats)
+
+# Celery微批量派发（可选）
+batch_dispatcher = CeleryBatchDispatcher(
+    max_batch_size=settings.CELERY_BATCH_MAX_SIZE,
+    max_latency_ms=settings.CELERY_BATCH_MAX_LATENCY_MS,
+    publish_retries=settings.CELERY_BATCH_PUBLISH_RETRIES,
+    retry_backoff_ms=settings.CELERY_BATCH_RETRY_BACKOFF_MS
+) if settings.CELERY_BATCH_ENABLED else None
+if batch_dispatcher:
+    metrics.register_provider("celery_batch_dispatcher", batch_dispatcher.stats)
+
 
 @router.get("/wework/callback")
 async def verify_callback(
@@ -64,29 +90,47 @@ async def handle_message(
 
         logger.info(f"Received WeWork message: signature={msg_signature}, timestamp={timestamp}")
 
-        # 使用官方库解密消息
-        ret_code, decrypted_xml = crypto.decrypt_msg(msg_signature, timestamp, nonce, encrypted_xml)
+        # 签名校验、解密及解析（按配置卸载到线程池/进程池，避免阻塞事件循环）
+        try:
+            ret_code, message_data = await cpu_offloader.run(
+                decrypt_and_parse, msg_signature, timestamp, nonce, encrypted_xml
+            )
+        except OffloadQueueFullError as e:
+            logger.warning(f"WeWork callback rejected: {e}")
+            raise HTTPException(status_code=503, detail="Server busy")
 
         if ret_code != 0:
             logger.error(f"WeWork message decryption failed with code: {ret_code}")
             raise HTTPException(status_code=400, detail=f"Decryption failed: {ret_code}")
 
-        # 解析消息内容
-        message_data = WeWorkMessageParser.parse_message_xml(decrypted_xml)
-
         if not message_data:
             logger.error("Failed to parse WeWork message")
             raise HTTPException(status_code=400, detail="Message parsing failed")
 
-        # 添加时间戳
-        message_data["received_time"] = int(time.time())
+        # 企业微信重试投递的重复消息直接确认，不再入队
+        if await deduplicator.is_duplicate(message_data):
+            return PlainTextResponse("success")
+
+        # 添加时间戳（保留小数部分，用于毫秒级的截止时间与投递延迟统计）
+        message_data["received_time"] = time.time()
 
         # 快速响应企业微信 - 立即入队处理
         processing_time = (time.time() - start_time) * 1000
+        metrics.observe("callback.processing_ms", processing_time)
         logger.info(f"WeWork message processed in {processing_time:.2f}ms, queuing for AI processing")
 
-        # 异步处理消息 - 推送到Celery队列
-        process_message.delay(message_data)
+        # 异步处理消息 - 推送到Celery队列（或Redis任务流）
+        try:
+            if settings.TASK_BACKEND == "stream":
+                await enqueue_message(message_data)
+            elif batch_dispatcher:
+                # 等待所在批次发布到broker后再应答，发布失败时返回错误由企业微信重试
+                await batch_dispatcher.submit(message_data)
+            else:
+                process_message.delay(message_data)
+        except Exception:
+            await deduplicator.release(message_data)
+            raise
 
         # 立即返回成功响应
         return PlainTextResponse("success")
@@ -16,16 +16,103 @@ class Settings(BaseSettings):
                                 "")
  OPENAI_BASE_URL: str = os.getenv("BASEURL","https://api.openai.com/v1")
  OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-4o")
+ # 小模型层级（寒暄、短问题等简单请求）
+ OPENAI_SMALL_MODEL: str = os.getenv("OPENAI_SMALL_MODEL", "gpt-4o-mini")
+ # 流式生成：每条建议生成完成即推送给坐席
+ OPENAI_STREAM_ENABLED: bool = os.getenv("OPENAI_STREAM_ENABLED", "False").lower() == "true"
+ # 推测生成：知识检索超过期限时先用上下文生成并推送建议，知识返回后再替换
+ SPECULATIVE_GENERATION_ENABLED: bool = os.getenv("SPECULATIVE_GENERATION_ENABLED", "False").lower() == "true"
+ SPECULATIVE_RETRIEVAL_DEADLINE_MS: int = int(os.getenv("SPECULATIVE_RETRIEVAL_DEADLINE_MS", "800"))
+
+ # 结果投递（均由Web服务推送到坐席的WebSocket）：store（保存到ai_result键并经坐席频道推送，
+ # Web服务未订阅期间的推送会丢失）/ stream（写入结果流，Web服务重启后继续投递）
+ RESULT_DELIVERY_MODE: str = os.getenv("RESULT_DELIVERY_MODE", "store")
+ RESULT_STREAM_KEY: str = os.getenv("RESULT_STREAM_KEY", "ai_results")
+ RESULT_STREAM_MAXLEN: int = int(os.getenv("RESULT_STREAM_MAXLEN", "10000"))
+
+ # 多节点部署：坐席连接登记到Redis，消息经 node_events:{节点ID} 频道转发到坐席所在节点
+ CLUSTER_ENABLED: bool = os.getenv("CLUSTER_ENABLED", "False").lower() == "true"
+ NODE_ID: str = os.getenv("NODE_ID", "")  # 为空时使用 主机名-进程号
+ CLUSTER_OWNER_TTL_SECONDS: float = float(os.getenv("CLUSTER_OWNER_TTL_SECONDS", "60"))
+ RESULT_CONSUMER_GROUP: str = os.getenv("RESULT_CONSUMER_GROUP", "result_delivery")
+ # 结果流中空闲超过该时长的未确认条目（坐席未连接、节点崩溃或确认失败时遗留）由节点认领重新投递，
+ # 仍未送达时保存到ai_result键；即坐席断线重连的等待窗口
+ RESULT_CONSUMER_CLAIM_IDLE_MS: int = int(os.getenv("RESULT_CONSUMER_CLAIM_IDLE_MS", "30000"))
+ # 每千token单价（美元），用于估算缓存节省的费用
+ OPENAI_PROMPT_COST_PER_1K: float = float(os.getenv("OPENAI_PROMPT_COST_PER_1K", "0.0025"))
+ OPENAI_COMPLETION_COST_PER_1K: float = float(os.getenv("OPENAI_COMPLETION_COST_PER_1K", "0.01"))
+ OPENAI_SMALL_PROMPT_COST_PER_1K: float = float(os.getenv("OPENAI_SMALL_PROMPT_COST_PER_1K", "0.00015"))
+ OPENAI_SMALL_COMPLETION_COST_PER_1K: float = float(os.getenv("OPENAI_SMALL_COMPLETION_COST_PER_1K", "0.0006"))
+
+ # 模型路由：按问题长度、知识命中、上下文大小与坐席SLO选择模型层级
+ MODEL_ROUTER_ENABLED: bool = os.getenv("MODEL_ROUTER_ENABLED", "False").lower() == "true"
+ MODEL_ROUTER_SHORT_QUERY_CHARS: int = int(os.getenv("MODEL_ROUTER_SHORT_QUERY_CHARS", "8"))
+ MODEL_ROUTER_SMALL_MAX_CONTEXT_TOKENS: int = int(os.getenv("MODEL_ROUTER_SMALL_MAX_CONTEXT_TOKENS", "1500"))
+ # 坐席SLO：fast/balanced/quality，按坐席覆盖格式为 "agent1:fast,agent2:quality"
+ MODEL_ROUTER_DEFAULT_SLO: str = os.getenv("MODEL_ROUTER_DEFAULT_SLO", "balanced")
+ MODEL_ROUTER_AGENT_SLOS: str = os.getenv("MODEL_ROUTER_AGENT_SLOS", "")
+ # 集群共享的OpenAI限流（每分钟请求数/token数），取配额最多等待OPENAI_RATE_LIMIT_MAX_WAIT秒
+ OPENAI_RATE_LIMIT_ENABLED: bool = os.getenv("OPENAI_RATE_LIMIT_ENABLED", "False").lower() == "true"
+ OPENAI_RPM_LIMIT: int = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+ OPENAI_TPM_LIMIT: int = int(os.getenv("OPENAI_TPM_LIMIT", "300000"))
+ OPENAI_RATE_LIMIT_MAX_WAIT: float = float(os.getenv("OPENAI_RATE_LIMIT_MAX_WAIT", "5"))
+
+ # LLM生成结果缓存（按模型+提示词+temperature）
+ LLM_CACHE_ENABLED: bool = os.getenv("LLM_CACHE_ENABLED", "False").lower() == "true"
+ LLM_CACHE_TTL_SECONDS: int = int(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+ LLM_CACHE_LOCAL_SIZE: int = int(os.getenv("LLM_CACHE_LOCAL_SIZE", "2000"))
+ LLM_CACHE_LOCAL_TTL: int = int(os.getenv("LLM_CACHE_LOCAL_TTL", "600"))
+ LLM_CACHE_LOCAL_MAX_BYTES: int = int(os.getenv("LLM_CACHE_LOCAL_MAX_BYTES", str(16 * 1024 * 1024)))
+ # 不使用缓存的坐席ID（逗号分隔）
+ LLM_CACHE_OPTOUT_AGENTS: str = os.getenv("LLM_CACHE_OPTOUT_AGENTS", "")
 
  # RAGFlow 配置
  RAGFLOW_API_URL: str = os.getenv("RAGFLOW_API_URL", "http://localhost:9870")
  RAGFLOW_API_KEY: str = os.getenv("RAGFLOW_API_KEY", "ragflow-dmZjViNzU4NmU3ZTExZjA4ZmIxOGFlNG")
+ RAGFLOW_DATASET: str = os.getenv("RAGFLOW_DATASET", "real_estate")
+
+ # 知识检索结果缓存（进程内LRU + Redis），数据集重建索引后需调用失效
+ RAG_CACHE_ENABLED: bool = os.getenv("RAG_CACHE_ENABLED", "False").lower() == "true"
+ RAG_CACHE_TTL_SECONDS: int = int(os.getenv("RAG_CACHE_TTL_SECONDS", "3600"))
+ RAG_CACHE_LOCAL_SIZE: int = int(os.getenv("RAG_CACHE_LOCAL_SIZE", "1000"))
+ RAG_CACHE_LOCAL_TTL: int = int(os.getenv("RAG_CACHE_LOCAL_TTL", "300"))
+ RAG_CACHE_VERSION_CHECK_SECONDS: float = float(os.getenv("RAG_CACHE_VERSION_CHECK_SECONDS", "5"))
+
+ # 单飞：合并并发的相同检索/生成请求（distributed时跨worker，通过Redis锁+频道共享结果）
+ SINGLE_FLIGHT_ENABLED: bool = os.getenv("SINGLE_FLIGHT_ENABLED", "False").lower() == "true"
+ SINGLE_FLIGHT_DISTRIBUTED: bool = os.getenv("SINGLE_FLIGHT_DISTRIBUTED", "True").lower() == "true"
+ SINGLE_FLIGHT_LOCK_TTL_MS: int = int(os.getenv("SINGLE_FLIGHT_LOCK_TTL_MS", "40000"))
+ SINGLE_FLIGHT_WAIT_TIMEOUT: float = float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", "45"))
+
+ # 本地知识索引（由数据集导出构建，python -m chatapp.utils.ngram_index） off/fallback/fast_path
+ LOCAL_INDEX_MODE: str = os.getenv("LOCAL_INDEX_MODE", "off")
+ LOCAL_INDEX_PATH: str = os.getenv("LOCAL_INDEX_PATH", "data/real_estate.idx")
+ LOCAL_INDEX_MIN_CONFIDENCE: float = float(os.getenv("LOCAL_INDEX_MIN_CONFIDENCE", "0.4"))
+
+ # 上游弹性策略：消息截止时间（自received_time起）、单次调用超时、对冲请求、熔断
+ RESILIENCE_ENABLED: bool = os.getenv("RESILIENCE_ENABLED", "False").lower() == "true"
+ MESSAGE_DEADLINE_SECONDS: float = float(os.getenv("MESSAGE_DEADLINE_SECONDS", "45"))
+ MESSAGE_DEADLINE_MIN_SECONDS: float = float(os.getenv("MESSAGE_DEADLINE_MIN_SECONDS", "10"))
+ OPENAI_CALL_TIMEOUT: float = float(os.getenv("OPENAI_CALL_TIMEOUT", "30"))
+ RAGFLOW_CALL_TIMEOUT: float = float(os.getenv("RAGFLOW_CALL_TIMEOUT", "8"))
+ OPENAI_HEDGE_ENABLED: bool = os.getenv("OPENAI_HEDGE_ENABLED", "False").lower() == "true"
+ RAGFLOW_HEDGE_ENABLED: bool = os.getenv("RAGFLOW_HEDGE_ENABLED", "True").lower() == "true"
+ HEDGE_PERCENTILE: float = float(os.getenv("HEDGE_PERCENTILE", "95"))
+ HEDGE_MIN_DELAY_MS: float = float(os.getenv("HEDGE_MIN_DELAY_MS", "200"))
+ BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+ BREAKER_RECOVERY_SECONDS: float = float(os.getenv("BREAKER_RECOVERY_SECONDS", "30"))
 
  # Redis 配置
  REDIS_HOST: str = os.getenv("REDIS_HOST", "localhost")
  REDIS_PORT: int = int(os.getenv("REDIS_PORT", "6379"))
  REDIS_PASSWORD: Optional[str] = os.getenv("REDIS_PASSWORD","root123")
  REDIS_DB: int = int(os.getenv("REDIS_DB", "0"))
+ REDIS_MAX_CONNECTIONS: int = int(os.getenv("REDIS_MAX_CONNECTIONS", "100"))
+ # 连接池用满时等待空闲连接的秒数，超时后才报错
+ REDIS_POOL_TIMEOUT: float = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+ # 会话上下文/AI结果的编码 json/msgpack/compact，超过阈值字节的值zstd压缩（0为不压缩）
+ REDIS_CODEC: str = os.getenv("REDIS_CODEC", "json")
+ REDIS_CODEC_COMPRESS_THRESHOLD: int = int(os.getenv("REDIS_CODEC_COMPRESS_THRESHOLD", "0"))
 
  # Celery 配置
  CELERY_BROKER_URL: str = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
@@ -38,6 +125,79 @@ class Settings(BaseSettings):
  POSTGRES_USER: str = os.getenv("MYSQL_USER", "root")
  POSTGRES_PASSWORD: str = os.getenv("MYSQLPASSWORD", "Qkz12136")
 
+ # 回调CPU卸载配置 inline/thread/process
+ CALLBACK_CPU_OFFLOAD_MODE: str = os.getenv("CALLBACK_CPU_OFFLOAD_MODE", "thread")
+ CALLBACK_CPU_OFFLOAD_WORKERS: int = int(os.getenv("CALLBACK_CPU_OFFLOAD_WORKERS", "4"))
+ CALLBACK_CPU_OFFLOAD_MAX_PENDING: int = int(os.getenv("CALLBACK_CPU_OFFLOAD_MAX_PENDING", "256"))
+
+ # 回调去重配置
+ DEDUP_TTL_SECONDS: int = int(os.getenv("DEDUP_TTL_SECONDS", "600"))
+ DEDUP_LOCAL_CACHE_SIZE: int = int(os.getenv("DEDUP_LOCAL_CACHE_SIZE", "10000"))
+
+ # Celery微批量派发配置
+ CELERY_BATCH_ENABLED: bool = os.getenv("CELERY_BATCH_ENABLED", "False").lower() == "true"
+ CELERY_BATCH_MAX_SIZE: int = int(os.getenv("CELERY_BATCH_MAX_SIZE", "50"))
+ CELERY_BATCH_MAX_LATENCY_MS: int = int(os.getenv("CELERY_BATCH_MAX_LATENCY_MS", "10"))
+ # 发布失败时的重试次数与初始退避，重试耗尽后回调返回错误，由企业微信重试
+ CELERY_BATCH_PUBLISH_RETRIES: int = int(os.getenv("CELERY_BATCH_PUBLISH_RETRIES", "3"))
+ CELERY_BATCH_RETRY_BACKOFF_MS: int = int(os.getenv("CELERY_BATCH_RETRY_BACKOFF_MS", "100"))
+
+ # 会话消息合并配置
+ COALESCE_ENABLED: bool = os.getenv("COALESCE_ENABLED", "False").lower() == "true"
+ COALESCE_QUIET_WINDOW_MS: int = int(os.getenv("COALESCE_QUIET_WINDOW_MS", "1500"))
+
+ # Worker运行时配置
+ WORKER_PERSISTENT_LOOP: bool = os.getenv("WORKER_PERSISTENT_LOOP", "True").lower() == "true"
+
+ # HTTP传输层配置（按上游划分连接池，超时单位秒）
+ HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+ HTTP_POOL_TIMEOUT: float = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
+ OPENAI_HTTP2: bool = os.getenv("OPENAI_HTTP2", "False").lower() == "true"
+ OPENAI_CONNECT_TIMEOUT: float = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+ OPENAI_READ_TIMEOUT: float = float(os.getenv("OPENAI_READ_TIMEOUT", "60"))
+ OPENAI_MAX_CONNECTIONS: int = int(os.getenv("OPENAI_MAX_CONNECTIONS", "50"))
+ OPENAI_MAX_KEEPALIVE: int = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+ RAGFLOW_HTTP2: bool = os.getenv("RAGFLOW_HTTP2", "False").lower() == "true"
+ RAGFLOW_CONNECT_TIMEOUT: float = float(os.getenv("RAGFLOW_CONNECT_TIMEOUT", "5"))
+ RAGFLOW_READ_TIMEOUT: float = float(os.getenv("RAGFLOW_READ_TIMEOUT", "30"))
+ RAGFLOW_MAX_CONNECTIONS: int = int(os.getenv("RAGFLOW_MAX_CONNECTIONS", "50"))
+ RAGFLOW_MAX_KEEPALIVE: int = int(os.getenv("RAGFLOW_MAX_KEEPALIVE", "20"))
+ WEWORK_HTTP2: bool = os.getenv("WEWORK_HTTP2", "False").lower() == "true"
+ WEWORK_CONNECT_TIMEOUT: float = float(os.getenv("WEWORK_CONNECT_TIMEOUT", "5"))
+ WEWORK_READ_TIMEOUT: float = float(os.getenv("WEWORK_READ_TIMEOUT", "30"))
+ WEWORK_MAX_CONNECTIONS: int = int(os.getenv("WEWORK_MAX_CONNECTIONS", "20"))
+ WEWORK_MAX_KEEPALIVE: int = int(os.getenv("WEWORK_MAX_KEEPALIVE", "10"))
+
+ # 任务队列后端 celery/stream（stream需运行 chatapp.workers.async_consumer）
+ TASK_BACKEND: str = os.getenv("TASK_BACKEND", "celery")
+ STREAM_TASK_KEY: str = os.getenv("STREAM_TASK_KEY", "ai_tasks")
+ STREAM_TASK_MAXLEN: int = int(os.getenv("STREAM_TASK_MAXLEN", "100000"))
+ STREAM_CONSUMER_GROUP: str = os.getenv("STREAM_CONSUMER_GROUP", "ai_workers")
+ STREAM_CONSUMER_CONCURRENCY: int = int(os.getenv("STREAM_CONSUMER_CONCURRENCY", "200"))
+ STREAM_VISIBILITY_TIMEOUT_MS: int = int(os.getenv("STREAM_VISIBILITY_TIMEOUT_MS", "300000"))
+ STREAM_MAX_RETRIES: int = int(os.getenv("STREAM_MAX_RETRIES", "3"))
+
+ # 阶段检查点配置
+ CHECKPOINT_TTL_SECONDS: int = int(os.getenv("CHECKPOINT_TTL_SECONDS", "3600"))
+
+ # 会话存储配置 string/list
+ SESSION_STORAGE_MODE: str = os.getenv("SESSION_STORAGE_MODE", "string")
+
+ # 会话上下文L1缓存（进程内，依赖Redis键空间通知保持一致；需在Redis中配置 notify-keyspace-events 包含 Kg$lxe）
+ SESSION_CACHE_ENABLED: bool = os.getenv("SESSION_CACHE_ENABLED", "False").lower() == "true"
+ SESSION_CACHE_MAX_ENTRIES: int = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "5000"))
+ SESSION_CACHE_TTL_SECONDS: int = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "60"))
+ SESSION_CACHE_MAX_BYTES: int = int(os.getenv("SESSION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+ # 上下文压缩：超出token预算的较早对话折叠为后台生成的滚动摘要
+ CONTEXT_COMPACTION_ENABLED: bool = os.getenv("CONTEXT_COMPACTION_ENABLED", "False").lower() == "true"
+ CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+ CONTEXT_RECENT_MAX_TURNS: int = int(os.getenv("CONTEXT_RECENT_MAX_TURNS", "5"))
+ CONTEXT_SUMMARY_MAX_TOKENS: int = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "300"))
+
+ # worker进程指标推送周期（秒），Web服务的/metrics合并各进程的快照；0为不推送
+ METRICS_PUSH_INTERVAL: float = float(os.getenv("METRICS_PUSH_INTERVAL", "10"))
+
  # 应用配置
  DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
  LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
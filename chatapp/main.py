@@ -2,12 +2,21 @@
 # ============================================================================
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from chatapp.api.wework_webhook import router as wework_router
+from chatapp.api.wework_webhook import router as wework_router, cpu_offloader, batch_dispatcher
 from chatapp.config import settings
+from chatapp.services.connection_registry import ConnectionRegistry
+from chatapp.services.result_delivery import AgentEventForwarder, AgentResultConsumer, NodeEventListener
+from chatapp.services.session_manager import AsyncSessionManager
 from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.metrics_export import collect_process_metrics
+from chatapp.utils.http_transport import close_all_transports, transport_stats
+from chatapp.utils.redis_client import close_async_redis
+from chatapp.utils.resilience import resilience_stats
 import json
 import asyncio
-from typing import Dict, Set
+import uuid
+from typing import Dict, Optional, Set
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -28,22 +37,75 @@ app.add_middleware(
 
 # WebSocket连接管理
 class ConnectionManager:
-    def __init__(self):
+    """
+    本节点上的坐席连接
+
+    集群模式（传入registry）下连接登记到共享的登记表，deliver()可将消息转发到其他节点上的坐席；
+    坐席在其他节点重连时，本节点上的旧连接会被关闭
+    """
+
+    def __init__(self, registry: Optional[ConnectionRegistry] = None):
+        self.registry = registry
         self.active_connections: Dict[str, WebSocket] = {}
+        self.connection_ids: Dict[str, str] = {}  # agent_id -> 当前连接的ID
         self.agent_sessions: Dict[str, Set[str]] = {}  # agent_id -> set of session_ids
 
-    async def connect(self, websocket: WebSocket, agent_id: str):
+    async def connect(self, websocket: WebSocket, agent_id: str) -> str:
         await websocket.accept()
+        conn_id = uuid.uuid4().hex
+        superseded = self.active_connections.get(agent_id)
         self.active_connections[agent_id] = websocket
+        self.connection_ids[agent_id] = conn_id
         logger.info(f"WebSocket connected for agent: {agent_id}")
 
-    def disconnect(self, agent_id: str):
+        # 同一坐席在本节点重连：关闭被取代的旧连接（其断开时按连接ID判断，不影响新连接）
+        if superseded is not None and superseded is not websocket:
+            try:
+                await superseded.close(code=4000, reason="reconnected")
+            except Exception:
+                pass
+            logger.info(f"Closed superseded connection of agent: {agent_id}")
+
+        if self.registry:
+            try:
+                previous = await self.registry.register(agent_id, conn_id)
+                if previous and previous[0] != self.registry.node_id:
+                    logger.info(f"Agent {agent_id} moved from node {previous[0]}")
+                    await self.registry.evict(previous[0], agent_id, previous[1])
+            except Exception as e:
+                logger.error(f"Error registering connection of agent {agent_id}: {e}")
+        return conn_id
+
+    async def disconnect(self, agent_id: str, conn_id: Optional[str] = None):
+        # 同一坐席已建立新连接时，旧连接断开不影响新连接
+        if conn_id is not None and self.connection_ids.get(agent_id) != conn_id:
+            return
+        conn_id = self.connection_ids.pop(agent_id, conn_id)
         if agent_id in self.active_connections:
             del self.active_connections[agent_id]
         if agent_id in self.agent_sessions:
             del self.agent_sessions[agent_id]
+        if self.registry and conn_id:
+            await self.registry.unregister(agent_id, conn_id)
         logger.info(f"WebSocket disconnected for agent: {agent_id}")
 
+    async def evict(self, agent_id: str, conn_id: str):
+        """坐席已在其他节点重连：关闭本节点上的旧连接（不删除新的登记）"""
+        if self.connection_ids.get(agent_id) != conn_id:
+            return
+        websocket = self.active_connections.pop(agent_id, None)
+        self.connection_ids.pop(agent_id, None)
+        self.agent_sessions.pop(agent_id, None)
+        if websocket is not None:
+            try:
+                await websocket.close(code=4000, reason="reconnected on another node")
+            except Exception:
+                pass
+        logger.info(f"Closed superseded connection of agent: {agent_id}")
+
+    def local_connections(self) -> Dict[str, str]:
+        return dict(self.connection_ids)
+
     async def send_personal_message(self, message: str, agent_id: str):
         if agent_id in self.active_connections:
             try:
@@ -54,8 +116,37 @@ class ConnectionManager:
                 return False
         return False
 
-
-manager = ConnectionManager()
+    async def deliver(self, message: str, agent_id: str) -> bool:
+        """投递给坐席：连接在本节点时直接发送，否则转发到其所在节点"""
+        if agent_id in self.active_connections or not self.registry:
+            return await self.send_personal_message(message, agent_id)
+        return await self.registry.route(agent_id, message)
+
+
+registry = ConnectionRegistry() if settings.CLUSTER_ENABLED else None
+manager = ConnectionManager(registry)
+# 集群模式：worker将事件直接转发到坐席所在节点的频道，由本节点的监听器投递
+node_listener = NodeEventListener(registry, manager.send_personal_message, manager.evict,
+                                  manager.local_connections) if registry else None
+# 单节点：将worker发布的建议/结果事件转发到坐席的WebSocket
+event_forwarder = AgentEventForwarder(manager.send_personal_message) if not registry else None
+# 读取结果流，将完整结果推送到坐席的WebSocket（集群模式下各节点以消费者组分摊）
+# 坐席未连接时结果保存到ai_result键，与store模式一致
+result_consumer = AgentResultConsumer(
+    manager.deliver, settings.RESULT_STREAM_KEY,
+    group=settings.RESULT_CONSUMER_GROUP if registry else None,
+    consumer=registry.node_id if registry else None,
+    claim_idle_ms=settings.RESULT_CONSUMER_CLAIM_IDLE_MS,
+    store=AsyncSessionManager().store_result
+) if settings.RESULT_DELIVERY_MODE == "stream" else None
+metrics.register_provider("http_transports", transport_stats)
+metrics.register_provider("resilience", resilience_stats)
+if event_forwarder:
+    metrics.register_provider("agent_events", event_forwarder.stats)
+if result_consumer:
+    metrics.register_provider("result_delivery", result_consumer.stats)
+if node_listener:
+    metrics.register_provider("cluster", node_listener.stats)
 
 # 注册路由
 app.include_router(wework_router, prefix="/api/v1")
@@ -71,10 +162,22 @@ async def health_check():
     }
 
 
+@app.get("/metrics")
+async def metrics_snapshot():
+    """运行指标接口（本进程指标，及worker进程推送的指标）"""
+    data = metrics.snapshot()
+    if settings.METRICS_PUSH_INTERVAL > 0:
+        try:
+            data["workers"] = await collect_process_metrics()
+        except Exception as e:
+            data["workers"] = {"error": str(e)}
+    return data
+
+
 @app.websocket("/ws/{agent_id}")
 async def websocket_endpoint(websocket: WebSocket, agent_id: str):
     """WebSocket连接端点"""
-    await manager.connect(websocket, agent_id)
+    conn_id = await manager.connect(websocket, agent_id)
 
     try:
         while True:
@@ -93,12 +196,20 @@ async def websocket_endpoint(websocket: WebSocket, agent_id: str):
                 if message_type == "feedback":
                     # 处理客服对AI建议的反馈
                     logger.info(f"Received feedback from agent {agent_id}: {message_data}")
+                    # 统计缓存建议的采纳情况（前端回传结果中的cached标记与used）
+                    if message_data.get("cached"):
+                        metrics.incr("llm_cache.feedback.used" if message_data.get("used")
+                                     else "llm_cache.feedback.ignored")
+                    # 统计推测建议与知识增强建议的采纳情况
+                    if message_data.get("variant") in ("speculative", "grounded"):
+                        metrics.incr(f"speculation.feedback.{message_data['variant']}."
+                                     f"{'used' if message_data.get('used') else 'ignored'}")
 
             except json.JSONDecodeError:
                 logger.warning(f"Invalid JSON received from agent {agent_id}: {data}")
 
     except WebSocketDisconnect:
-        manager.disconnect(agent_id)
+        await manager.disconnect(agent_id, conn_id)
 
 
 @app.on_event("startup")
@@ -108,9 +219,29 @@ async def startup_event():
 
     # 这里可以添加启动时的初始化逻辑
     # 比如检查外部服务连接等
+    if batch_dispatcher:
+        await batch_dispatcher.start()
+    if node_listener:
+        await node_listener.start()
+    if event_forwarder:
+        await event_forwarder.start()
+    if result_consumer:
+        await result_consumer.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭事件"""
-    logger.info("WeWork AI Assistant shutting down...")
\ No newline at end of file
+    logger.info("WeWork AI Assistant shutting down...")
+
+    if batch_dispatcher:
+        await batch_dispatcher.stop()
+    if node_listener:
+        await node_listener.stop()
+    if event_forwarder:
+        await event_forwarder.stop()
+    if result_consumer:
+        await result_consumer.stop()
+    cpu_offloader.shutdown()
+    await close_all_transports()
+    await close_async_redis()
\ No newline at end of file
@@ -0,0 +1,76 @@
+from typing import Any, Dict, Optional
+from chatapp.config import settings
+from chatapp.utils.codec import get_codec
+from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.redis_client import get_async_redis
+
+
+class StageCheckpoint:
+    """单条消息的阶段检查点（已完成阶段的结果）"""
+
+    def __init__(self, store: "StageCheckpointStore", msg_id: str, data: Dict[str, Any]):
+        self.store = store
+        self.msg_id = msg_id
+        self.data = data
+
+    def has(self, stage: str) -> bool:
+        return stage in self.data
+
+    def get(self, stage: str, default: Any = None) -> Any:
+        return self.data.get(stage, default)
+
+    async def save(self, stage: str, value: Any):
+        """保存阶段结果；写入失败只记录日志，不影响主流程"""
+        self.data[stage] = value
+        await self.store.save(self.msg_id, stage, value)
+
+
+class StageCheckpointStore:
+    """按msg_id保存流水线阶段检查点，使重试从第一个未完成的阶段继续"""
+
+    def __init__(self):
+        self.expire = settings.CHECKPOINT_TTL_SECONDS
+        self.codec = get_codec()
+
+    def get_checkpoint_key(self, msg_id: str) -> str:
+        return f"checkpoint:{msg_id}"
+
+    async def load(self, msg_id: Optional[str]) -> Optional[StageCheckpoint]:
+        """读取消息的检查点，没有msg_id时返回None（不启用检查点）"""
+        if not msg_id:
+            return None
+
+        try:
+            raw = await get_async_redis(binary=self.codec.binary).hgetall(self.get_checkpoint_key(msg_id))
+        except Exception as e:
+            logger.error(f"Error loading checkpoint for message {msg_id}: {e}")
+            raw = {}
+
+        data = {
+            stage.decode("utf-8") if isinstance(stage, bytes) else stage: self.codec.decode(value)
+            for stage, value in raw.items()
+        }
+        if data:
+            metrics.incr("checkpoint.resumed")
+            logger.info(f"Resuming message {msg_id} from checkpoint, completed stages: {list(data)}")
+        return StageCheckpoint(self, msg_id, data)
+
+    async def save(self, msg_id: str, stage: str, value: Any):
+        checkpoint_key = self.get_checkpoint_key(msg_id)
+        try:
+            async with get_async_redis(binary=self.codec.binary).pipeline(transaction=True) as pipe:
+                pipe.hset(checkpoint_key, stage, self.codec.encode(value))
+                pipe.expire(checkpoint_key, self.expire)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error saving checkpoint {stage} for message {msg_id}: {e}")
+
+    async def clear(self, msg_id: Optional[str]):
+        """消息处理完成后删除检查点"""
+        if not msg_id:
+            return
+        try:
+            await get_async_redis().delete(self.get_checkpoint_key(msg_id))
+        except Exception as e:
+            logger.error(f"Error clearing checkpoint for message {msg_id}: {e}")
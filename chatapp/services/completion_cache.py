@@ -0,0 +1,109 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+from chatapp.config import settings
+from chatapp.services.model_router import estimate_cost
+from chatapp.utils.codec import get_codec
+from chatapp.utils.logger import logger
+from chatapp.utils.lru_cache import LRUCache
+from chatapp.utils.metrics import metrics
+from chatapp.utils.redis_client import get_async_redis
+
+
+def _entry_size(entry: Dict[str, Any]) -> int:
+    """估算缓存条目占用的内存字节数"""
+    return 256 + sum(64 + 4 * len(suggestion) for suggestion in entry.get("suggestions", []))
+
+
+class CompletionCache:
+    """
+    LLM生成结果缓存：进程内LRU（按字节上限淘汰）+ Redis（带TTL）
+
+    键为 (模型, 提示词, temperature) 的哈希，提示词逐字节相同才会命中；
+    条目中保存生成时的token用量，命中时按单价累计节省的费用（llm_cache.cost_avoided_usd）
+    """
+
+    def __init__(self):
+        self.ttl = settings.LLM_CACHE_TTL_SECONDS
+        self.local_cache = LRUCache(
+            max_entries=settings.LLM_CACHE_LOCAL_SIZE,
+            ttl=settings.LLM_CACHE_LOCAL_TTL,
+            max_bytes=settings.LLM_CACHE_LOCAL_MAX_BYTES,
+            sizeof=_entry_size
+        )
+        self.optout_agents = {
+            agent.strip() for agent in settings.LLM_CACHE_OPTOUT_AGENTS.split(",") if agent.strip()
+        }
+        self.codec = get_codec()
+        self.hits_local = 0
+        self.hits_redis = 0
+        self.misses = 0
+        self.cost_avoided = 0.0
+
+    @staticmethod
+    def get_cache_key(model: str, prompt: str, temperature: float) -> str:
+        digest = hashlib.sha256(
+            json.dumps([model, prompt, temperature], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        return f"llm_cache:{digest}"
+
+    def enabled_for(self, agent_id: Optional[str]) -> bool:
+        """坐席可通过 LLM_CACHE_OPTOUT_AGENTS 关闭缓存（每次都重新生成）"""
+        return agent_id not in self.optout_agents
+
+    async def get(self, model: str, prompt: str, temperature: float) -> Optional[Dict[str, Any]]:
+        """读取缓存条目 {"suggestions", "usage", "tier"}，未命中返回None；Redis不可用时视为未命中"""
+        cache_key = self.get_cache_key(model, prompt, temperature)
+        entry = self.local_cache.get(cache_key)
+        if entry is not None:
+            self.hits_local += 1
+            self._record_hit("local", model, entry)
+            return {**entry, "tier": "local"}
+
+        try:
+            raw = await get_async_redis(binary=self.codec.binary).get(cache_key)
+        except Exception as e:
+            logger.error(f"Error reading completion cache: {e}")
+            return None
+
+        if raw is None:
+            self.misses += 1
+            metrics.incr("llm_cache.miss")
+            return None
+
+        entry = self.codec.decode(raw)
+        self.local_cache.set(cache_key, entry)
+        self.hits_redis += 1
+        self._record_hit("redis", model, entry)
+        return {**entry, "tier": "redis"}
+
+    async def set(self, model: str, prompt: str, temperature: float, suggestions: List[str],
+                  usage: Dict[str, int]):
+        """写入缓存（只缓存非空结果）"""
+        if not suggestions:
+            return
+        cache_key = self.get_cache_key(model, prompt, temperature)
+        entry = {"suggestions": suggestions, "usage": usage}
+        self.local_cache.set(cache_key, entry)
+        try:
+            await get_async_redis(binary=self.codec.binary).set(cache_key, self.codec.encode(entry), ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Error writing completion cache: {e}")
+
+    def _record_hit(self, tier: str, model: str, entry: Dict[str, Any]):
+        cost = estimate_cost(model, entry.get("usage") or {})
+        self.cost_avoided += cost
+        metrics.incr(f"llm_cache.hit.{tier}")
+        metrics.incr("llm_cache.cost_avoided_usd", cost)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits_local + self.hits_redis + self.misses
+        return {
+            "hits_local": self.hits_local,
+            "hits_redis": self.hits_redis,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits_local + self.hits_redis) / total, 4) if total else 0.0,
+            "cost_avoided_usd": round(self.cost_avoided, 4),
+            "optout_agents": len(self.optout_agents),
+            "local": self.local_cache.stats(),
+        }
@@ -0,0 +1,136 @@
+import json
+import os
+import socket
+from typing import Any, Dict, Optional, Tuple
+from chatapp.config import settings
+from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.redis_client import get_async_redis
+
+NODE_CHANNEL_PREFIX = "node_events:"
+
+# 登记坐席连接，返回之前的所有者（可能在其他节点上）
+_REGISTER_SCRIPT = """
+local previous = redis.call('GET', KEYS[1])
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return previous
+"""
+
+# 仅当仍由该连接持有时删除/续期（坐席已在其他节点重连时不覆盖新的登记）
+_UNREGISTER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_REFRESH_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def default_node_id() -> str:
+    return settings.NODE_ID or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class ConnectionRegistry:
+    """
+    集群共享的坐席连接登记表：ws_owner:{agent_id} -> "{node_id}|{conn_id}"
+
+    - 坐席连接时登记为本节点所有；若之前连接在其他节点，通知旧节点关闭旧连接
+    - 登记带TTL，由所有者节点定期续期，节点宕机后自动失效
+    - route()查找所有者节点，通过节点频道 node_events:{node_id} 转发消息
+    """
+
+    def __init__(self, node_id: Optional[str] = None, owner_ttl: Optional[float] = None):
+        self.node_id = node_id or default_node_id()
+        self.owner_ttl_ms = int((owner_ttl or settings.CLUSTER_OWNER_TTL_SECONDS) * 1000)
+        self.routed = 0
+        self.offline = 0
+
+    def get_owner_key(self, agent_id: str) -> str:
+        return f"ws_owner:{agent_id}"
+
+    def get_node_channel(self, node_id: str) -> str:
+        return f"{NODE_CHANNEL_PREFIX}{node_id}"
+
+    def _owner_value(self, conn_id: str) -> str:
+        return f"{self.node_id}|{conn_id}"
+
+    async def register(self, agent_id: str, conn_id: str) -> Optional[Tuple[str, str]]:
+        """登记本节点上的连接，返回之前的 (node_id, conn_id)"""
+        previous = await get_async_redis().eval(
+            _REGISTER_SCRIPT, 1, self.get_owner_key(agent_id), self._owner_value(conn_id), self.owner_ttl_ms
+        )
+        if not previous:
+            return None
+        node_id, _, previous_conn = previous.rpartition("|")
+        return node_id, previous_conn
+
+    async def unregister(self, agent_id: str, conn_id: str):
+        try:
+            await get_async_redis().eval(
+                _UNREGISTER_SCRIPT, 1, self.get_owner_key(agent_id), self._owner_value(conn_id)
+            )
+        except Exception as e:
+            logger.error(f"Error unregistering connection of agent {agent_id}: {e}")
+
+    async def refresh(self, connections: Dict[str, str]):
+        """为本节点上的连接续期（agent_id -> conn_id）"""
+        if not connections:
+            return
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            for agent_id, conn_id in connections.items():
+                pipe.eval(_REFRESH_SCRIPT, 1, self.get_owner_key(agent_id), self._owner_value(conn_id),
+                          self.owner_ttl_ms)
+            await pipe.execute()
+
+    async def lookup(self, agent_id: str) -> Optional[str]:
+        """坐席当前连接所在的节点，未连接时返回None"""
+        owner = await get_async_redis().get(self.get_owner_key(agent_id))
+        return owner.rpartition("|")[0] if owner else None
+
+    async def publish_to_node(self, node_id: str, event: Dict[str, Any]) -> int:
+        return await get_async_redis().publish(self.get_node_channel(node_id), json.dumps(event, ensure_ascii=False))
+
+    async def route(self, agent_id: str, data: str, hops: int = 0) -> bool:
+        """
+        将消息转发到坐席所在的节点，返回是否有节点接收
+
+        hops>0表示已由其他节点转发过一次，不再转发回本节点，避免循环
+        """
+        try:
+            node_id = await self.lookup(agent_id)
+            if node_id is None or (hops and node_id == self.node_id):
+                self.offline += 1
+                metrics.incr("cluster.route.offline")
+                return False
+            received = await self.publish_to_node(
+                node_id, {"type": "deliver", "agent_id": agent_id, "data": data, "hops": hops}
+            )
+        except Exception as e:
+            logger.error(f"Error routing message to agent {agent_id}: {e}")
+            return False
+
+        if received:
+            self.routed += 1
+            metrics.incr("cluster.route.routed")
+        return received > 0
+
+    async def evict(self, node_id: str, agent_id: str, conn_id: str):
+        """通知旧节点关闭坐席已被取代的连接"""
+        try:
+            await self.publish_to_node(node_id, {"type": "evict", "agent_id": agent_id, "conn_id": conn_id})
+            metrics.incr("cluster.evictions_sent")
+        except Exception as e:
+            logger.error(f"Error evicting connection of agent {agent_id} on node {node_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "node_id": self.node_id,
+            "routed": self.routed,
+            "offline": self.offline,
+        }
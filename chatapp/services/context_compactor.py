@@ -0,0 +1,123 @@
+from typing import Any, Dict, List, Optional
+from chatapp.config import settings
+from chatapp.services.openai_service import OpenAIService
+from chatapp.services.session_manager import AsyncSessionManager
+from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.redis_client import get_async_redis
+from chatapp.utils.tokens import (
+    MESSAGE_OVERHEAD_TOKENS, estimate_context_tokens, estimate_message_tokens, estimate_tokens, truncate_to_tokens
+)
+
+
+class CompactedContext:
+    """压缩后的提示词上下文"""
+
+    def __init__(self, recent: List[Dict[str, Any]], summary: Optional[str], pending: List[Dict[str, Any]],
+                 tokens: int, raw_tokens: int):
+        self.recent = recent  # 放入提示词的最近几轮原文
+        self.summary = summary  # 较早对话的摘要
+        self.pending = pending  # 已移出窗口但尚未并入摘要的消息
+        self.tokens = tokens
+        self.raw_tokens = raw_tokens
+
+
+class ContextCompactor:
+    """
+    按token预算压缩会话上下文
+
+    提示词 = 滚动摘要 + 预算内的最近几轮原文；移出窗口的较早消息由后台任务
+    增量合并进摘要（session:{agent}:{customer}:summary，记录已覆盖到的消息时间戳），
+    请求路径上只读取摘要，从不调用摘要生成
+    """
+
+    def __init__(self, session_manager: AsyncSessionManager):
+        self.session_manager = session_manager
+        self.token_budget = settings.CONTEXT_TOKEN_BUDGET
+        self.max_recent_turns = settings.CONTEXT_RECENT_MAX_TURNS
+        self.summary_max_tokens = settings.CONTEXT_SUMMARY_MAX_TOKENS
+        self.refresh_lock_expire = 120
+
+    def get_refresh_lock_key(self, agent_id: str, customer_id: str) -> str:
+        return f"{self.session_manager.get_summary_key(agent_id, customer_id)}:lock"
+
+    async def load_summary(self, agent_id: str, customer_id: str) -> Dict[str, str]:
+        """读取会话摘要 {text, covered_until}，读取失败时视为无摘要"""
+        try:
+            return await get_async_redis().hgetall(self.session_manager.get_summary_key(agent_id, customer_id))
+        except Exception as e:
+            logger.error(f"Error loading summary for session {agent_id}:{customer_id}: {e}")
+            return {}
+
+    def compact(self, context: List[Dict[str, Any]], summary: Dict[str, str]) -> CompactedContext:
+        """从最新消息往前选取预算内的原文，其余交给摘要"""
+        summary_text = summary.get("text") or None
+        covered_until = summary.get("covered_until", "")
+        budget = max(self.token_budget - estimate_tokens(summary_text or ""), self.token_budget // 2)
+
+        recent: List[Dict[str, Any]] = []
+        used = 0
+        for message in reversed(context):
+            if len(recent) >= self.max_recent_turns:
+                break
+            tokens = estimate_message_tokens(message)
+            if used + tokens > budget:
+                if recent:
+                    break
+                # 最新一条单独超出预算（如客户粘贴长文本）时截断保留
+                content = truncate_to_tokens(str(message.get("content", "")), budget - MESSAGE_OVERHEAD_TOKENS)
+                message = {**message, "content": content}
+                tokens = estimate_message_tokens(message)
+            recent.insert(0, message)
+            used += tokens
+
+        older = context[:len(context) - len(recent)]
+        pending = [message for message in older if message.get("timestamp", "") > covered_until]
+        return CompactedContext(
+            recent=recent,
+            summary=summary_text,
+            pending=pending,
+            tokens=used + estimate_tokens(summary_text or ""),
+            raw_tokens=estimate_context_tokens(context)
+        )
+
+    async def claim_refresh(self, agent_id: str, customer_id: str) -> bool:
+        """每个会话同时只调度一个摘要刷新任务"""
+        return bool(await get_async_redis().set(
+            self.get_refresh_lock_key(agent_id, customer_id), 1, nx=True, ex=self.refresh_lock_expire
+        ))
+
+    async def release_refresh(self, agent_id: str, customer_id: str):
+        await get_async_redis().delete(self.get_refresh_lock_key(agent_id, customer_id))
+
+    async def refresh(self, agent_id: str, customer_id: str, openai_service: OpenAIService) -> Dict[str, Any]:
+        """后台任务：将移出窗口的消息合并进摘要"""
+        try:
+            context = await self.session_manager.get_context(agent_id, customer_id)
+            summary = await self.load_summary(agent_id, customer_id)
+            pending = self.compact(context, summary).pending
+            if not pending:
+                return {"summarized": 0}
+
+            text = await openai_service.summarize_conversation(
+                summary.get("text"), pending, self.summary_max_tokens
+            )
+            if not text:
+                metrics.incr("context.summary_failed")
+                return {"summarized": 0, "error": "summary generation failed"}
+
+            summary_key = self.session_manager.get_summary_key(agent_id, customer_id)
+            async with get_async_redis().pipeline(transaction=True) as pipe:
+                pipe.hset(summary_key, mapping={
+                    "text": truncate_to_tokens(text, self.summary_max_tokens),
+                    "covered_until": pending[-1].get("timestamp", "")
+                })
+                pipe.expire(summary_key, self.session_manager.session_expire)
+                await pipe.execute()
+
+            metrics.incr("context.summary_refreshed")
+            logger.info(f"Folded {len(pending)} messages into summary for session {agent_id}:{customer_id}")
+            return {"summarized": len(pending)}
+
+        finally:
+            await self.release_refresh(agent_id, customer_id)
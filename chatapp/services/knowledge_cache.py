@@ -0,0 +1,124 @@
+import hashlib
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional
+from chatapp.config import settings
+from chatapp.utils.codec import get_codec
+from chatapp.utils.logger import logger
+from chatapp.utils.lru_cache import LRUCache
+from chatapp.utils.metrics import metrics
+from chatapp.utils.redis_client import get_async_redis
+
+
+def normalize_query(query: str) -> str:
+    """
+    规范化检索问题：全角转半角（NFKC）、统一小写、去掉标点与空白
+
+    "首付 多少？" 与 "首付多少?" 视为同一个问题
+    """
+    normalized = unicodedata.normalize("NFKC", query).lower()
+    return "".join(
+        ch for ch in normalized
+        if not ch.isspace() and not unicodedata.category(ch).startswith("P")
+    )
+
+
+class KnowledgeCache:
+    """
+    知识检索结果缓存：进程内LRU + Redis（带TTL）
+
+    缓存键包含数据集的版本号（rag_cache:version:{dataset}），数据集重建索引后
+    调用invalidate()递增版本号，旧条目不再被命中并随TTL过期；
+    其他进程最多在version_check_interval秒后感知到新版本
+    """
+
+    def __init__(self):
+        self.ttl = settings.RAG_CACHE_TTL_SECONDS
+        self.local_cache = LRUCache(max_entries=settings.RAG_CACHE_LOCAL_SIZE, ttl=settings.RAG_CACHE_LOCAL_TTL)
+        self.version_check_interval = settings.RAG_CACHE_VERSION_CHECK_SECONDS
+        self.codec = get_codec()
+        self._versions: Dict[str, tuple] = {}  # dataset -> (version, checked_at)
+        self._upstream_ms = 0.0  # 上游检索耗时的指数滑动平均，用于估算节省的时间
+        self.hits_local = 0
+        self.hits_redis = 0
+        self.misses = 0
+
+    def get_version_key(self, dataset: str) -> str:
+        return f"rag_cache:version:{dataset}"
+
+    def get_cache_key(self, dataset: str, version: int, top_k: int, query: str) -> str:
+        digest = hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+        return f"rag_cache:{dataset}:v{version}:{top_k}:{digest}"
+
+    async def get_version(self, dataset: str) -> int:
+        """读取数据集版本号（本地缓存version_check_interval秒）"""
+        cached = self._versions.get(dataset)
+        now = time.monotonic()
+        if cached and now - cached[1] < self.version_check_interval:
+            return cached[0]
+        version = int(await get_async_redis().get(self.get_version_key(dataset)) or 0)
+        self._versions[dataset] = (version, now)
+        return version
+
+    async def get(self, dataset: str, top_k: int, query: str) -> Optional[List[Dict[str, Any]]]:
+        """读取缓存，未命中返回None；Redis不可用时视为未命中"""
+        try:
+            cache_key = self.get_cache_key(dataset, await self.get_version(dataset), top_k, query)
+
+            results = self.local_cache.get(cache_key)
+            if results is not None:
+                self.hits_local += 1
+                self._record_hit("local")
+                return results
+
+            raw = await get_async_redis(binary=self.codec.binary).get(cache_key)
+        except Exception as e:
+            logger.error(f"Error reading knowledge cache: {e}")
+            return None
+
+        if raw is None:
+            self.misses += 1
+            metrics.incr("rag_cache.miss")
+            return None
+
+        results = self.codec.decode(raw)
+        self.local_cache.set(cache_key, results)
+        self.hits_redis += 1
+        self._record_hit("redis")
+        return results
+
+    async def set(self, dataset: str, top_k: int, query: str, results: List[Dict[str, Any]], upstream_ms: float):
+        """写入缓存（只缓存非空结果，空结果可能是上游异常）"""
+        self._upstream_ms = upstream_ms if not self._upstream_ms else 0.9 * self._upstream_ms + 0.1 * upstream_ms
+        if not results:
+            return
+        try:
+            cache_key = self.get_cache_key(dataset, await self.get_version(dataset), top_k, query)
+            self.local_cache.set(cache_key, results)
+            await get_async_redis(binary=self.codec.binary).set(cache_key, self.codec.encode(results), ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Error writing knowledge cache: {e}")
+
+    async def invalidate(self, dataset: str) -> int:
+        """数据集重建索引后调用：递增版本号并清空本进程缓存，返回新版本号"""
+        version = await get_async_redis().incr(self.get_version_key(dataset))
+        self._versions[dataset] = (version, time.monotonic())
+        self.local_cache.clear()
+        metrics.incr("rag_cache.invalidated")
+        logger.info(f"Knowledge cache invalidated for dataset {dataset}, version={version}")
+        return version
+
+    def _record_hit(self, tier: str):
+        metrics.incr(f"rag_cache.hit.{tier}")
+        metrics.incr("rag_cache.latency_saved_ms", self._upstream_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits_local + self.hits_redis + self.misses
+        return {
+            "hits_local": self.hits_local,
+            "hits_redis": self.hits_redis,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits_local + self.hits_redis) / total, 4) if total else 0.0,
+            "avg_upstream_ms": round(self._upstream_ms, 2),
+            "local": self.local_cache.stats(),
+        }
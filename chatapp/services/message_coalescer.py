@@ -0,0 +1,118 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+from chatapp.config import settings
+from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.redis_client import get_async_redis
+
+# 仅当序号未被新消息取代时，移除已合并的消息行
+_COMMIT_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('LTRIM', KEYS[2], tonumber(ARGV[2]), -1)
+    return 1
+end
+return 0
+"""
+
+
+class CoalesceTicket:
+    """一次合并请求的凭据"""
+
+    def __init__(self, session_id: str, seq: int):
+        self.session_id = session_id
+        self.seq = seq
+        self.line_count = 0
+
+
+class MessageCoalescer:
+    """
+    按会话合并短时间内连续发送的客户消息
+
+    每条消息写入会话的待处理列表并递增序号，静默窗口结束后
+    只有序号最新的那条消息负责合并全部待处理内容并运行一次流水线，
+    被新消息取代的处理会被取消或丢弃
+    """
+
+    def __init__(self):
+        self.quiet_window = settings.COALESCE_QUIET_WINDOW_MS / 1000
+        self.poll_interval = 0.2
+        self.key_expire = int(self.quiet_window * 10) + 300
+
+    def get_lines_key(self, session_id: str) -> str:
+        return f"coalesce:{session_id}:lines"
+
+    def get_seq_key(self, session_id: str) -> str:
+        return f"coalesce:{session_id}:seq"
+
+    async def submit(self, session_id: str, content: str) -> CoalesceTicket:
+        """登记一条待合并消息"""
+        redis_client = get_async_redis()
+        lines_key = self.get_lines_key(session_id)
+        seq_key = self.get_seq_key(session_id)
+
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.rpush(lines_key, content)
+            pipe.incr(seq_key)
+            pipe.expire(lines_key, self.key_expire)
+            pipe.expire(seq_key, self.key_expire)
+            _, seq, _, _ = await pipe.execute()
+
+        return CoalesceTicket(session_id, int(seq))
+
+    async def is_current(self, ticket: CoalesceTicket) -> bool:
+        """是否仍是该会话最新的消息"""
+        seq = await get_async_redis().get(self.get_seq_key(ticket.session_id))
+        return seq is not None and int(seq) == ticket.seq
+
+    async def wait_quiet(self, ticket: CoalesceTicket) -> Optional[str]:
+        """等待静默窗口，若期间有新消息则返回None，否则返回合并后的查询"""
+        await asyncio.sleep(self.quiet_window)
+
+        if not await self.is_current(ticket):
+            metrics.incr("coalesce.superseded")
+            logger.info(f"Message superseded during quiet window: {ticket.session_id}#{ticket.seq}")
+            return None
+
+        lines = await get_async_redis().lrange(self.get_lines_key(ticket.session_id), 0, -1)
+        ticket.line_count = len(lines)
+        if len(lines) > 1:
+            metrics.incr("coalesce.merged_lines", len(lines) - 1)
+            logger.info(f"Coalesced {len(lines)} messages for session {ticket.session_id}")
+        return "\n".join(lines)
+
+    async def run_if_current(self, ticket: CoalesceTicket,
+                             coro_factory: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        """运行流水线，期间若被新消息取代则取消并返回None"""
+        task = asyncio.create_task(coro_factory())
+
+        while True:
+            try:
+                done, _ = await asyncio.wait({task}, timeout=self.poll_interval)
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            if done:
+                return task.result()
+
+            if not await self.is_current(ticket):
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                metrics.incr("coalesce.cancelled_in_flight")
+                logger.info(f"Cancelled superseded run: {ticket.session_id}#{ticket.seq}")
+                return None
+
+    async def commit(self, ticket: CoalesceTicket) -> bool:
+        """原子地确认本次合并结果：仍为最新时移除已合并的消息行并返回True"""
+        committed = await get_async_redis().eval(
+            _COMMIT_SCRIPT, 2,
+            self.get_seq_key(ticket.session_id),
+            self.get_lines_key(ticket.session_id),
+            ticket.seq, ticket.line_count
+        )
+        if not committed:
+            metrics.incr("coalesce.dropped_results")
+            logger.info(f"Dropped superseded result: {ticket.session_id}#{ticket.seq}")
+        return bool(committed)
@@ -0,0 +1,81 @@
+from typing import Dict, Any, Optional
+from chatapp.config import settings
+from chatapp.utils.logger import logger
+from chatapp.utils.lru_cache import LRUCache
+from chatapp.utils.metrics import metrics
+from chatapp.utils.redis_client import get_async_redis
+
+
+class MessageDeduplicator:
+    """企业微信重试回调去重：进程内LRU + Redis SET NX"""
+
+    def __init__(self):
+        self.ttl = settings.DEDUP_TTL_SECONDS
+        self.local_cache = LRUCache(max_entries=settings.DEDUP_LOCAL_CACHE_SIZE, ttl=self.ttl)
+        self.duplicates_local = 0
+        self.duplicates_redis = 0
+
+    def get_dedup_key(self, message_data: Dict[str, Any]) -> Optional[str]:
+        """生成去重键：优先使用MsgId，事件消息使用(发送者, 创建时间)"""
+        msg_id = message_data.get("msg_id")
+        if msg_id:
+            return f"dedup:msg:{msg_id}"
+
+        from_user = message_data.get("from_user_name")
+        create_time = message_data.get("create_time")
+        if from_user and create_time:
+            event = message_data.get("event", "")
+            return f"dedup:evt:{from_user}:{create_time}:{event}"
+
+        return None
+
+    async def is_duplicate(self, message_data: Dict[str, Any]) -> bool:
+        """检查并标记消息，已处理过的消息返回True"""
+        dedup_key = self.get_dedup_key(message_data)
+        if not dedup_key:
+            return False
+
+        # 1. 进程内LRU
+        if not self.local_cache.add(dedup_key):
+            self.duplicates_local += 1
+            metrics.incr("dedup.suppressed.local")
+            logger.info(f"Duplicate WeWork callback suppressed (local): {dedup_key}")
+            return True
+
+        # 2. Redis SET NX（跨进程/跨节点）
+        try:
+            redis_client = get_async_redis()
+            is_new = await redis_client.set(dedup_key, 1, nx=True, ex=self.ttl)
+        except Exception as e:
+            # Redis不可用时放行，宁可重复处理也不丢消息
+            logger.error(f"Error checking dedup key {dedup_key}: {e}")
+            return False
+
+        if not is_new:
+            self.duplicates_redis += 1
+            metrics.incr("dedup.suppressed.redis")
+            logger.info(f"Duplicate WeWork callback suppressed (redis): {dedup_key}")
+            return True
+
+        return False
+
+    async def release(self, message_data: Dict[str, Any]):
+        """入队失败时释放去重标记，使企业微信的重试能够再次入队"""
+        dedup_key = self.get_dedup_key(message_data)
+        if not dedup_key:
+            return
+
+        self.local_cache.delete(dedup_key)
+        try:
+            await get_async_redis().delete(dedup_key)
+        except Exception as e:
+            logger.error(f"Error releasing dedup key {dedup_key}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """去重统计"""
+        return {
+            "suppressed_local": self.duplicates_local,
+            "suppressed_redis": self.duplicates_redis,
+            "suppressed_total": self.duplicates_local + self.duplicates_redis,
+            "local_cache": self.local_cache.stats(),
+        }
@@ -0,0 +1,111 @@
+from typing import Any, Dict, List, Optional, Tuple
+from chatapp.config import settings
+from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.tokens import estimate_context_tokens
+
+# 每条消息需要生成的建议条数，小模型不足时回退到大模型
+REQUIRED_SUGGESTIONS = 3
+
+SMALL, LARGE = "small", "large"
+
+
+def _parse_agent_slos(value: str) -> Dict[str, str]:
+    """解析 "agent1:fast,agent2:quality" 格式的坐席SLO配置"""
+    slos = {}
+    for item in value.split(","):
+        if ":" in item:
+            agent_id, slo = item.split(":", 1)
+            slos[agent_id.strip()] = slo.strip()
+    return slos
+
+
+def estimate_cost(model: str, usage: Dict[str, int]) -> float:
+    """按模型的每千token单价估算一次调用的费用（美元），未知模型按大模型计价"""
+    if model == settings.OPENAI_SMALL_MODEL and model != settings.OPENAI_MODEL:
+        prompt_price = settings.OPENAI_SMALL_PROMPT_COST_PER_1K
+        completion_price = settings.OPENAI_SMALL_COMPLETION_COST_PER_1K
+    else:
+        prompt_price = settings.OPENAI_PROMPT_COST_PER_1K
+        completion_price = settings.OPENAI_COMPLETION_COST_PER_1K
+    return (usage.get("prompt_tokens", 0) * prompt_price + usage.get("completion_tokens", 0) * completion_price) / 1000
+
+
+class RouteDecision:
+    """路由结果：依次尝试的模型层级与原因"""
+
+    def __init__(self, tiers: Tuple[str, ...], reason: str):
+        self.tiers = tiers
+        self.reason = reason
+
+
+class ModelRouter:
+    """
+    按请求选择模型层级（small=OPENAI_SMALL_MODEL，large=OPENAI_MODEL）
+
+    只使用本地信号：问题长度、知识检索是否命中、上下文token数、坐席的SLO
+    - quality: 始终使用大模型
+    - fast:    上下文过长时才使用大模型
+    - balanced（默认）: 短问题且无知识命中（寒暄、确认类）使用小模型，其余使用大模型
+    小模型生成的建议不足REQUIRED_SUGGESTIONS条时由调用方回退到大模型；
+    enabled=False时始终使用大模型，但仍按层级统计耗时与费用
+    """
+
+    def __init__(self):
+        self.enabled = settings.MODEL_ROUTER_ENABLED
+        self.models = {SMALL: settings.OPENAI_SMALL_MODEL, LARGE: settings.OPENAI_MODEL}
+        self.short_query_chars = settings.MODEL_ROUTER_SHORT_QUERY_CHARS
+        self.small_max_context_tokens = settings.MODEL_ROUTER_SMALL_MAX_CONTEXT_TOKENS
+        self.default_slo = settings.MODEL_ROUTER_DEFAULT_SLO
+        self.agent_slos = _parse_agent_slos(settings.MODEL_ROUTER_AGENT_SLOS)
+        self.decisions = {SMALL: 0, LARGE: 0}
+        self.fallbacks = 0
+        self.costs = {SMALL: 0.0, LARGE: 0.0}
+
+    def route(self, query: str, context: List[Dict[str, Any]], knowledge: List[Dict[str, Any]],
+              agent_id: Optional[str] = None) -> RouteDecision:
+        if not self.enabled:
+            return RouteDecision((LARGE,), "disabled")
+
+        slo = self.agent_slos.get(agent_id, self.default_slo)
+        if slo == "quality":
+            tier, reason = LARGE, "slo_quality"
+        elif estimate_context_tokens(context) > self.small_max_context_tokens:
+            tier, reason = LARGE, "long_context"
+        elif slo == "fast":
+            tier, reason = SMALL, "slo_fast"
+        elif len(query.strip()) <= self.short_query_chars and not knowledge:
+            tier, reason = SMALL, "short_query"
+        else:
+            tier, reason = LARGE, "default"
+
+        self.decisions[tier] += 1
+        metrics.incr(f"model_router.decision.{tier}")
+        metrics.incr(f"model_router.reason.{reason}")
+        return RouteDecision((SMALL, LARGE) if tier == SMALL else (LARGE,), reason)
+
+    def tier_of(self, model: str) -> str:
+        return SMALL if model == self.models[SMALL] and self.models[SMALL] != self.models[LARGE] else LARGE
+
+    def record_latency(self, tier: str, elapsed_ms: float):
+        metrics.observe(f"model_router.{tier}.latency_ms", elapsed_ms)
+
+    def record_cost(self, model: str, usage: Dict[str, int]):
+        tier = self.tier_of(model)
+        cost = estimate_cost(model, usage)
+        self.costs[tier] += cost
+        metrics.incr(f"model_router.{tier}.cost_usd", cost)
+
+    def record_fallback(self, query: str, count: int):
+        self.fallbacks += 1
+        metrics.incr("model_router.fallback")
+        logger.info(f"Small model returned {count} suggestions, falling back to large model for query: {query}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "models": self.models,
+            "decisions": self.decisions,
+            "fallbacks": self.fallbacks,
+            "cost_usd": {tier: round(cost, 4) for tier, cost in self.costs.items()},
+        }
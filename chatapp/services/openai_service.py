@@ -1,7 +1,72 @@
+import hashlib
+import json
+import time
+from typing import Awaitable, Callable, List, Dict, Any, Optional
 import httpx
-from typing import List, Dict, Any
 from chatapp.config import settings
+from chatapp.services.completion_cache import CompletionCache
+from chatapp.services.model_router import REQUIRED_SUGGESTIONS, ModelRouter
 from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.http_transport import get_transport
+from chatapp.utils.rate_limiter import RateLimitedError, create_rate_limiter, parse_retry_after
+from chatapp.utils.resilience import CircuitOpenError, get_policy
+from chatapp.utils.single_flight import create_single_flight
+from chatapp.utils.tokens import estimate_tokens
+
+
+SuggestionCallback = Callable[[int, str], Awaitable[Any]]
+
+
+class SuggestionStreamParser:
+    """
+    增量解析建议：逐行处理模型输出，遇到下一条"建议N:"开头时上一条即视为完成
+
+    最后一条建议在finish()时完成；非流式解析同样使用该解析器，保证两种模式结果一致
+    """
+
+    MARKERS = ('建议1:', '建议2:', '建议3:')
+
+    def __init__(self):
+        self.suggestions: List[str] = []
+        self._buffer = ""
+        self._current = ""
+        self._active = False
+
+    def feed(self, text: str) -> List[str]:
+        """输入一段增量文本，返回本次新完成的建议"""
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split('\n')
+        completed: List[str] = []
+        for line in lines:
+            self._process_line(line, completed)
+        return completed
+
+    def finish(self) -> List[str]:
+        """输出结束，返回剩余的建议"""
+        completed: List[str] = []
+        if self._buffer:
+            self._process_line(self._buffer, completed)
+            self._buffer = ""
+        self._emit(completed)
+        return completed
+
+    def _process_line(self, line: str, completed: List[str]):
+        line = line.strip()
+        if line.startswith(self.MARKERS):
+            self._emit(completed)
+            self._current = line[len(self.MARKERS[0]):].strip()  # 移除"建议X:"前缀
+            self._active = True
+        elif self._active and line:
+            self._current = f"{self._current} {line}" if self._current else line
+
+    def _emit(self, completed: List[str]):
+        suggestion = self._current.strip()
+        if suggestion:
+            self.suggestions.append(suggestion)
+            completed.append(suggestion)
+        self._current = ""
+        self._active = False
 
 
 class OpenAIService:
@@ -11,10 +76,19 @@ class OpenAIService:
         self.api_key = settings.OPENAI_API_KEY
         self.base_url = settings.OPENAI_BASE_URL
         self.model = settings.OPENAI_MODEL
-        self.timeout = 60
+        self.transport = get_transport("openai")
+        self.policy = get_policy("openai")
+        self.single_flight = create_single_flight("openai")
+        self.rate_limiter = create_rate_limiter("openai")
+        self.router = ModelRouter()
+        metrics.register_provider("model_router", self.router.stats)
+        self.completion_cache = CompletionCache() if settings.LLM_CACHE_ENABLED else None
+        if self.completion_cache:
+            metrics.register_provider("llm_cache", self.completion_cache.stats)
 
-    def build_prompt(self, query: str, context: List[Dict[str, Any]], knowledge: List[Dict[str, Any]]) -> str:
-        """构建 Prompt"""
+    def build_prompt(self, query: str, context: List[Dict[str, Any]], knowledge: List[Dict[str, Any]],
+                     summary: Optional[str] = None) -> str:
+        """构建 Prompt（summary为较早对话的摘要，context为最近几轮原文）"""
         system_prompt = """你是一个专业的房产销售顾问助手，你的任务是帮助客服人员生成专业、热情且准确的回复建议。
 
 ## 角色要求：
@@ -31,6 +105,11 @@ class OpenAIService:
 
 每条建议用 "建议1:"、"建议2:"、"建议3:" 开头，换行分隔。"""
 
+        # 较早对话的摘要
+        summary_str = ""
+        if summary:
+            summary_str = f"\n## 早期对话摘要：\n{summary}\n"
+
         # 构建对话历史
         context_str = ""
         if context:
@@ -50,64 +129,302 @@ class OpenAIService:
         # 当前客户问题
         current_query = f"\n## 当前客户问题：\n{query}\n"
 
-        prompt = system_prompt + context_str + knowledge_str + current_query
+        prompt = system_prompt + summary_str + context_str + knowledge_str + current_query
         return prompt
 
-    async def generate_suggestions(self, query: str, context: List[Dict[str, Any]], knowledge: List[Dict[str, Any]]) -> \
-    List[str]:
-        """生成回复建议"""
+    async def generate_suggestions(self, query: str, context: List[Dict[str, Any]], knowledge: List[Dict[str, Any]],
+                                   summary: Optional[str] = None,
+                                   on_suggestion: Optional[SuggestionCallback] = None,
+                                   agent_id: Optional[str] = None,
+                                   meta: Optional[Dict[str, Any]] = None) -> List[str]:
+        """
+        生成回复建议
+
+        传入on_suggestion时以流式（SSE）方式生成，每条建议一完成即以 (序号, 建议) 回调，
+        流式调用各自独立，不参与并发合并
+        模型层级由ModelRouter选择，小模型生成的建议不足REQUIRED_SUGGESTIONS条时回退到大模型
+        （流式模式下回退生成的建议按相同序号再次推送，覆盖已推送的建议）
+        meta用于回传本次生成的附加信息：cache为命中的缓存层级（local/redis，未命中为None），
+        tier/model为最终使用的模型层级与模型
+        """
+        meta = meta if meta is not None else {}
         try:
-            prompt = self.build_prompt(query, context, knowledge)
-
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.model,
-                        "messages": [
-                            {"role": "user", "content": prompt}
-                        ],
-                        "temperature": 0.7,
-                        "max_tokens": 1000
-                    }
-                )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    content = result["choices"][0]["message"]["content"]
-
-                    # 解析建议
-                    suggestions = self.parse_suggestions(content)
-                    logger.info(f"Generated {len(suggestions)} suggestions for query: {query}")
-                    return suggestions
-                else:
-                    logger.error(f"OpenAI API failed: {response.status_code} - {response.text}")
-                    return []
+            prompt = self.build_prompt(query, context, knowledge, summary)
+            decision = self.router.route(query, context, knowledge, agent_id)
+            suggestions: List[str] = []
+            for tier in decision.tiers:
+                payload = {
+                    "model": self.router.models[tier],
+                    "messages": [
+                        {"role": "user", "content": prompt}
+                    ],
+                    "temperature": 0.7,
+                    "max_tokens": 1000
+                }
+                meta["tier"], meta["model"] = tier, payload["model"]
+
+                started_at = time.perf_counter()
+                suggestions = await self._generate(query, payload, on_suggestion, agent_id, meta)
+                if meta["cache"] is None:
+                    self.router.record_latency(tier, (time.perf_counter() - started_at) * 1000)
+
+                if len(suggestions) >= REQUIRED_SUGGESTIONS:
+                    break
+                if tier != decision.tiers[-1]:
+                    self.router.record_fallback(query, len(suggestions))
+            return suggestions
 
         except Exception as e:
             logger.error(f"Error generating suggestions: {e}")
             return []
 
+    async def _generate(self, query: str, payload: Dict[str, Any], on_suggestion: Optional[SuggestionCallback],
+                        agent_id: Optional[str], meta: Dict[str, Any]) -> List[str]:
+        """使用payload指定的模型生成一次建议（依次尝试缓存、流式或并发合并的调用）"""
+        use_cache = self.completion_cache is not None and self.completion_cache.enabled_for(agent_id)
+        cached = await self.completion_cache.get(*self._cache_args(payload)) if use_cache else None
+        meta["cache"] = cached["tier"] if cached else None
+        if cached:
+            logger.info(f"Using cached suggestions ({cached['tier']}) for query: {query}")
+            if on_suggestion is not None:
+                await self._deliver(on_suggestion, 0, cached["suggestions"])
+            return cached["suggestions"]
+
+        if on_suggestion is not None:
+            return await self._stream_suggestions(query, payload, on_suggestion, use_cache)
+
+        # 提示词完全相同的并发请求共享一次调用
+        if self.single_flight:
+            return await self.single_flight.do(
+                self.get_prompt_hash(payload), lambda: self._complete_suggestions(query, payload, use_cache)
+            )
+        return await self._complete_suggestions(query, payload, use_cache)
+
+    @staticmethod
+    def get_prompt_hash(payload: Dict[str, Any]) -> str:
+        """请求体（模型、消息、采样参数）的哈希"""
+        return hashlib.sha256(
+            json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    @staticmethod
+    def _cache_args(payload: Dict[str, Any]) -> tuple:
+        """缓存键的组成：(模型, 提示词, temperature)"""
+        return payload["model"], payload["messages"][0]["content"], payload["temperature"]
+
+    async def _settle_usage(self, payload: Dict[str, Any], outputs: List[str],
+                            usage: Optional[Dict[str, int]]) -> Dict[str, int]:
+        """
+        记录一次成功调用的用量：按实际用量退还限流预扣的token，按模型层级累计费用
+
+        上游未返回用量时按提示词与输出长度估算（不退还限流配额），返回最终使用的用量
+        """
+        if usage and usage.get("total_tokens"):
+            if self.rate_limiter:
+                await self.rate_limiter.refund(self._estimate_request_tokens(payload) - usage["total_tokens"])
+        else:
+            usage = {
+                "prompt_tokens": estimate_tokens(payload["messages"][0]["content"]),
+                "completion_tokens": sum(estimate_tokens(output) for output in outputs),
+            }
+        self.router.record_cost(payload["model"], usage)
+        return usage
+
+    @staticmethod
+    def _estimate_request_tokens(payload: Dict[str, Any]) -> int:
+        """限流预扣的token数：提示词估算 + 最大输出"""
+        return sum(estimate_tokens(message["content"]) for message in payload["messages"]) + payload["max_tokens"]
+
+    async def _rate_limited(self, fn: Callable[[], Awaitable[httpx.Response]],
+                            payload: Dict[str, Any]) -> httpx.Response:
+        """
+        取得集群限流配额后执行调用
+
+        上游仍返回429时按Retry-After暂停所有worker，并在等待预算内重试一次；
+        预算内取不到配额时抛出RateLimitedError
+        """
+        if not self.rate_limiter:
+            return await fn()
+
+        tokens = self._estimate_request_tokens(payload)
+        await self.rate_limiter.acquire(tokens)
+        response = await fn()
+        if response.status_code == 429:
+            await self.rate_limiter.throttled(parse_retry_after(response.headers, default=1.0))
+            await self.rate_limiter.acquire(tokens)
+            response = await fn()
+        return response
+
+    async def _complete_suggestions(self, query: str, payload: Dict[str, Any], use_cache: bool = False) -> List[str]:
+        try:
+            response = await self._rate_limited(lambda: self.policy.call(lambda: self.transport.request(
+                "POST",
+                f"{self.base_url}/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                json=payload
+            )), payload)
+
+            if response.status_code == 200:
+                result = response.json()
+                content = result["choices"][0]["message"]["content"]
+
+                # 解析建议
+                suggestions = self.parse_suggestions(content)
+                logger.info(f"Generated {len(suggestions)} suggestions for query: {query}")
+                usage = await self._settle_usage(payload, suggestions, result.get("usage"))
+                if use_cache:
+                    await self.completion_cache.set(*self._cache_args(payload), suggestions, usage)
+                return suggestions
+            else:
+                logger.error(f"OpenAI API failed: {response.status_code} - {response.text}")
+                return []
+
+        except CircuitOpenError:
+            metrics.incr("openai.skipped_circuit_open")
+            logger.warning(f"OpenAI circuit open, no suggestions for query: {query}")
+            return []
+
+        except RateLimitedError as e:
+            metrics.incr("openai.skipped_rate_limited")
+            logger.warning(f"{e}, no suggestions for query: {query}")
+            return []
+
+        except Exception as e:
+            logger.error(f"Error generating suggestions: {e!r}")
+            return []
+
+    async def _stream_suggestions(self, query: str, payload: Dict[str, Any],
+                                  on_suggestion: SuggestionCallback, use_cache: bool = False) -> List[str]:
+        parser = SuggestionStreamParser()
+        usage: Dict[str, int] = {}
+        stream_payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+        try:
+            # 建议已推送给坐席，不能对冲重发
+            response = await self._rate_limited(lambda: self.policy.call(
+                lambda: self._read_stream(stream_payload, parser, on_suggestion, usage), hedge=False
+            ), payload)
+
+            if response.status_code == 200:
+                completed = parser.finish()
+                await self._deliver(on_suggestion, len(parser.suggestions) - len(completed), completed)
+                logger.info(f"Streamed {len(parser.suggestions)} suggestions for query: {query}")
+                usage = await self._settle_usage(payload, parser.suggestions, usage)
+                if use_cache:
+                    await self.completion_cache.set(*self._cache_args(payload), parser.suggestions, usage)
+                return parser.suggestions
+            else:
+                logger.error(f"OpenAI API failed: {response.status_code} - {response.text}")
+                return []
+
+        except CircuitOpenError:
+            metrics.incr("openai.skipped_circuit_open")
+            logger.warning(f"OpenAI circuit open, no suggestions for query: {query}")
+            return []
+
+        except RateLimitedError as e:
+            metrics.incr("openai.skipped_rate_limited")
+            logger.warning(f"{e}, no suggestions for query: {query}")
+            return []
+
+        except Exception as e:
+            # 中途失败时已推送的建议仍然有效
+            logger.error(f"Error streaming suggestions: {e!r}")
+            return parser.suggestions
+
+    async def _read_stream(self, payload: Dict[str, Any], parser: SuggestionStreamParser,
+                           on_suggestion: SuggestionCallback, usage: Dict[str, int]) -> httpx.Response:
+        """读取SSE响应，逐段喂给解析器，token用量写入usage；非200时读完响应体后原样返回"""
+        async with self.transport.stream(
+            "POST",
+            f"{self.base_url}/chat/completions",
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            json=payload
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return response
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    usage.update(chunk["usage"])
+                choices = chunk.get("choices") or []
+                delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                if not delta:
+                    continue
+                completed = parser.feed(delta)
+                await self._deliver(on_suggestion, len(parser.suggestions) - len(completed), completed)
+            return response
+
+    @staticmethod
+    async def _deliver(on_suggestion: SuggestionCallback, first_index: int, completed: List[str]):
+        """回调新完成的建议，first_index为第一条的序号"""
+        for offset, suggestion in enumerate(completed):
+            try:
+                await on_suggestion(first_index + offset, suggestion)
+            except Exception as e:
+                logger.error(f"Error delivering streamed suggestion {first_index + offset}: {e}")
+
+    async def summarize_conversation(self, previous_summary: Optional[str], messages: List[Dict[str, Any]],
+                                     max_tokens: int) -> Optional[str]:
+        """将较早的对话增量合并进已有摘要，失败时返回None"""
+        history = "\n".join(
+            f"{'客户' if msg.get('from_customer') else '客服'}：{msg.get('content', '')}" for msg in messages
+        )
+        prompt = f"""请将以下房产咨询对话合并进已有摘要，输出更新后的完整摘要。
+要求：保留客户的需求、预算、意向区域/户型、已确认的事实和未解决的问题，省略寒暄，不超过{max_tokens}字。
+
+## 已有摘要：
+{previous_summary or "（无）"}
+
+## 新增对话：
+{history}
+"""
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.2,
+            "max_tokens": max_tokens
+        }
+        try:
+            response = await self._rate_limited(lambda: self.transport.request(
+                "POST",
+                f"{self.base_url}/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                json=payload
+            ), payload)
+
+            if response.status_code == 200:
+                result = response.json()
+                summary = result["choices"][0]["message"]["content"].strip()
+                await self._settle_usage(payload, [summary], result.get("usage"))
+                return summary
+            logger.error(f"OpenAI summary failed: {response.status_code} - {response.text}")
+            return None
+
+        except Exception as e:
+            logger.error(f"Error summarizing conversation: {e}")
+            return None
+
     def parse_suggestions(self, content: str) -> List[str]:
         """解析AI生成的建议"""
-        suggestions = []
-        lines = content.split('\n')
-        current_suggestion = ""
-
-        for line in lines:
-            line = line.strip()
-            if line.startswith(('建议1:', '建议2:', '建议3:')):
-                if current_suggestion:
-                    suggestions.append(current_suggestion.strip())
-                current_suggestion = line[3:].strip()  # 移除"建议X:"前缀
-            elif current_suggestion and line:
-                current_suggestion += " " + line
-
-        if current_suggestion:
-            suggestions.append(current_suggestion.strip())
-
-        return suggestions
\ No newline at end of file
+        parser = SuggestionStreamParser()
+        parser.feed(content)
+        parser.finish()
+        return parser.suggestions
@@ -1,7 +1,15 @@
-import httpx
-from typing import List, Dict, Any
+import asyncio
+import hashlib
+import time
+from typing import List, Dict, Any, Optional
 from chatapp.config import settings
+from chatapp.services.knowledge_cache import KnowledgeCache, normalize_query
 from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.http_transport import get_transport
+from chatapp.utils.resilience import CircuitOpenError, get_policy
+from chatapp.utils.ngram_index import LocalIndexHandle, SearchResult, NGramIndex
+from chatapp.utils.single_flight import create_single_flight
 
 
 class RAGFlowService:
@@ -10,33 +18,111 @@ class RAGFlowService:
     def __init__(self):
         self.api_url = settings.RAGFLOW_API_URL
         self.api_key = settings.RAGFLOW_API_KEY
-        self.timeout = 30
+        self.dataset = settings.RAGFLOW_DATASET
+        self.transport = get_transport("ragflow")
+        self.policy = get_policy("ragflow")
+        self.cache = KnowledgeCache() if settings.RAG_CACHE_ENABLED else None
+        if self.cache:
+            metrics.register_provider("rag_cache", self.cache.stats)
+        self.single_flight = create_single_flight("ragflow")
+        # 本地索引 off/fallback/fast_path
+        self.local_mode = settings.LOCAL_INDEX_MODE
+        self.local_min_confidence = settings.LOCAL_INDEX_MIN_CONFIDENCE
+        self.local_index = LocalIndexHandle(settings.LOCAL_INDEX_PATH) if self.local_mode != "off" else None
 
     async def search_knowledge(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """搜索知识库"""
+        """
+        搜索知识库
+
+        fast_path: 本地索引置信度足够时直接返回，否则查询RAGFlow
+        fallback:  RAGFlow失败或无结果时使用本地索引的结果
+        """
+        index = self.local_index.get() if self.local_index else None
+        local = None
+        if index and self.local_mode == "fast_path":
+            local = await self._search_local(index, query, top_k)
+            if local.results and local.confidence >= self.local_min_confidence:
+                metrics.incr("local_index.fast_path")
+                return local.results
+
+        results = await self._search_remote(query, top_k)
+        if not results and index:
+            local = local or await self._search_local(index, query, top_k)
+            if local.results:
+                metrics.incr("local_index.fallback")
+                logger.warning(f"RAGFlow returned no results, using local index for query: {query}")
+                return local.results
+        return results
+
+    async def _search_local(self, index: NGramIndex, query: str, top_k: int) -> SearchResult:
+        """本地检索为CPU计算，大语料时可达数十毫秒，放到线程中执行以免阻塞事件循环"""
+        started_at = time.perf_counter()
+        local = await asyncio.to_thread(index.search, query, top_k)
+        metrics.observe("local_index.search_ms", (time.perf_counter() - started_at) * 1000)
+        return local
+
+    async def _search_remote(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+        """RAGFlow检索（启用缓存时先查缓存）"""
+        if self.cache:
+            cached = await self.cache.get(self.dataset, top_k, query)
+            if cached is not None:
+                logger.info(f"RAGFlow cache hit for query: {query}")
+                return cached
+
+        # 同一时刻的相同问题（规范化后）只发起一次检索
+        if self.single_flight:
+            digest = hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+            return await self.single_flight.do(
+                f"{self.dataset}:{top_k}:{digest}", lambda: self._retrieve_and_cache(query, top_k)
+            )
+        return await self._retrieve_and_cache(query, top_k)
+
+    async def _retrieve_and_cache(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+        started_at = time.perf_counter()
+        results = await self._retrieve(query, top_k)
+        upstream_ms = (time.perf_counter() - started_at) * 1000
+        metrics.observe("ragflow.retrieval_ms", upstream_ms)
+
+        if self.cache:
+            await self.cache.set(self.dataset, top_k, query, results, upstream_ms)
+        return results
+
+    async def invalidate_cache(self, dataset: Optional[str] = None) -> Optional[int]:
+        """数据集重建索引后使缓存失效，返回新的版本号"""
+        if not self.cache:
+            return None
+        return await self.cache.invalidate(dataset or self.dataset)
+
+    async def _retrieve(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+        """调用RAGFlow检索接口"""
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.api_url}/api/v1/retrieval",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "query": query,
-                        "top_k": top_k,
-                        "dataset": "real_estate"  # 假设您的房源数据集名称
-                    }
-                )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    logger.info(f"RAGFlow search successful for query: {query}")
-                    return result.get("data", [])
-                else:
-                    logger.error(f"RAGFlow search failed: {response.status_code} - {response.text}")
-                    return []
+            response = await self.policy.call(lambda: self.transport.request(
+                "POST",
+                f"{self.api_url}/api/v1/retrieval",
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "query": query,
+                    "top_k": top_k,
+                    "dataset": self.dataset
+                }
+            ))
+
+            if response.status_code == 200:
+                result = response.json()
+                logger.info(f"RAGFlow search successful for query: {query}")
+                return result.get("data", [])
+            else:
+                logger.error(f"RAGFlow search failed: {response.status_code} - {response.text}")
+                return []
+
+        except CircuitOpenError:
+            # 熔断期间跳过知识检索，直接返回空结果（启用本地索引时由其兜底）
+            metrics.incr("ragflow.skipped_circuit_open")
+            return []
 
         except Exception as e:
-            logger.error(f"Error searching RAGFlow: {e}")
+            logger.error(f"Error searching RAGFlow: {e!r}")
             return []
@@ -0,0 +1,397 @@
+import asyncio
+import json
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Optional
+from chatapp.config import settings
+from chatapp.services.connection_registry import ConnectionRegistry
+from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.redis_client import get_async_redis
+
+AGENT_CHANNEL_PREFIX = "agent_events:"
+RECEIVED_TIME_FIELD = "received_time"
+
+# (agent_id, customer_id, msg_id, result_data)，未送达的结果保存到ai_result键
+ResultStore = Callable[[str, str, Optional[str], Dict[str, Any]], Awaitable[Any]]
+
+
+class ResultPublisher:
+    """
+    worker侧：将建议/结果事件发布到坐席频道 agent_events:{agent_id}
+
+    指定stream_key时完整结果写入结果流（Redis Streams），Web服务断线重连后可从上次读取的位置继续，
+    不会丢失结果；逐条建议仍通过频道推送。未指定时完整结果同样通过频道推送（结果另存于ai_result键）
+    集群模式（传入registry）下事件直接转发到坐席所在节点的频道，不再发布到坐席频道
+    """
+
+    def __init__(self, stream_key: Optional[str] = None, registry: Optional[ConnectionRegistry] = None):
+        self.stream_key = stream_key
+        self.registry = registry
+
+    def get_channel(self, agent_id: str) -> str:
+        return f"{AGENT_CHANNEL_PREFIX}{agent_id}"
+
+    async def publish(self, agent_id: str, event: Dict[str, Any]) -> int:
+        """发布事件，返回收到事件的订阅者数；发布失败只记录日志"""
+        try:
+            data = json.dumps(event, ensure_ascii=False)
+            if self.registry:
+                return int(await self.registry.route(agent_id, data))
+            return await get_async_redis().publish(self.get_channel(agent_id), data)
+        except Exception as e:
+            logger.error(f"Error publishing {event.get('type')} event to agent {agent_id}: {e}")
+            return 0
+
+    async def publish_suggestion(self, agent_id: str, session_id: str, msg_id: Optional[str],
+                                 index: int, suggestion: str, variant: Optional[str] = None) -> int:
+        """
+        推送单条已生成完成的建议
+
+        variant为speculative（未使用知识的推测建议）或grounded（知识返回后重新生成，按序号覆盖推测建议）
+        """
+        event = {
+            "type": "suggestion",
+            "session_id": session_id,
+            "msg_id": msg_id,
+            "index": index,
+            "suggestion": suggestion,
+        }
+        if variant:
+            event["variant"] = variant
+        return await self.publish(agent_id, event)
+
+    async def publish_result(self, agent_id: str, msg_id: Optional[str], result_data: Dict[str, Any],
+                             received_time: Optional[float] = None, customer_id: Optional[str] = None) -> int:
+        """
+        推送完整的处理结果，received_time（回调接收时间）用于统计端到端投递延迟
+
+        结果流是stream模式下结果的唯一存储，写入失败时抛出异常，由任务从检查点重试；
+        customer_id随条目写入，坐席未连接时Web侧据此将结果保存到ai_result键
+        """
+        event = {"type": "ai_result", "msg_id": msg_id, **result_data}
+        if not self.stream_key:
+            # 接收时间随事件发布，由Web侧转发时取出并统计延迟，不发送给坐席
+            if received_time:
+                event[RECEIVED_TIME_FIELD] = received_time
+            return await self.publish(agent_id, event)
+        try:
+            await get_async_redis().xadd(
+                self.stream_key,
+                {
+                    "agent_id": agent_id,
+                    "customer_id": customer_id or "",
+                    "payload": json.dumps(event, ensure_ascii=False),
+                    "received_time": received_time or "",
+                },
+                maxlen=settings.RESULT_STREAM_MAXLEN,
+                approximate=True
+            )
+            return 1
+        except Exception as e:
+            logger.error(f"Error publishing result {msg_id} for agent {agent_id}: {e}")
+            raise
+
+
+class _BackgroundForwarder(ABC):
+    """Web侧转发任务的公共部分：后台任务的启停与转发统计"""
+
+    name = "forwarder"
+
+    def __init__(self, send: Callable[[str, str], Awaitable[bool]]):
+        self.send = send
+        self._task: Optional[asyncio.Task] = None
+        self.forwarded = 0
+        self.undelivered = 0
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"{self.name} started")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    @abstractmethod
+    async def _run(self):
+        """后台任务主循环，由stop()取消"""
+
+    async def _forward(self, data: str, agent_id: str) -> bool:
+        """转发频道事件；结果事件携带的接收时间在转发前移除，投递成功后统计自回调接收起的延迟"""
+        received_time = None
+        if f'"{RECEIVED_TIME_FIELD}"' in data:
+            event = json.loads(data)
+            received_time = event.pop(RECEIVED_TIME_FIELD, None)
+            data = json.dumps(event, ensure_ascii=False)
+        if not await self.send(data, agent_id):
+            return False
+        if received_time:
+            metrics.observe("result_delivery.latency_ms", (time.time() - float(received_time)) * 1000)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "forwarded": self.forwarded,
+            "undelivered": self.undelivered,
+        }
+
+
+class AgentEventForwarder(_BackgroundForwarder):
+    """
+    Web侧（单节点）：订阅所有坐席频道，将事件转发到坐席的WebSocket
+
+    连接断开时自动重新订阅（断开期间的事件会丢失，完整结果由结果流或ai_result键保证）
+    """
+
+    name = "Agent event forwarder"
+
+    async def _run(self):
+        while True:
+            pubsub = get_async_redis().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(f"{AGENT_CHANNEL_PREFIX}*")
+                async for message in pubsub.listen():
+                    if message.get("type") != "pmessage":
+                        continue
+                    agent_id = message["channel"][len(AGENT_CHANNEL_PREFIX):]
+                    if await self._forward(message["data"], agent_id):
+                        self.forwarded += 1
+                    else:
+                        self.undelivered += 1
+                        metrics.incr("agent_events.undelivered")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Agent event forwarder error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+class AgentResultConsumer(_BackgroundForwarder):
+    """
+    Web侧：读取结果流，将完整结果转发到坐席的WebSocket，并统计自回调接收起的投递延迟；
+    坐席未连接时通过store（AsyncSessionManager.store_result）将结果保存到ai_result键，与store模式一致
+
+    单实例：读取全部结果，只投递给连接在本实例上的坐席；
+    最后读取的条目ID保存在 {stream_key}:last_id，Redis连接中断恢复或服务重启后从该位置继续读取
+    集群模式（指定group）：各节点以消费者组分摊结果，由send（ConnectionManager.deliver）转发到坐席所在节点；
+    送达后确认，坐席未连接（可能正在重连）的条目不确认；定期认领空闲超过claim_idle_ms的未确认条目
+    （包括上述条目，以及节点崩溃或确认失败时遗留的条目）重新投递，仍未送达时保存后确认。
+    启动时先处理自己此前未确认的条目（同样按最终一次投递处理）
+    """
+
+    name = "Agent result consumer"
+
+    def __init__(self, send: Callable[[str, str], Awaitable[bool]], stream_key: str, block_ms: int = 5000,
+                 group: Optional[str] = None, consumer: Optional[str] = None, claim_idle_ms: int = 30000,
+                 store: Optional[ResultStore] = None):
+        super().__init__(send)
+        self.stream_key = stream_key
+        self.block_ms = block_ms
+        self.group = group
+        self.consumer = consumer
+        self.claim_idle_ms = claim_idle_ms
+        self.store = store
+        self.last_id = "0" if group else "$"
+        self.last_id_key = f"{stream_key}:last_id"
+        self.reclaimed = 0
+        self.stored = 0
+
+    async def _run(self):
+        if self.group:
+            await self._ensure_group()
+        else:
+            await self._load_last_id()
+        next_claim = time.monotonic()
+        while True:
+            try:
+                if self.group and time.monotonic() >= next_claim:
+                    next_claim = time.monotonic() + self.claim_idle_ms / 3000
+                    await self._claim_stale()
+                if self.group:
+                    response = await get_async_redis().xreadgroup(
+                        self.group, self.consumer, {self.stream_key: self.last_id}, count=100, block=self.block_ms
+                    )
+                else:
+                    response = await get_async_redis().xread(
+                        {self.stream_key: self.last_id}, count=100, block=self.block_ms
+                    )
+                entries = [entry for _, stream_entries in response or [] for entry in stream_entries]
+                if self.group and self.last_id == "0" and not entries:
+                    self.last_id = ">"  # 未确认的条目已处理完，开始读取新条目
+                for entry_id, fields in entries:
+                    if self.group:
+                        # 新条目未送达时留在待确认列表，坐席在被认领前重连即可收到；启动时读取的
+                        # 本节点遗留条目按最终一次投递处理（已被MAXLEN裁剪的条目没有内容，直接确认）
+                        final = self.last_id == "0"
+                        if not fields or await self._deliver(fields, final) or final:
+                            await get_async_redis().xack(self.stream_key, self.group, entry_id)
+                    else:
+                        await self._deliver(fields)
+                        self.last_id = entry_id
+                if entries and not self.group:
+                    await get_async_redis().set(self.last_id_key, self.last_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Agent result consumer error: {e}")
+                await asyncio.sleep(1)
+
+    async def _claim_stale(self):
+        """认领并投递其他消费者（或本节点此前）遗留的未确认条目"""
+        start_id = "0-0"
+        while True:
+            start_id, entries, *_ = await get_async_redis().xautoclaim(
+                self.stream_key, self.group, self.consumer,
+                min_idle_time=self.claim_idle_ms, start_id=start_id, count=100
+            )
+            for entry_id, fields in entries:
+                # 已被MAXLEN裁剪的条目没有内容，直接确认；其余条目送达或保存后确认
+                if fields:
+                    self.reclaimed += 1
+                    await self._deliver(fields)
+                await get_async_redis().xack(self.stream_key, self.group, entry_id)
+            if entries:
+                logger.info(f"Reclaimed {len(entries)} stale result entries")
+            if start_id in ("0-0", b"0-0"):
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "reclaimed": self.reclaimed, "stored": self.stored}
+
+    async def _load_last_id(self):
+        """单实例：从上次保存的位置继续读取，首次启动时只读取新结果"""
+        while True:
+            try:
+                self.last_id = await get_async_redis().get(self.last_id_key) or "$"
+                return
+            except Exception as e:
+                logger.error(f"Error loading result consumer position: {e}")
+                await asyncio.sleep(1)
+
+    async def _ensure_group(self):
+        while True:
+            try:
+                await get_async_redis().xgroup_create(self.stream_key, self.group, id="$", mkstream=True)
+                return
+            except Exception as e:
+                if "BUSYGROUP" in str(e):
+                    return
+                logger.error(f"Error creating result consumer group {self.group}: {e}")
+                await asyncio.sleep(1)
+
+    async def _deliver(self, fields: Dict[str, str], final: bool = True) -> bool:
+        """
+        投递结果，返回是否送达坐席
+
+        坐席未连接时：final=True则保存结果（保存失败时抛出异常，条目留待重试）；
+        final=False时不做处理，由调用方保留条目稍后重试
+        """
+        if await self.send(fields["payload"], fields["agent_id"]):
+            self.forwarded += 1
+            metrics.incr("result_delivery.delivered")
+            if fields.get("received_time"):
+                metrics.observe("result_delivery.latency_ms", (time.time() - float(fields["received_time"])) * 1000)
+            return True
+        if not final:
+            return False
+
+        # 坐席未连接（或连接已断开）
+        self.undelivered += 1
+        metrics.incr("result_delivery.undelivered")
+        if self.store is None or not fields.get("customer_id"):
+            return False
+        event = json.loads(fields["payload"])
+        result_data = {key: value for key, value in event.items() if key not in ("type", "msg_id")}
+        await self.store(fields["agent_id"], fields["customer_id"], event.get("msg_id"), result_data)
+        self.stored += 1
+        metrics.incr("result_delivery.stored")
+        return False
+
+
+class NodeEventListener(_BackgroundForwarder):
+    """
+    集群模式下每个Web节点订阅自己的频道 node_events:{node_id}
+
+    - deliver: 投递到本节点上的坐席；坐席已迁移到其他节点时重新查找并转发一次
+    - evict:   坐席已在其他节点重连，关闭本节点上被取代的旧连接
+    同时定期为本节点上的连接续期登记
+    """
+
+    name = "Node event listener"
+
+    def __init__(self, registry: ConnectionRegistry, send: Callable[[str, str], Awaitable[bool]],
+                 evict: Callable[[str, str], Awaitable[Any]], connections: Callable[[], Dict[str, str]]):
+        super().__init__(send)
+        self.registry = registry
+        self.evict = evict
+        self.connections = connections
+        self.rerouted = 0
+        self.evicted = 0
+
+    async def _run(self):
+        await asyncio.gather(self._listen(), self._refresh_loop())
+
+    async def _listen(self):
+        channel = self.registry.get_node_channel(self.registry.node_id)
+        while True:
+            pubsub = get_async_redis().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(channel)
+                # 订阅中断期间可能有登记过期，重新订阅后立即续期
+                await self.registry.refresh(self.connections())
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        await self._handle(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Node event listener error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def _handle(self, event: Dict[str, Any]):
+        agent_id = event["agent_id"]
+        if event["type"] == "evict":
+            self.evicted += 1
+            await self.evict(agent_id, event["conn_id"])
+            return
+
+        if await self._forward(event["data"], agent_id):
+            self.forwarded += 1
+        elif not event.get("hops") and await self.registry.route(agent_id, event["data"], hops=1):
+            self.rerouted += 1
+            metrics.incr("cluster.route.rerouted")
+        else:
+            self.undelivered += 1
+            metrics.incr("cluster.undelivered")
+
+    async def _refresh_loop(self):
+        interval = self.registry.owner_ttl_ms / 1000 / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.registry.refresh(self.connections())
+            except Exception as e:
+                logger.error(f"Error refreshing connection registry: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "rerouted": self.rerouted,
+            "evicted": self.evicted,
+            "local_connections": len(self.connections()),
+            "registry": self.registry.stats(),
+        }
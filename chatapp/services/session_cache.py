@@ -0,0 +1,257 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from chatapp.config import settings
+from chatapp.utils.logger import logger
+from chatapp.utils.lru_cache import LRUCache
+from chatapp.utils.metrics import metrics
+from chatapp.utils.redis_client import get_redis
+
+
+def _context_size(context: List[Dict[str, Any]]) -> int:
+    """估算上下文占用的内存字节数"""
+    return 64 + sum(128 + 4 * len(str(message.get("content", ""))) for message in context)
+
+
+class SessionContextCache:
+    """
+    会话上下文的进程内L1缓存（LRU + TTL + 内存上限）
+
+    通过Redis键空间通知（session:*）在各worker之间保持一致：
+    - 每次写入会话时在同一原子操作中递增版本号（session:{agent}:{customer}:ver），
+      本进程写入后按返回的版本号回填缓存
+    - 已缓存或正在写入的会话收到修改通知时读取当前版本号：与缓存条目的版本不同则淘汰，
+      本进程写入的版本低于已知的最新版本时不回填（与通知和写入返回的先后顺序无关）
+    - 删除/过期/淘汰通知总是淘汰缓存
+    - 每个会话维护一个代数，读取期间收到修改通知则不回填缓存
+    - 通知连接断开期间可能丢失通知，重连时清空整个缓存
+    键空间通知须由运维在Redis中开启（notify-keyspace-events 至少包含 Kg$lxe），未开启时不使用缓存
+    """
+
+    # 需要的键空间通知类型（K:键空间 g:通用 $:字符串 l:列表 x:过期 e:淘汰）
+    REQUIRED_NOTIFY_FLAGS = "Kg$lxe"
+    # 表示会话已被删除的通知
+    REMOVAL_EVENTS = {"del", "expired", "evicted"}
+    # 会话已被删除，下一次写入的通知到达前不回填
+    DELETED = float("inf")
+
+    def __init__(self):
+        self.cache = LRUCache(
+            max_entries=settings.SESSION_CACHE_MAX_ENTRIES,
+            ttl=settings.SESSION_CACHE_TTL_SECONDS,
+            max_bytes=settings.SESSION_CACHE_MAX_BYTES,
+            sizeof=_context_size
+        )
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._generations: Dict[str, int] = {}
+        # 缓存条目对应的版本号（读取回填的条目没有版本号，为None）
+        self._cached_versions: Dict[str, Optional[int]] = {}
+        # 通知中读到的最新版本号（只记录已缓存或正在写入的会话）
+        self._latest_versions: Dict[str, float] = {}
+        self._writing: Dict[str, int] = {}
+        self._redis = None
+        self._listener_pid: Optional[int] = None
+        self._listening = False
+        self.invalidations = 0
+
+    @staticmethod
+    def get_cache_key(redis_key: str) -> Optional[str]:
+        """将会话相关的Redis键映射为缓存键 session:{agent}:{customer}（版本号键不映射）"""
+        parts = redis_key.split(":")
+        if len(parts) == 3 or (len(parts) == 4 and parts[3] == "messages"):
+            return ":".join(parts[:3])
+        return None
+
+    @staticmethod
+    def get_version_key(session_key: str) -> str:
+        return f"{session_key}:ver"
+
+    def get(self, session_key: str) -> Optional[List[Dict[str, Any]]]:
+        """读取缓存，未命中返回None；通知监听不可用时总是未命中"""
+        if not self._ensure_listener():
+            return None
+        context = self.cache.get(session_key)
+        return list(context) if context is not None else None
+
+    def generation(self, session_key: str) -> Tuple[int, int]:
+        """读取前记录代数，用于判断回填是否安全"""
+        with self._lock:
+            return self._epoch, self._generations.get(session_key, 0)
+
+    def fill(self, session_key: str, context: List[Dict[str, Any]], generation: Tuple[int, int]):
+        """读取后回填缓存（期间有修改通知则放弃）"""
+        with self._lock:
+            if self._listening and (self._epoch, self._generations.get(session_key, 0)) == generation:
+                self._set(session_key, context, None)
+
+    def begin_write(self, session_key: str) -> Tuple[int, int]:
+        """本进程写入前登记，写入期间的修改通知会记录最新版本号"""
+        with self._lock:
+            self._writing[session_key] = self._writing.get(session_key, 0) + 1
+            return self._epoch, self._generations.get(session_key, 0)
+
+    def end_write(self, session_key: str, context: Optional[List[Dict[str, Any]]], generation: Tuple[int, int],
+                  version: Optional[int] = None):
+        """写入完成后按写入返回的版本号回填缓存；写入失败时context传入None"""
+        with self._lock:
+            writing = self._writing.get(session_key, 0) - 1
+            if writing > 0:
+                self._writing[session_key] = writing
+            else:
+                self._writing.pop(session_key, None)
+
+            if context is None or version is None or not self._listening or self._epoch != generation[0]:
+                stored = False
+            else:
+                version = int(version)
+                stored = version >= self._latest_versions.get(session_key, 0)
+                if stored:
+                    self._set(session_key, context, version)
+            if not stored and session_key not in self._cached_versions and not writing:
+                self._latest_versions.pop(session_key, None)
+        if context is None:
+            self.invalidate(session_key)
+
+    def invalidate(self, session_key: str):
+        """淘汰缓存并推进代数"""
+        with self._lock:
+            self._invalidate(session_key)
+
+    def _set(self, session_key: str, context: List[Dict[str, Any]], version: Optional[int]):
+        """写入缓存条目（调用方持有锁）"""
+        self.cache.set(session_key, list(context))
+        self._cached_versions[session_key] = version
+
+    def _invalidate(self, session_key: str):
+        """淘汰缓存条目并推进代数（调用方持有锁）"""
+        self._generations[session_key] = self._generations.get(session_key, 0) + 1
+        self._cached_versions.pop(session_key, None)
+        if not self._writing.get(session_key):
+            self._latest_versions.pop(session_key, None)
+        self.cache.delete(session_key)
+        self.invalidations += 1
+
+    def _on_keyspace_event(self, redis_key: str, event: str):
+        session_key = self.get_cache_key(redis_key)
+        if session_key is None:
+            return
+
+        with self._lock:
+            tracked = session_key in self._cached_versions or session_key in self._writing
+        current: Optional[float] = None
+        if tracked:
+            if event in self.REMOVAL_EVENTS:
+                current = self.DELETED
+            else:
+                try:
+                    value = self._redis.get(self.get_version_key(session_key))
+                    current = int(value) if value is not None else self.DELETED
+                except Exception as e:
+                    logger.error(f"Error reading version of session {session_key}: {e}")
+                    current = self.DELETED
+
+        with self._lock:
+            # 代数总是推进：读取期间收到的通知使读取回填失效
+            self._generations[session_key] = self._generations.get(session_key, 0) + 1
+            if current is None:
+                self._invalidate(session_key)
+            else:
+                self._latest_versions[session_key] = current
+                if session_key in self._cached_versions and self._cached_versions[session_key] != current:
+                    self._cached_versions.pop(session_key, None)
+                    self.cache.delete(session_key)
+                    self.invalidations += 1
+            # 代数表只需覆盖缓存中的会话，防止无限增长
+            if len(self._generations) + len(self._cached_versions) > self.cache.max_entries * 4:
+                self._reset()
+
+    def _reset(self):
+        """清空缓存并开始新的纪元（调用方持有锁）"""
+        self._epoch += 1
+        self._generations.clear()
+        self._cached_versions.clear()
+        self._latest_versions.clear()
+        self.cache.clear()
+
+    def _ensure_listener(self) -> bool:
+        """在当前进程中启动通知监听线程（fork之后按需启动）"""
+        pid = os.getpid()
+        if self._listener_pid != pid:
+            with self._lock:
+                if self._listener_pid != pid:
+                    self._listener_pid = pid
+                    self._listening = False
+                    self._reset()
+                    threading.Thread(target=self._listen_forever, name="session-cache-invalidator",
+                                     daemon=True).start()
+        return self._listening
+
+    def _listen_forever(self):
+        redis_client = self._redis = get_redis()
+        channel_pattern = f"__keyspace@{settings.REDIS_DB}__:session:*"
+        prefix_length = len(channel_pattern) - len("session:*")
+
+        try:
+            self._check_notifications(redis_client)
+        except Exception as e:
+            logger.error(f"Redis keyspace notifications unavailable, session cache disabled: {e}")
+            return
+
+        while True:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(channel_pattern)
+                with self._lock:
+                    self._reset()
+                    self._listening = True
+                logger.info("Session cache invalidation listener subscribed")
+
+                for message in pubsub.listen():
+                    if message.get("type") == "pmessage":
+                        self._on_keyspace_event(message["channel"][prefix_length:], message["data"])
+
+            except Exception as e:
+                logger.error(f"Session cache invalidation listener error: {e}")
+            finally:
+                # 断线期间可能丢失通知，停止使用缓存直到重新订阅
+                with self._lock:
+                    self._listening = False
+                    self._reset()
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            time.sleep(1)
+
+    @classmethod
+    def _check_notifications(cls, redis_client):
+        """检查键空间通知配置（由运维开启，应用不修改共享Redis的服务器配置）"""
+        current = redis_client.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+        flags = set(current) | (set("g$lshzxetd") if "A" in current else set())
+        missing = "".join(flag for flag in cls.REQUIRED_NOTIFY_FLAGS if flag not in flags)
+        if missing:
+            raise RuntimeError(f"notify-keyspace-events='{current}' is missing '{missing}', "
+                               f"configure it to include '{cls.REQUIRED_NOTIFY_FLAGS}'")
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存命中率与内存统计"""
+        data = self.cache.stats()
+        data["listening"] = self._listening
+        data["invalidations"] = self.invalidations
+        return data
+
+
+_session_cache: Optional[SessionContextCache] = None
+
+
+def get_session_cache() -> Optional[SessionContextCache]:
+    """获取进程内共享的会话缓存，未启用时返回None"""
+    global _session_cache
+    if not settings.SESSION_CACHE_ENABLED:
+        return None
+    if _session_cache is None:
+        _session_cache = SessionContextCache()
+        metrics.register_provider("session_cache", _session_cache.stats)
+    return _session_cache
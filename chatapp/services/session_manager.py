@@ -1,71 +1,338 @@
-import json
-import redis
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 from datetime import datetime, timedelta
+from redis.commands.core import AsyncScript
 from chatapp.config import settings
 from chatapp.utils.logger import logger
+from chatapp.utils.redis_client import get_redis, get_async_redis
+from chatapp.utils.codec import get_codec
+from chatapp.services.session_cache import get_session_cache
 
+# 列表存储：一次往返完成 迁移旧键 + 追加 + 截断 + 续期 + 递增版本号 + 读取，返回 {版本号, 上下文}
+# 旧键为二进制编码（非JSON）时整段作为一个元素写入，读取时展开
+# KEYS[1]=列表键 KEYS[2]=旧的字符串键 KEYS[3]=版本号键 ARGV[1]=消息JSON ARGV[2]=最大条数 ARGV[3]=过期秒数
+_APPEND_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    local ok, old = pcall(cjson.decode, redis.call('GET', KEYS[2]))
+    if ok and type(old) == 'table' then
+        for _, item in ipairs(old) do
+            redis.call('RPUSH', KEYS[1], cjson.encode(item))
+        end
+    elseif not ok then
+        redis.call('RPUSH', KEYS[1], redis.call('GET', KEYS[2]))
+    end
+    redis.call('DEL', KEYS[2])
+end
+redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('LTRIM', KEYS[1], -tonumber(ARGV[2]), -1)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+local version = redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], tonumber(ARGV[3]))
+return {version, redis.call('LRANGE', KEYS[1], 0, -1)}
+"""
 
-class SessionManager:
-    """会话管理器"""
+# 将旧的字符串键迁移为列表键，保留剩余过期时间
+# KEYS[1]=列表键 KEYS[2]=旧的字符串键 ARGV[1]=最大条数
+_MIGRATE_SCRIPT = """
+if redis.call('TYPE', KEYS[2])['ok'] ~= 'string' then
+    return 0
+end
+local ttl = redis.call('PTTL', KEYS[2])
+local ok, old = pcall(cjson.decode, redis.call('GET', KEYS[2]))
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    if ok and type(old) == 'table' then
+        for _, item in ipairs(old) do
+            redis.call('RPUSH', KEYS[1], cjson.encode(item))
+        end
+        redis.call('LTRIM', KEYS[1], -tonumber(ARGV[1]), -1)
+    elseif not ok then
+        redis.call('RPUSH', KEYS[1], redis.call('GET', KEYS[2]))
+    end
+    if ttl > 0 and redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('PEXPIRE', KEYS[1], ttl)
+    end
+end
+redis.call('DEL', KEYS[2])
+return 1
+"""
+
+
+class _SessionStore:
+    """会话存储的公共配置与键规则"""
 
     def __init__(self):
-        self.redis_client = redis.Redis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
-            password=settings.REDIS_PASSWORD,
-            db=settings.REDIS_DB,
-            decode_responses=True
-        )
         self.session_expire = 3600  # 1小时过期
         self.max_context_messages = 10  # 最多保存10条上下文
+        self.result_expire = 300  # AI结果5分钟过期
+        self.storage_mode = settings.SESSION_STORAGE_MODE
+        self.cache = get_session_cache()
+        self.codec = get_codec()
 
     def get_session_key(self, agent_id: str, customer_id: str) -> str:
         """生成会话键"""
         return f"session:{agent_id}:{customer_id}"
 
-    def add_message(self, agent_id: str, customer_id: str, message: Dict[str, Any]):
-        """添加消息到会话上下文"""
-        session_key = self.get_session_key(agent_id, customer_id)
+    def get_session_list_key(self, agent_id: str, customer_id: str) -> str:
+        """生成列表存储模式的会话键"""
+        return f"session:{agent_id}:{customer_id}:messages"
 
-        try:
-            # 获取现有上下文
-            context = self.get_context(agent_id, customer_id)
+    def get_version_key(self, agent_id: str, customer_id: str) -> str:
+        """生成会话版本号键：每次写入递增，L1缓存据此区分本进程与其他进程的写入"""
+        return f"session:{agent_id}:{customer_id}:ver"
+
+    def get_summary_key(self, agent_id: str, customer_id: str) -> str:
+        """生成会话摘要键（较早对话的滚动摘要）"""
+        return f"session:{agent_id}:{customer_id}:summary"
+
+    def get_result_key(self, agent_id: str, customer_id: str, msg_id: str) -> str:
+        """生成AI结果键"""
+        return f"ai_result:{agent_id}:{customer_id}:{msg_id}"
+
+    def _append_to_context(self, context: List[Dict[str, Any]], message: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """字符串存储：追加消息并保持上下文长度限制"""
+        # 添加新消息
+        message['timestamp'] = datetime.now().isoformat()
+        context.append(message)
+
+        # 保持上下文长度限制
+        if len(context) > self.max_context_messages:
+            context = context[-self.max_context_messages:]
+        return context
+
+    def _encode_message(self, message: Dict[str, Any]) -> Union[str, bytes]:
+        """列表存储：为消息加上时间戳并编码"""
+        message['timestamp'] = datetime.now().isoformat()
+        return self.codec.encode_message(message)
+
+    def _decode_context(self, items: List[Union[str, bytes]],
+                        legacy_value: Optional[Union[str, bytes]]) -> List[Dict[str, Any]]:
+        """解析上下文：优先列表存储，尚未迁移的会话回退到旧的字符串键（JSON或二进制编码）"""
+        if items:
+            return self.codec.decode_context_items(items)[-self.max_context_messages:]
+        if legacy_value:
+            return self.codec.decode(legacy_value)
+        return []
+
+    def _bump_version(self, pipe, agent_id: str, customer_id: str):
+        """字符串存储：在写入上下文的事务中递增版本号（与上下文同时过期）"""
+        version_key = self.get_version_key(agent_id, customer_id)
+        pipe.incr(version_key)
+        pipe.expire(version_key, self.session_expire)
+
+
+class SessionManager(_SessionStore):
+    """
+    会话管理器（同步）
+
+    storage_mode:
+        string - 整个上下文存为一个JSON字符串（session:{agent}:{customer}），读-改-写
+        list   - 每个会话一个Redis列表（session:{agent}:{customer}:messages），
+                 追加/截断/续期/读取在一次Lua脚本调用中原子完成
+
+    启用SESSION_CACHE_ENABLED时，get_context优先读取进程内L1缓存
+    """
 
-            # 添加新消息
-            message['timestamp'] = datetime.now().isoformat()
-            context.append(message)
+    def __init__(self):
+        super().__init__()
+        self.redis_client = get_redis(binary=self.codec.binary)
+        self._append_script = self.redis_client.register_script(_APPEND_SCRIPT)
+        self._migrate_script = self.redis_client.register_script(_MIGRATE_SCRIPT)
 
-            # 保持上下文长度限制
-            if len(context) > self.max_context_messages:
-                context = context[-self.max_context_messages:]
+    def add_message(self, agent_id: str, customer_id: str, message: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """添加消息到会话上下文，返回更新后的上下文"""
+        session_key = self.get_session_key(agent_id, customer_id)
+        generation = self.cache.begin_write(session_key) if self.cache else None
 
-            # 保存到 Redis
-            self.redis_client.setex(
-                session_key,
-                self.session_expire,
-                json.dumps(context, ensure_ascii=False)
-            )
+        try:
+            if self.storage_mode == "list":
+                version, items = self._append_script(
+                    keys=[self.get_session_list_key(agent_id, customer_id), session_key,
+                          self.get_version_key(agent_id, customer_id)],
+                    args=[self._encode_message(message), self.max_context_messages, self.session_expire]
+                )
+                context = self._decode_context(items, None)
+            else:
+                # 读-改-写必须基于Redis中的最新值，不使用缓存
+                context = self._append_to_context(self._load_context(agent_id, customer_id), message)
+                pipe = self.redis_client.pipeline(transaction=True)
+                pipe.setex(session_key, self.session_expire, self.codec.encode_context(context))
+                self._bump_version(pipe, agent_id, customer_id)
+                version = pipe.execute()[1]
 
             logger.info(f"Added message to session {session_key}")
+            if self.cache:
+                self.cache.end_write(session_key, context, generation, version)
+            return context
 
         except Exception as e:
             logger.error(f"Error adding message to session {session_key}: {e}")
+            if self.cache:
+                self.cache.end_write(session_key, None, generation)
+            return []
 
     def get_context(self, agent_id: str, customer_id: str) -> List[Dict[str, Any]]:
         """获取会话上下文"""
         session_key = self.get_session_key(agent_id, customer_id)
 
+        if self.cache:
+            cached = self.cache.get(session_key)
+            if cached is not None:
+                return cached
+            generation = self.cache.generation(session_key)
+
         try:
-            context_json = self.redis_client.get(session_key)
-            if context_json:
-                return json.loads(context_json)
-            return []
+            context = self._load_context(agent_id, customer_id)
         except Exception as e:
             logger.error(f"Error getting context for session {session_key}: {e}")
             return []
 
+        if self.cache:
+            self.cache.fill(session_key, context, generation)
+        return context
+
+    def _load_context(self, agent_id: str, customer_id: str) -> List[Dict[str, Any]]:
+        """从Redis读取上下文"""
+        session_key = self.get_session_key(agent_id, customer_id)
+        if self.storage_mode == "list":
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.lrange(self.get_session_list_key(agent_id, customer_id), 0, -1)
+            pipe.get(session_key)
+            items, legacy_value = pipe.execute()
+            return self._decode_context(items, legacy_value)
+        return self._decode_context([], self.redis_client.get(session_key))
+
     def clear_session(self, agent_id: str, customer_id: str):
         """清除会话"""
         session_key = self.get_session_key(agent_id, customer_id)
-        self.redis_client.delete(session_key)
+        self.redis_client.delete(
+            session_key,
+            self.get_session_list_key(agent_id, customer_id),
+            self.get_summary_key(agent_id, customer_id),
+            self.get_version_key(agent_id, customer_id)
+        )
+        if self.cache:
+            self.cache.invalidate(session_key)
+
+    def store_result(self, agent_id: str, customer_id: str, msg_id: str, result_data: Dict[str, Any]):
+        """保存AI处理结果"""
+        self.redis_client.setex(
+            self.get_result_key(agent_id, customer_id, msg_id),
+            self.result_expire,
+            self.codec.encode(result_data)
+        )
+
+    def migrate_legacy_sessions(self, batch_size: int = 500) -> int:
+        """将所有旧的字符串会话键迁移为列表存储，返回迁移的会话数"""
+        migrated = 0
+        for session_key in self.redis_client.scan_iter(match="session:*", count=batch_size, _type="string"):
+            if isinstance(session_key, bytes):
+                session_key = session_key.decode("utf-8")
+            parts = session_key.split(":")
+            if len(parts) != 3:
+                continue
+            list_key = self.get_session_list_key(parts[1], parts[2])
+            if self._migrate_script(keys=[list_key, session_key], args=[self.max_context_messages]):
+                migrated += 1
+
+        logger.info(f"Migrated {migrated} legacy sessions to list storage")
+        return migrated
+
+
+class AsyncSessionManager(_SessionStore):
+    """
+    会话管理器（异步，基于redis.asyncio连接池）
+
+    与SessionManager使用相同的键、存储格式和L1缓存，供worker协程中使用，避免阻塞事件循环
+    """
+
+    def __init__(self):
+        super().__init__()
+        # 异步客户端按事件循环创建，脚本对象只注册一次，调用时传入当前事件循环的客户端
+        self._append_script: Optional[AsyncScript] = None
+
+    async def add_message(self, agent_id: str, customer_id: str, message: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """添加消息到会话上下文，返回更新后的上下文"""
+        session_key = self.get_session_key(agent_id, customer_id)
+        generation = self.cache.begin_write(session_key) if self.cache else None
+        redis_client = get_async_redis(binary=self.codec.binary)
+
+        try:
+            if self.storage_mode == "list":
+                if self._append_script is None:
+                    self._append_script = redis_client.register_script(_APPEND_SCRIPT)
+                version, items = await self._append_script(
+                    keys=[self.get_session_list_key(agent_id, customer_id), session_key,
+                          self.get_version_key(agent_id, customer_id)],
+                    args=[self._encode_message(message), self.max_context_messages, self.session_expire],
+                    client=redis_client
+                )
+                context = self._decode_context(items, None)
+            else:
+                # 读-改-写必须基于Redis中的最新值，不使用缓存
+                context = self._append_to_context(await self._load_context(agent_id, customer_id), message)
+                async with redis_client.pipeline(transaction=True) as pipe:
+                    pipe.setex(session_key, self.session_expire, self.codec.encode_context(context))
+                    self._bump_version(pipe, agent_id, customer_id)
+                    version = (await pipe.execute())[1]
+
+            logger.info(f"Added message to session {session_key}")
+            if self.cache:
+                self.cache.end_write(session_key, context, generation, version)
+            return context
+
+        except Exception as e:
+            logger.error(f"Error adding message to session {session_key}: {e}")
+            if self.cache:
+                self.cache.end_write(session_key, None, generation)
+            return []
+
+    async def get_context(self, agent_id: str, customer_id: str) -> List[Dict[str, Any]]:
+        """获取会话上下文"""
+        session_key = self.get_session_key(agent_id, customer_id)
+
+        if self.cache:
+            cached = self.cache.get(session_key)
+            if cached is not None:
+                return cached
+            generation = self.cache.generation(session_key)
+
+        try:
+            context = await self._load_context(agent_id, customer_id)
+        except Exception as e:
+            logger.error(f"Error getting context for session {session_key}: {e}")
+            return []
+
+        if self.cache:
+            self.cache.fill(session_key, context, generation)
+        return context
+
+    async def _load_context(self, agent_id: str, customer_id: str) -> List[Dict[str, Any]]:
+        """从Redis读取上下文"""
+        session_key = self.get_session_key(agent_id, customer_id)
+        redis_client = get_async_redis(binary=self.codec.binary)
+        if self.storage_mode == "list":
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.lrange(self.get_session_list_key(agent_id, customer_id), 0, -1)
+                pipe.get(session_key)
+                items, legacy_value = await pipe.execute()
+            return self._decode_context(items, legacy_value)
+        return self._decode_context([], await redis_client.get(session_key))
+
+    async def clear_session(self, agent_id: str, customer_id: str):
+        """清除会话"""
+        session_key = self.get_session_key(agent_id, customer_id)
+        await get_async_redis().delete(
+            session_key,
+            self.get_session_list_key(agent_id, customer_id),
+            self.get_summary_key(agent_id, customer_id),
+            self.get_version_key(agent_id, customer_id)
+        )
+        if self.cache:
+            self.cache.invalidate(session_key)
+
+    async def store_result(self, agent_id: str, customer_id: str, msg_id: str, result_data: Dict[str, Any]):
+        """保存AI处理结果"""
+        await get_async_redis(binary=self.codec.binary).setex(
+            self.get_result_key(agent_id, customer_id, msg_id),
+            self.result_expire,
+            self.codec.encode(result_data)
+        )
@@ -1,8 +1,8 @@
-import httpx
 import json
 from typing import Optional, Dict, Any
 from chatapp.config import settings
 from chatapp.utils.logger import logger
+from chatapp.utils.http_transport import get_transport
 from chatapp.utils.wework_crypto import WeWorkOfficialCrypto
 import time
 
@@ -16,7 +16,7 @@ class WeWorkService:
         self.agent_id = settings.WEWORK_AGENT_ID
         self.access_token = None
         self.token_expires_at = 0
-        self.timeout = 30
+        self.transport = get_transport("wework")
         self.crypto = WeWorkOfficialCrypto()
 
     async def get_access_token(self) -> Optional[str]:
@@ -26,27 +26,27 @@ class WeWorkService:
             return self.access_token
 
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(
-                    "https://qyapi.weixin.qq.com/cgi-bin/gettoken",
-                    params={
-                        "corpid": self.corp_id,
-                        "corpsecret": self.secret
-                    }
-                )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("errcode") == 0:
-                        self.access_token = result.get("access_token")
-                        expires_in = result.get("expires_in", 7200)  # 默认2小时
-                        self.token_expires_at = time.time() + expires_in - 300  # 提前5分钟过期
-
-                        logger.info(f"WeWork access token obtained, expires in {expires_in}s")
-                        return self.access_token
-                    else:
-                        logger.error(f"WeWork API error: {result}")
-                        return None
+            response = await self.transport.request(
+                "GET",
+                "https://qyapi.weixin.qq.com/cgi-bin/gettoken",
+                params={
+                    "corpid": self.corp_id,
+                    "corpsecret": self.secret
+                }
+            )
+
+            if response.status_code == 200:
+                result = response.json()
+                if result.get("errcode") == 0:
+                    self.access_token = result.get("access_token")
+                    expires_in = result.get("expires_in", 7200)  # 默认2小时
+                    self.token_expires_at = time.time() + expires_in - 300  # 提前5分钟过期
+
+                    logger.info(f"WeWork access token obtained, expires in {expires_in}s")
+                    return self.access_token
+                else:
+                    logger.error(f"WeWork API error: {result}")
+                    return None
 
         except Exception as e:
             logger.error(f"Error getting WeWork access token: {e}")
@@ -58,26 +58,26 @@ class WeWorkService:
             return False
 
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    "https://qyapi.weixin.qq.com/cgi-bin/message/send",
-                    params={"access_token": self.access_token},
-                    json={
-                        "touser": user_id,
-                        "msgtype": "text",
-                        "agentid": self.agent_id,
-                        "text": {"content": content}
-                    }
-                )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("errcode") == 0:
-                        logger.info(f"Text message sent successfully to {user_id}")
-                        return True
-                    else:
-                        logger.error(f"WeWork send message error: {result}")
-                        return False
+            response = await self.transport.request(
+                "POST",
+                "https://qyapi.weixin.qq.com/cgi-bin/message/send",
+                params={"access_token": self.access_token},
+                json={
+                    "touser": user_id,
+                    "msgtype": "text",
+                    "agentid": self.agent_id,
+                    "text": {"content": content}
+                }
+            )
+
+            if response.status_code == 200:
+                result = response.json()
+                if result.get("errcode") == 0:
+                    logger.info(f"Text message sent successfully to {user_id}")
+                    return True
+                else:
+                    logger.error(f"WeWork send message error: {result}")
+                    return False
 
         except Exception as e:
             logger.error(f"Error sending text message: {e}")
@@ -89,26 +89,26 @@ class WeWorkService:
             return False
 
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    "https://qyapi.weixin.qq.com/cgi-bin/message/send",
-                    params={"access_token": self.access_token},
-                    json={
-                        "touser": user_id,
-                        "msgtype": "markdown",
-                        "agentid": self.agent_id,
-                        "markdown": {"content": content}
-                    }
-                )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("errcode") == 0:
-                        logger.info(f"Markdown message sent successfully to {user_id}")
-                        return True
-                    else:
-                        logger.error(f"WeWork send markdown message error: {result}")
-                        return False
+            response = await self.transport.request(
+                "POST",
+                "https://qyapi.weixin.qq.com/cgi-bin/message/send",
+                params={"access_token": self.access_token},
+                json={
+                    "touser": user_id,
+                    "msgtype": "markdown",
+                    "agentid": self.agent_id,
+                    "markdown": {"content": content}
+                }
+            )
+
+            if response.status_code == 200:
+                result = response.json()
+                if result.get("errcode") == 0:
+                    logger.info(f"Markdown message sent successfully to {user_id}")
+                    return True
+                else:
+                    logger.error(f"WeWork send markdown message error: {result}")
+                    return False
 
         except Exception as e:
             logger.error(f"Error sending markdown message: {e}")
@@ -120,23 +120,23 @@ class WeWorkService:
             return None
 
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(
-                    "https://qyapi.weixin.qq.com/cgi-bin/user/get",
-                    params={
-                        "access_token": self.access_token,
-                        "userid": user_id
-                    }
-                )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("errcode") == 0:
-                        logger.info(f"User info retrieved for {user_id}")
-                        return result
-                    else:
-                        logger.error(f"WeWork get user info error: {result}")
-                        return None
+            response = await self.transport.request(
+                "GET",
+                "https://qyapi.weixin.qq.com/cgi-bin/user/get",
+                params={
+                    "access_token": self.access_token,
+                    "userid": user_id
+                }
+            )
+
+            if response.status_code == 200:
+                result = response.json()
+                if result.get("errcode") == 0:
+                    logger.info(f"User info retrieved for {user_id}")
+                    return result
+                else:
+                    logger.error(f"WeWork get user info error: {result}")
+                    return None
 
         except Exception as e:
             logger.error(f"Error getting user info: {e}")
@@ -0,0 +1,187 @@
+#Redis值编解码 - 会话上下文与AI结果的紧凑二进制编码
+#
+# 编码格式（非JSON时）: MAGIC(0xC1) + 格式字节 + 负载
+#   格式字节低4位: 1=JSON 2=msgpack 3=紧凑消息 4=紧凑上下文；0x10位: 负载经过zstd压缩
+#   0xC1在msgpack中未使用，也不可能是JSON文本的首字节，因此可与旧的JSON值区分
+#
+# 紧凑消息为元组 [content, flags, timestamp_us, extras]：
+#   from_customer/msg_type="text" 编入flags，ISO时间戳存为自纪元起的微秒整数，
+#   其余字段原样放入extras（为空时省略），解码后与原消息完全一致
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Union
+from chatapp.config import settings
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"\xc1"
+
+FORMAT_JSON = 1
+FORMAT_MSGPACK = 2
+FORMAT_COMPACT_MESSAGE = 3
+FORMAT_COMPACT_CONTEXT = 4
+FLAG_ZSTD = 0x10
+
+_FROM_CUSTOMER_SET = 0x01
+_FROM_CUSTOMER = 0x02
+_MSG_TYPE_TEXT = 0x04
+_TIMESTAMP_ISO = 0x08
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _pack_message(message: Dict[str, Any]) -> list:
+    extras = dict(message)
+    content = extras.pop("content", None)
+    flags = 0
+    if "from_customer" in extras and isinstance(extras["from_customer"], bool):
+        flags |= _FROM_CUSTOMER_SET | (_FROM_CUSTOMER if extras.pop("from_customer") else 0)
+    if extras.get("msg_type") == "text":
+        del extras["msg_type"]
+        flags |= _MSG_TYPE_TEXT
+
+    timestamp = None
+    if isinstance(extras.get("timestamp"), str):
+        try:
+            parsed = datetime.fromisoformat(extras["timestamp"])
+            if parsed.tzinfo is None and parsed.isoformat() == extras["timestamp"]:
+                timestamp = (parsed - _EPOCH) // _MICROSECOND
+                del extras["timestamp"]
+                flags |= _TIMESTAMP_ISO
+        except ValueError:
+            pass
+
+    packed = [content, flags, timestamp]
+    if extras:
+        packed.append(extras)
+    return packed
+
+
+def _unpack_message(packed: list) -> Dict[str, Any]:
+    content, flags, timestamp = packed[:3]
+    message: Dict[str, Any] = {"content": content}
+    if flags & _FROM_CUSTOMER_SET:
+        message["from_customer"] = bool(flags & _FROM_CUSTOMER)
+    if flags & _MSG_TYPE_TEXT:
+        message["msg_type"] = "text"
+    if len(packed) > 3:
+        message.update(packed[3])
+    if flags & _TIMESTAMP_ISO:
+        message["timestamp"] = (_EPOCH + timestamp * _MICROSECOND).isoformat()
+    return message
+
+
+class RedisCodec:
+    """
+    可插拔的Redis值编解码器
+
+    name:
+        json    - 与原有格式一致的JSON文本（默认，兼容旧版本读取方）
+        msgpack - msgpack二进制
+        compact - 上下文消息使用紧凑元组 + msgpack，其余值使用msgpack
+    超过compress_threshold字节的负载使用zstd压缩（0表示不压缩）
+
+    解码总是兼容旧的JSON值，因此可以在线切换编码而无需迁移数据
+    """
+
+    def __init__(self, name: str = "json", compress_threshold: int = 0, compress_level: int = 3):
+        if name not in ("json", "msgpack", "compact"):
+            raise ValueError(f"Unknown Redis codec: {name}")
+        if name != "json" and msgpack is None:
+            raise RuntimeError(f"Redis codec {name} requires the msgpack package")
+        if compress_threshold and zstandard is None:
+            raise RuntimeError("Redis value compression requires the zstandard package")
+
+        self.name = name
+        self.compress_threshold = compress_threshold
+        self._compressor = zstandard.ZstdCompressor(level=compress_level) if compress_threshold else None
+        self._decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+    @property
+    def binary(self) -> bool:
+        """编码结果是否可能为非UTF-8字节（需要decode_responses=False的客户端）"""
+        return self.name != "json" or bool(self.compress_threshold)
+
+    def encode(self, value: Any) -> Union[str, bytes]:
+        """编码任意JSON兼容的值（AI结果、检查点等）"""
+        if self.name == "json":
+            return self._finish(FORMAT_JSON, json.dumps(value, ensure_ascii=False))
+        return self._finish(FORMAT_MSGPACK, msgpack.packb(value, use_bin_type=True))
+
+    def encode_message(self, message: Dict[str, Any]) -> Union[str, bytes]:
+        """编码单条上下文消息（列表存储的元素）"""
+        if self.name == "compact":
+            return self._finish(FORMAT_COMPACT_MESSAGE, msgpack.packb(_pack_message(message), use_bin_type=True))
+        return self.encode(message)
+
+    def encode_context(self, context: List[Dict[str, Any]]) -> Union[str, bytes]:
+        """编码整个上下文（字符串存储）"""
+        if self.name == "compact":
+            packed = [_pack_message(message) for message in context]
+            return self._finish(FORMAT_COMPACT_CONTEXT, msgpack.packb(packed, use_bin_type=True))
+        return self.encode(context)
+
+    def decode(self, raw: Optional[Union[str, bytes]]) -> Any:
+        """解码任意格式的值，旧的JSON文本原样解析"""
+        if raw is None:
+            return None
+        if isinstance(raw, str) or raw[:1] != MAGIC:
+            return json.loads(raw)
+
+        fmt, payload = raw[1], raw[2:]
+        if fmt & FLAG_ZSTD:
+            if self._decompressor is None:
+                raise RuntimeError("Cannot decode compressed Redis value: zstandard is not installed")
+            payload = self._decompressor.decompress(payload)
+            fmt &= ~FLAG_ZSTD
+
+        if fmt == FORMAT_JSON:
+            return json.loads(payload)
+        if msgpack is None:
+            raise RuntimeError("Cannot decode binary Redis value: msgpack is not installed")
+        value = msgpack.unpackb(payload, raw=False)
+        if fmt == FORMAT_COMPACT_MESSAGE:
+            return _unpack_message(value)
+        if fmt == FORMAT_COMPACT_CONTEXT:
+            return [_unpack_message(item) for item in value]
+        return value
+
+    def decode_context_items(self, items: List[Union[str, bytes]]) -> List[Dict[str, Any]]:
+        """解码列表存储的元素；迁移时整段写入的旧上下文会被展开"""
+        context: List[Dict[str, Any]] = []
+        for item in items:
+            value = self.decode(item)
+            if isinstance(value, list):
+                context.extend(value)
+            else:
+                context.append(value)
+        return context
+
+    def _finish(self, fmt: int, payload: Union[str, bytes]) -> Union[str, bytes]:
+        if self._compressor is not None and len(payload) > self.compress_threshold:
+            if isinstance(payload, str):
+                payload = payload.encode("utf-8")
+            return MAGIC + bytes([fmt | FLAG_ZSTD]) + self._compressor.compress(payload)
+        if fmt == FORMAT_JSON:
+            return payload
+        return MAGIC + bytes([fmt]) + payload
+
+
+_codec: Optional[RedisCodec] = None
+
+
+def get_codec() -> RedisCodec:
+    """获取按配置创建的进程内共享编解码器"""
+    global _codec
+    if _codec is None:
+        _codec = RedisCodec(settings.REDIS_CODEC, settings.REDIS_CODEC_COMPRESS_THRESHOLD)
+    return _codec
@@ -0,0 +1,110 @@
+#CPU密集型任务卸载工具 - 避免阻塞事件循环
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from chatapp.utils.logger import logger
+
+
+class OffloadQueueFullError(Exception):
+    """卸载队列已满"""
+
+
+class CPUOffloader:
+    """
+    将签名校验、解密、XML解析等CPU工作放到有界线程池/进程池中执行
+
+    mode:
+        inline  - 在事件循环中直接执行（原有行为）
+        thread  - 线程池执行
+        process - 进程池执行（函数及参数需可pickle）
+    """
+
+    MODES = ("inline", "thread", "process")
+
+    def __init__(self, mode: str = "thread", max_workers: int = 4, max_pending: int = 256):
+        if mode not in self.MODES:
+            raise ValueError(f"Unsupported CPU offload mode: {mode}")
+
+        self.mode = mode
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor: Optional[Executor] = None
+
+        # 队列深度统计
+        self.pending = 0
+        self.max_pending_seen = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.total_wait_ms = 0.0
+        self.total_run_ms = 0.0
+
+    def _get_executor(self) -> Optional[Executor]:
+        if self.mode == "inline":
+            return None
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="cpu-offload"
+                )
+            logger.info(f"CPU offload executor started: mode={self.mode}, workers={self.max_workers}")
+        return self._executor
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """在卸载执行器中运行函数并等待结果"""
+        executor = self._get_executor()
+        if executor is None:
+            return func(*args)
+
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise OffloadQueueFullError(f"CPU offload queue is full ({self.pending} pending)")
+
+        self.pending += 1
+        self.submitted += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        submitted_at = time.perf_counter()
+
+        try:
+            loop = asyncio.get_running_loop()
+            started_at, result = await loop.run_in_executor(executor, _timed_call, func, args)
+            finished_at = time.perf_counter()
+            # perf_counter在进程池中不可比，仅以总耗时计入运行时间
+            if self.mode == "thread":
+                self.total_wait_ms += (started_at - submitted_at) * 1000
+                self.total_run_ms += (finished_at - started_at) * 1000
+            else:
+                self.total_run_ms += (finished_at - submitted_at) * 1000
+            return result
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """队列深度及耗时统计"""
+        completed = self.submitted - self.pending
+        return {
+            "mode": self.mode,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "max_pending_seen": self.max_pending_seen,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait_ms / completed, 3) if completed else 0.0,
+            "avg_run_ms": round(self.total_run_ms / completed, 3) if completed else 0.0,
+        }
+
+    def shutdown(self):
+        """关闭执行器"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logger.info("CPU offload executor shut down")
+
+
+def _timed_call(func: Callable[..., Any], args: tuple):
+    """在执行器中调用函数，同时返回开始执行的时间点"""
+    return time.perf_counter(), func(*args)
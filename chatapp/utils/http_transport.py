@@ -0,0 +1,210 @@
+#共享HTTP传输层 - 按上游划分的连接池与统计
+import asyncio
+import contextlib
+import time
+import weakref
+from typing import Any, AsyncIterator, Dict
+import httpx
+from chatapp.config import settings
+from chatapp.utils.logger import logger
+
+
+class UpstreamConfig:
+    """单个上游的连接池与超时配置"""
+
+    def __init__(self, name: str, connect_timeout: float, read_timeout: float,
+                 max_connections: int, max_keepalive_connections: int,
+                 keepalive_expiry: float = 60, pool_timeout: float = 10, http2: bool = False):
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.pool_timeout = pool_timeout
+        self.http2 = http2
+
+
+class HTTPTransport:
+    """
+    单个上游的共享HTTP传输
+
+    每个事件循环持有一个长连接客户端；通过httpcore的trace扩展统计
+    进行中请求数、连接池等待时间以及连接复用率
+    """
+
+    # 请求真正开始发送（已拿到连接）或开始新建连接的trace事件
+    _READY_EVENTS = (
+        "connection.connect_tcp.started",
+        "http11.send_request_headers.started",
+        "http2.send_request_headers.started",
+    )
+
+    def __init__(self, config: UpstreamConfig):
+        self.config = config
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = \
+            weakref.WeakKeyDictionary()
+
+        self.requests = 0
+        self.failures = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.new_connections = 0
+        self.total_pool_wait_ms = 0.0
+        self.max_pool_wait_ms = 0.0
+        self.total_latency_ms = 0.0
+
+    def get_client(self) -> httpx.AsyncClient:
+        """获取当前事件循环的客户端"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            config = self.config
+            client = httpx.AsyncClient(
+                http2=config.http2,
+                timeout=httpx.Timeout(
+                    connect=config.connect_timeout,
+                    read=config.read_timeout,
+                    write=config.read_timeout,
+                    pool=config.pool_timeout
+                ),
+                limits=httpx.Limits(
+                    max_connections=config.max_connections,
+                    max_keepalive_connections=config.max_keepalive_connections,
+                    keepalive_expiry=config.keepalive_expiry
+                )
+            )
+            self._clients[loop] = client
+            logger.info(f"HTTP transport client created for upstream: {config.name}")
+        return client
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """发送请求并记录连接池统计"""
+        async with self._tracked(kwargs) as extensions:
+            return await self.get_client().request(method, url, extensions=extensions, **kwargs)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs: Any) -> AsyncIterator[httpx.Response]:
+        """发送流式请求（如SSE），在上下文内逐块读取响应体"""
+        async with self._tracked(kwargs) as extensions:
+            async with self.get_client().stream(method, url, extensions=extensions, **kwargs) as response:
+                yield response
+
+    @contextlib.asynccontextmanager
+    async def _tracked(self, kwargs: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """统计一次请求的连接池等待、新建连接与耗时，返回带trace的extensions"""
+        started_at = time.perf_counter()
+        state = {"ready": False, "connected": False}
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            if event_name == "connection.connect_tcp.started":
+                state["connected"] = True
+            if not state["ready"] and event_name in self._READY_EVENTS:
+                state["ready"] = True
+                wait_ms = (time.perf_counter() - started_at) * 1000
+                self.total_pool_wait_ms += wait_ms
+                self.max_pool_wait_ms = max(self.max_pool_wait_ms, wait_ms)
+
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        extensions["trace"] = trace
+
+        self.requests += 1
+        self.in_use += 1
+        self.max_in_use = max(self.max_in_use, self.in_use)
+        try:
+            yield extensions
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.in_use -= 1
+            if state["connected"]:
+                self.new_connections += 1
+            self.total_latency_ms += (time.perf_counter() - started_at) * 1000
+
+    async def aclose(self):
+        """关闭当前事件循环的客户端"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池统计"""
+        requests = self.requests
+        return {
+            "http2": self.config.http2,
+            "max_connections": self.config.max_connections,
+            "requests": requests,
+            "failures": self.failures,
+            "in_use": self.in_use,
+            "max_in_use": self.max_in_use,
+            "new_connections": self.new_connections,
+            "reuse_ratio": round(1 - self.new_connections / requests, 4) if requests else 0.0,
+            "avg_pool_wait_ms": round(self.total_pool_wait_ms / requests, 3) if requests else 0.0,
+            "max_pool_wait_ms": round(self.max_pool_wait_ms, 3),
+            "avg_latency_ms": round(self.total_latency_ms / requests, 3) if requests else 0.0,
+        }
+
+
+def _build_upstream_configs() -> Dict[str, UpstreamConfig]:
+    return {
+        "openai": UpstreamConfig(
+            name="openai",
+            connect_timeout=settings.OPENAI_CONNECT_TIMEOUT,
+            read_timeout=settings.OPENAI_READ_TIMEOUT,
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            pool_timeout=settings.HTTP_POOL_TIMEOUT,
+            http2=settings.OPENAI_HTTP2
+        ),
+        "ragflow": UpstreamConfig(
+            name="ragflow",
+            connect_timeout=settings.RAGFLOW_CONNECT_TIMEOUT,
+            read_timeout=settings.RAGFLOW_READ_TIMEOUT,
+            max_connections=settings.RAGFLOW_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.RAGFLOW_MAX_KEEPALIVE,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            pool_timeout=settings.HTTP_POOL_TIMEOUT,
+            http2=settings.RAGFLOW_HTTP2
+        ),
+        "wework": UpstreamConfig(
+            name="wework",
+            connect_timeout=settings.WEWORK_CONNECT_TIMEOUT,
+            read_timeout=settings.WEWORK_READ_TIMEOUT,
+            max_connections=settings.WEWORK_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.WEWORK_MAX_KEEPALIVE,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            pool_timeout=settings.HTTP_POOL_TIMEOUT,
+            http2=settings.WEWORK_HTTP2
+        ),
+    }
+
+
+_transports: Dict[str, HTTPTransport] = {}
+
+
+def get_transport(name: str) -> HTTPTransport:
+    """获取指定上游的共享传输"""
+    transport = _transports.get(name)
+    if transport is None:
+        configs = _build_upstream_configs()
+        if name not in configs:
+            raise ValueError(f"Unknown HTTP upstream: {name}")
+        transport = _transports[name] = HTTPTransport(configs[name])
+    return transport
+
+
+async def close_all_transports():
+    """关闭当前事件循环中所有上游的客户端"""
+    for transport in list(_transports.values()):
+        try:
+            await transport.aclose()
+        except Exception as e:
+            logger.error(f"Error closing HTTP transport {transport.config.name}: {e}")
+
+
+def transport_stats() -> Dict[str, Any]:
+    """所有上游的连接池统计"""
+    return {name: transport.stats() for name, transport in _transports.items()}
@@ -0,0 +1,104 @@
+#跨进程指标导出 - worker进程定期将指标快照写入Redis，由Web服务的/metrics合并展示
+#
+# 指标注册表是进程内的，熔断、对冲、限流、模型路由、流水线阶段耗时等指标都产生在worker进程中；
+# 各进程将快照写入哈希 metrics:processes {进程标识: 快照JSON}，超过3个推送周期未更新的条目视为进程已退出
+import json
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, Optional
+from chatapp.config import settings
+from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.redis_client import get_async_redis, get_redis
+
+METRICS_KEY = "metrics:processes"
+
+
+class MetricsPusher:
+    """
+    后台线程定期推送本进程的指标快照
+
+    使用独立线程与同步客户端，不依赖worker的事件循环（Celery按任务运行事件循环时同样可用）
+    """
+
+    def __init__(self, role: str, interval: float):
+        self.process_id = f"{role}:{socket.gethostname()}-{os.getpid()}"
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-pusher", daemon=True)
+        self._thread.start()
+        logger.info(f"Pushing metrics as {self.process_id} every {self.interval:.0f}s")
+
+    def stop(self):
+        """停止推送并移除本进程的快照"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout=self.interval)
+        self._thread = None
+        try:
+            get_redis().hdel(METRICS_KEY, self.process_id)
+        except Exception as e:
+            logger.error(f"Error removing metrics snapshot {self.process_id}: {e}")
+
+    def push(self):
+        snapshot = metrics.snapshot()
+        snapshot["pushed_at"] = time.time()
+        get_redis().hset(METRICS_KEY, self.process_id, json.dumps(snapshot, ensure_ascii=False, default=str))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.push()
+            except Exception as e:
+                logger.error(f"Error pushing metrics snapshot: {e}")
+            self._stopping.wait(self.interval)
+
+
+def start_metrics_pusher(role: str) -> Optional[MetricsPusher]:
+    """按配置启动本进程的指标推送，未启用时返回None"""
+    if settings.METRICS_PUSH_INTERVAL <= 0:
+        return None
+    pusher = MetricsPusher(role, settings.METRICS_PUSH_INTERVAL)
+    pusher.start()
+    return pusher
+
+
+async def collect_process_metrics() -> Dict[str, Any]:
+    """
+    读取各进程推送的快照
+
+    返回各进程的完整快照，以及所有进程计数器之和（直方图分位数无法合并，按进程查看）；
+    过期的条目同时从哈希中删除
+    """
+    redis_client = get_async_redis()
+    entries = await redis_client.hgetall(METRICS_KEY)
+    stale_before = time.time() - settings.METRICS_PUSH_INTERVAL * 3
+
+    processes: Dict[str, Any] = {}
+    counters: Dict[str, float] = {}
+    stale = []
+    for process_id, raw in entries.items():
+        try:
+            snapshot = json.loads(raw)
+        except ValueError:
+            stale.append(process_id)
+            continue
+        if snapshot.get("pushed_at", 0) < stale_before:
+            stale.append(process_id)
+            continue
+        processes[process_id] = snapshot
+        for name, value in snapshot.get("counters", {}).items():
+            counters[name] = counters.get(name, 0) + value
+
+    if stale:
+        await redis_client.hdel(METRICS_KEY, *stale)
+    return {"counters": counters, "processes": processes}
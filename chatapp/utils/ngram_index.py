@@ -0,0 +1,245 @@
+#本地知识检索索引 - 中文字符n-gram + BM25倒排索引，内存映射的磁盘格式
+#
+# 文件格式（小端，各段按8字节对齐），由 build_index 生成、NGramIndex 通过mmap只读加载，
+# 多个worker进程共享同一份页缓存：
+#   头部     magic(8s) n_docs(u32) n_terms(u32) avgdl(f64) 各段偏移(5 x u64)
+#   词表     term_hashes u64[n_terms]（升序） term_offsets u64[n_terms] term_dfs u32[n_terms]
+#   倒排     每个词: doc_ids u32[df] 紧接 tfs u32[df]
+#   文档长度 u32[n_docs]
+#   文档偏移 u64[n_docs + 1]
+#   文档     UTF-8 JSON（RAGFlow检索结果格式，至少包含content）
+#
+# 构建:
+#     python -m chatapp.utils.ngram_index --input real_estate_export.jsonl --output data/real_estate.idx
+import argparse
+import bisect
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import time
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+from chatapp.utils.logger import logger
+
+MAGIC = b"CHNGIDX1"
+_HEADER = struct.Struct("<8sIIdQQQQQ")
+_TOKEN_PATTERN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+|[a-z0-9]+")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """中文按字符二元组切分（单字片段保留单字），字母数字按整词切分"""
+    tokens = []
+    for segment in _TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", text).lower()):
+        if segment.isascii() or len(segment) == 1:
+            tokens.append(segment)
+        else:
+            tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+    return tokens
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _pad(buffer: bytearray):
+    buffer.extend(b"\0" * (-len(buffer) % 8))
+
+
+def build_index(documents: Iterable[Dict[str, Any]], path: str) -> Dict[str, Any]:
+    """从文档（至少包含content字段）构建索引文件，原子替换已有文件"""
+    postings: Dict[int, List[tuple]] = {}
+    doc_lengths = array("I")
+    doc_offsets = array("Q", [0])
+    doc_store = bytearray()
+
+    for doc_id, document in enumerate(documents):
+        tokens = tokenize(str(document.get("content", "")))
+        doc_lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term_hash(term), []).append((doc_id, tf))
+        doc_store.extend(json.dumps(document, ensure_ascii=False).encode("utf-8"))
+        doc_offsets.append(len(doc_store))
+
+    n_docs = len(doc_lengths)
+    avgdl = sum(doc_lengths) / n_docs if n_docs else 0.0
+    term_hashes = array("Q", sorted(postings))
+    term_offsets = array("Q")
+    term_dfs = array("I")
+    posting_data = array("I")
+    for hashed in term_hashes:
+        entries = postings[hashed]
+        term_offsets.append(len(posting_data))
+        term_dfs.append(len(entries))
+        posting_data.extend(doc_id for doc_id, _ in entries)
+        posting_data.extend(tf for _, tf in entries)
+
+    body = bytearray()
+    offsets = []
+    for section in ((term_hashes, term_offsets, term_dfs), (posting_data,), (doc_lengths,), (doc_offsets,)):
+        offsets.append(_HEADER.size + len(body))
+        for values in section:
+            body.extend(values.tobytes())
+            _pad(body)
+    offsets.append(_HEADER.size + len(body))
+    body.extend(doc_store)
+
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, n_docs, len(term_hashes), avgdl, *offsets))
+        f.write(body)
+    os.replace(tmp_path, path)
+    return {"documents": n_docs, "terms": len(term_hashes), "bytes": _HEADER.size + len(body)}
+
+
+class SearchResult:
+    """检索结果与置信度（得分最高的文档覆盖的查询词权重比例，0~1）"""
+
+    def __init__(self, results: List[Dict[str, Any]], confidence: float):
+        self.results = results
+        self.confidence = confidence
+
+
+class NGramIndex:
+    """只读加载索引文件（mmap），检索为纯CPU计算，无需网络"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_docs, self.n_terms, self.avgdl, off_terms, off_postings, off_doclens, off_docoffs, \
+            self._off_docs = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a knowledge index file")
+
+        view = memoryview(self._mmap)
+        n = self.n_terms
+        self._term_hashes = view[off_terms:off_terms + 8 * n].cast("Q")
+        self._term_offsets = view[off_terms + 8 * n:off_terms + 16 * n].cast("Q")
+        self._term_dfs = view[off_terms + 16 * n:off_terms + 20 * n].cast("I")
+        self._postings = view[off_postings:off_doclens].cast("I")
+        self._doc_lengths = view[off_doclens:off_doclens + 4 * self.n_docs].cast("I")
+        self._doc_offsets = view[off_docoffs:off_docoffs + 8 * (self.n_docs + 1)].cast("Q")
+        self._docs = view[self._off_docs:]
+
+    def _lookup(self, term: str) -> Optional[tuple]:
+        hashed = term_hash(term)
+        position = bisect.bisect_left(self._term_hashes, hashed)
+        if position < self.n_terms and self._term_hashes[position] == hashed:
+            return self._term_offsets[position], self._term_dfs[position]
+        return None
+
+    def document(self, doc_id: int) -> Dict[str, Any]:
+        start, end = self._doc_offsets[doc_id], self._doc_offsets[doc_id + 1]
+        return json.loads(bytes(self._docs[start:end]))
+
+    def search(self, query: str, top_k: int = 5) -> SearchResult:
+        """BM25检索，返回RAGFlow格式的结果（content + score + source=local）"""
+        terms = set(tokenize(query))
+        if not terms or not self.n_docs:
+            return SearchResult([], 0.0)
+
+        # 语料中不存在的词按最稀有词idf的一半计权，避免只靠一个偶然命中的词就判定高置信度
+        absent_weight = math.log(1 + (self.n_docs - 0.5) / 1.5) / 2
+        total_weight = 0.0
+        scores: Dict[int, float] = {}
+        matched: Dict[int, float] = {}
+        for term in terms:
+            entry = self._lookup(term)
+            if entry is None:
+                total_weight += absent_weight
+                continue
+            offset, df = entry
+            idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            total_weight += idf
+            doc_ids = self._postings[offset:offset + df]
+            tfs = self._postings[offset + df:offset + 2 * df]
+            for doc_id, tf in zip(doc_ids, tfs):
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_lengths[doc_id] / self.avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+                matched[doc_id] = matched.get(doc_id, 0.0) + idf
+
+        if not scores:
+            return SearchResult([], 0.0)
+
+        top = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        results = []
+        for doc_id, score in top:
+            document = self.document(doc_id)
+            document["score"] = round(score, 4)
+            document["source"] = "local"
+            results.append(document)
+        return SearchResult(results, matched[top[0][0]] / total_weight if total_weight else 0.0)
+
+    def close(self):
+        self._term_hashes = self._term_offsets = self._term_dfs = None
+        self._postings = self._doc_lengths = self._doc_offsets = self._docs = None
+        self._mmap.close()
+        self._file.close()
+
+
+class LocalIndexHandle:
+    """持有当前索引，文件被重新构建（mtime变化）后自动重新加载"""
+
+    def __init__(self, path: str, check_interval: float = 30.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._index: Optional[NGramIndex] = None
+        self._mtime = 0.0
+        self._checked_at = 0.0
+
+    def get(self) -> Optional[NGramIndex]:
+        now = time.monotonic()
+        if self._index is not None and now - self._checked_at < self.check_interval:
+            return self._index
+        self._checked_at = now
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return self._index
+        if self._index is None or mtime != self._mtime:
+            try:
+                # 旧索引不主动关闭，由仍在使用它的调用方释放后回收
+                self._index = NGramIndex(self.path)
+                self._mtime = mtime
+            except (OSError, ValueError, struct.error) as e:
+                logger.error(f"Error loading local knowledge index {self.path}: {e}")
+        return self._index
+
+
+def load_documents(path: str) -> Iterable[Dict[str, Any]]:
+    """读取数据集导出：JSONL（每行一个分块）或JSON数组，也接受RAGFlow检索响应 {"data": [...]}"""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("data", [])
+        if isinstance(data, dict):
+            data = data.get("chunks", [])
+    yield from data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local knowledge index")
+    parser.add_argument("--input", required=True, help="数据集导出文件（.jsonl 或 .json）")
+    parser.add_argument("--output", required=True, help="索引文件路径")
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    summary = build_index(load_documents(args.input), args.output)
+    print(f"Built {args.output}: {summary}, {time.perf_counter() - started_at:.1f}s")
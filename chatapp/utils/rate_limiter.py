@@ -0,0 +1,203 @@
+#分布式限流 - 基于Redis的令牌桶（每分钟请求数RPM + 每分钟token数TPM）
+import asyncio
+import email.utils
+import random
+import time
+from typing import Any, Dict, Optional
+from chatapp.config import settings
+from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.redis_client import get_async_redis
+from chatapp.utils.resilience import get_deadline
+
+# 两个令牌桶按Redis服务器时间连续回填（桶容量为一分钟的配额）；
+# 两者都足够时扣减并返回0，否则返回需要等待的毫秒数（不扣减）。
+# blocked_until为上游429时按Retry-After设置的全局暂停时间
+_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rpm_cap, tpm_cap = tonumber(ARGV[1]), tonumber(ARGV[2])
+local cost = math.min(tonumber(ARGV[3]), tpm_cap)
+local state = redis.call('HMGET', KEYS[1], 'rpm', 'tpm', 'ts', 'blocked_until')
+local rpm = tonumber(state[1]) or rpm_cap
+local tpm = tonumber(state[2]) or tpm_cap
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+local blocked_until = tonumber(state[4]) or 0
+rpm = math.min(rpm_cap, rpm + elapsed * rpm_cap / 60000)
+tpm = math.min(tpm_cap, tpm + elapsed * tpm_cap / 60000)
+
+local wait = 0
+if blocked_until > now then
+    wait = blocked_until - now
+else
+    if rpm < 1 then
+        wait = math.ceil((1 - rpm) * 60000 / rpm_cap)
+    end
+    if tpm < cost then
+        wait = math.max(wait, math.ceil((cost - tpm) * 60000 / tpm_cap))
+    end
+    if wait == 0 then
+        rpm = rpm - 1
+        tpm = tpm - cost
+    end
+end
+redis.call('HSET', KEYS[1], 'rpm', tostring(rpm), 'tpm', tostring(tpm), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], 120000)
+return {wait, tostring(rpm), tostring(tpm)}
+"""
+
+# 上游返回429后暂停所有worker的调用，直到Retry-After到期
+_BLOCK_SCRIPT = """
+local t = redis.call('TIME')
+local blocked_until = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000) + tonumber(ARGV[1])
+if blocked_until > (tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0) then
+    redis.call('HSET', KEYS[1], 'blocked_until', blocked_until)
+end
+redis.call('PEXPIRE', KEYS[1], math.max(120000, tonumber(ARGV[1]) * 2))
+return blocked_until
+"""
+
+# 按实际用量退还多扣的token（不超过桶容量）
+_REFUND_SCRIPT = """
+local tpm = tonumber(redis.call('HGET', KEYS[1], 'tpm'))
+if tpm then
+    redis.call('HSET', KEYS[1], 'tpm', tostring(math.min(tonumber(ARGV[2]), tpm + tonumber(ARGV[1]))))
+end
+return 0
+"""
+
+
+class RateLimitedError(Exception):
+    """等待预算内未能取得配额"""
+
+
+def parse_retry_after(headers: Any, default: float) -> float:
+    """解析Retry-After（秒数或HTTP日期）与retry-after-ms响应头，返回秒数"""
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return default
+
+
+class RateLimiter:
+    """
+    集群共享的令牌桶限流（ratelimit:{name}）
+
+    - acquire()在等待预算（max_wait，且不超过当前消息的截止时间）内排队取得配额，超出则抛出RateLimitedError
+    - 上游返回429时调用throttled()，所有worker暂停到Retry-After到期
+    - Redis不可用时放行（fail-open），由上游自身的限流兜底
+    利用率以仪表 ratelimit.{name}.rpm_utilization / tpm_utilization 导出（0~1）
+    """
+
+    def __init__(self, name: str, rpm: int, tpm: int, max_wait: float = 5.0):
+        self.name = name
+        self.key = f"ratelimit:{name}"
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait = max_wait
+        self.acquired = 0
+        self.waited = 0
+        self.rejected = 0
+        self.throttled_count = 0
+        self.rpm_utilization = 0.0
+        self.tpm_utilization = 0.0
+
+    async def acquire(self, tokens: int):
+        """取得一次请求及tokens个token的配额"""
+        started_at = time.monotonic()
+        budget = self.max_wait
+        deadline = get_deadline()
+        if deadline is not None:
+            budget = min(budget, deadline.remaining())
+
+        waited = False
+        while True:
+            try:
+                wait_ms, rpm_left, tpm_left = await get_async_redis().eval(
+                    _ACQUIRE_SCRIPT, 1, self.key, self.rpm, self.tpm, tokens
+                )
+            except Exception as e:
+                logger.error(f"Rate limiter {self.name} unavailable, allowing call: {e}")
+                return
+            self._record_utilization(float(rpm_left), float(tpm_left))
+
+            if not wait_ms:
+                break
+            remaining = budget - (time.monotonic() - started_at)
+            if wait_ms / 1000 > remaining:
+                self.rejected += 1
+                metrics.incr(f"ratelimit.{self.name}.rejected")
+                raise RateLimitedError(f"Rate limit for {self.name} exceeded, retry in {wait_ms}ms")
+            waited = True
+            # 加少量抖动，避免等待中的worker同时醒来争抢
+            await asyncio.sleep(wait_ms / 1000 * (1 + random.random() * 0.1))
+
+        self.acquired += 1
+        if waited:
+            self.waited += 1
+            metrics.observe(f"ratelimit.{self.name}.wait_ms", (time.monotonic() - started_at) * 1000)
+
+    async def refund(self, tokens: int):
+        """实际用量低于预估时退还差额"""
+        if tokens <= 0:
+            return
+        try:
+            await get_async_redis().eval(_REFUND_SCRIPT, 1, self.key, tokens, self.tpm)
+        except Exception as e:
+            logger.error(f"Error refunding rate limit tokens for {self.name}: {e}")
+
+    async def throttled(self, retry_after: float):
+        """上游返回429：全局暂停retry_after秒"""
+        self.throttled_count += 1
+        metrics.incr(f"ratelimit.{self.name}.throttled")
+        logger.warning(f"{self.name} returned 429, pausing all calls for {retry_after:.1f}s")
+        try:
+            await get_async_redis().eval(_BLOCK_SCRIPT, 1, self.key, int(retry_after * 1000))
+        except Exception as e:
+            logger.error(f"Error recording rate limit pause for {self.name}: {e}")
+
+    def _record_utilization(self, rpm_left: float, tpm_left: float):
+        self.rpm_utilization = 1 - max(0.0, rpm_left) / self.rpm
+        self.tpm_utilization = 1 - max(0.0, tpm_left) / self.tpm
+        metrics.set_gauge(f"ratelimit.{self.name}.rpm_utilization", round(self.rpm_utilization, 4))
+        metrics.set_gauge(f"ratelimit.{self.name}.tpm_utilization", round(self.tpm_utilization, 4))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rpm_limit": self.rpm,
+            "tpm_limit": self.tpm,
+            "rpm_utilization": round(self.rpm_utilization, 4),
+            "tpm_utilization": round(self.tpm_utilization, 4),
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "rejected": self.rejected,
+            "throttled": self.throttled_count,
+        }
+
+
+def create_rate_limiter(name: str) -> Optional[RateLimiter]:
+    """按配置创建上游的限流器，未启用时返回None"""
+    if name != "openai":
+        raise ValueError(f"Unknown rate limiter: {name}")
+    if not settings.OPENAI_RATE_LIMIT_ENABLED:
+        return None
+    limiter = RateLimiter(
+        name,
+        rpm=settings.OPENAI_RPM_LIMIT,
+        tpm=settings.OPENAI_TPM_LIMIT,
+        max_wait=settings.OPENAI_RATE_LIMIT_MAX_WAIT
+    )
+    metrics.register_provider(f"ratelimit_{name}", limiter.stats)
+    return limiter
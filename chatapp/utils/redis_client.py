@@ -0,0 +1,63 @@
+#Redis客户端工具 - 进程内共享连接池
+import asyncio
+import weakref
+import redis
+import redis.asyncio as aioredis
+from chatapp.config import settings
+
+# 文本客户端（decode_responses=True）与二进制客户端（读取编码后的值）各一个连接池；
+# 连接池用满时等待空闲连接（最多REDIS_POOL_TIMEOUT秒），而不是立即抛出连接数超限错误
+_sync_clients = {}
+
+# 异步连接池与事件循环绑定，每个事件循环一个
+_async_clients = {
+    False: weakref.WeakKeyDictionary(),
+    True: weakref.WeakKeyDictionary(),
+}
+
+
+def get_redis(binary: bool = False) -> redis.Redis:
+    """获取进程内共享的同步Redis客户端，binary=True时返回原始字节"""
+    client = _sync_clients.get(binary)
+    if client is None:
+        pool = redis.BlockingConnectionPool(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            password=settings.REDIS_PASSWORD,
+            db=settings.REDIS_DB,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            decode_responses=not binary
+        )
+        client = _sync_clients[binary] = redis.Redis(connection_pool=pool)
+    return client
+
+
+def get_async_redis(binary: bool = False) -> aioredis.Redis:
+    """获取当前事件循环的异步Redis客户端，binary=True时返回原始字节"""
+    loop = asyncio.get_running_loop()
+    clients = _async_clients[binary]
+    client = clients.get(loop)
+    if client is None:
+        pool = aioredis.BlockingConnectionPool(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            password=settings.REDIS_PASSWORD,
+            db=settings.REDIS_DB,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            decode_responses=not binary
+        )
+        client = aioredis.Redis(connection_pool=pool)
+        clients[loop] = client
+    return client
+
+
+async def close_async_redis():
+    """关闭当前事件循环的异步Redis连接池"""
+    loop = asyncio.get_running_loop()
+    for clients in _async_clients.values():
+        client = clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+            await client.connection_pool.disconnect()
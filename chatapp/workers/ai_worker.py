@@ -1,11 +1,25 @@
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
 import asyncio
-from typing import Dict, Any
+import time
+from typing import Dict, Any, List, Optional, Set
 from chatapp.config import settings
-from chatapp.services.session_manager import SessionManager
+from chatapp.services.session_manager import AsyncSessionManager
 from chatapp.services.ragflow_service import RAGFlowService
 from chatapp.services.openai_service import OpenAIService
+from chatapp.services.message_coalescer import MessageCoalescer, CoalesceTicket
+from chatapp.services.checkpoint_store import StageCheckpointStore, StageCheckpoint
+from chatapp.services.context_compactor import ContextCompactor, CompactedContext
+from chatapp.services.connection_registry import ConnectionRegistry
+from chatapp.services.result_delivery import ResultPublisher
 from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.metrics_export import MetricsPusher, start_metrics_pusher
+from chatapp.utils.http_transport import close_all_transports, transport_stats
+from chatapp.utils.redis_client import close_async_redis
+from chatapp.utils.resilience import Deadline, set_deadline, reset_deadline, resilience_stats
+from chatapp.workers.runtime import WorkerLoop
+from chatapp.workers.pipeline import Pipeline, Stage, StageFunc
 
 # 创建 Celery 实例
 celery_app = Celery(
@@ -27,9 +41,41 @@ celery_app.conf.update(
 )
 
 # 初始化服务
-session_manager = SessionManager()
+session_manager = AsyncSessionManager()
 ragflow_service = RAGFlowService()
 openai_service = OpenAIService()
+message_coalescer = MessageCoalescer() if settings.COALESCE_ENABLED else None
+checkpoint_store = StageCheckpointStore()
+context_compactor = ContextCompactor(session_manager) if settings.CONTEXT_COMPACTION_ENABLED else None
+result_publisher = ResultPublisher(
+    settings.RESULT_STREAM_KEY if settings.RESULT_DELIVERY_MODE == "stream" else None,
+    ConnectionRegistry() if settings.CLUSTER_ENABLED else None
+)
+
+# 每个worker进程一个长期存活的事件循环，复用HTTP长连接
+worker_loop = WorkerLoop(persistent=settings.WORKER_PERSISTENT_LOOP)
+worker_loop.register_shutdown(close_all_transports)
+worker_loop.register_shutdown(close_async_redis)
+
+metrics.register_provider("http_transports", transport_stats)
+metrics.register_provider("resilience", resilience_stats)
+metrics_pusher: Optional[MetricsPusher] = None
+
+
+@worker_process_init.connect
+def _start_metrics_pusher(**kwargs):
+    """每个worker子进程（fork之后）推送自己的指标，由Web服务的/metrics合并"""
+    global metrics_pusher
+    metrics_pusher = start_metrics_pusher("celery")
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _shutdown_worker_loop(**kwargs):
+    """worker进程退出时关闭事件循环及长连接"""
+    worker_loop.shutdown()
+    if metrics_pusher is not None:
+        metrics_pusher.stop()
 
 
 @celery_app.task(bind=True, max_retries=3)
@@ -42,7 +88,7 @@ def process_message(self, message_data: Dict[str, Any]):
         logger.info(f"Processing message: {message_data.get('msg_id')}")
 
         # 运行异步处理逻辑
-        result = asyncio.run(_process_message_async(message_data))
+        result = worker_loop.run(_process_message_async(message_data))
 
         logger.info(f"Message processed successfully: {message_data.get('msg_id')}")
         return result
@@ -58,6 +104,80 @@ def process_message(self, message_data: Dict[str, Any]):
         return {"error": str(e)}
 
 
+@celery_app.task(bind=True)
+def process_message_batch(self, messages: List[Dict[str, Any]]):
+    """
+    批量处理消息（由Webhook微批量派发）
+    在单个任务内并发扇出，失败的消息转为单条任务以复用重试机制
+    """
+    logger.info(f"Processing message batch: {len(messages)} messages")
+    return worker_loop.run(_process_batch_async(messages))
+
+
+@celery_app.task
+def refresh_session_summary(agent_id: str, customer_id: str):
+    """后台刷新会话摘要（不在请求路径上）"""
+    return worker_loop.run(context_compactor.refresh(agent_id, customer_id, openai_service))
+
+
+@celery_app.task
+def invalidate_knowledge_cache(dataset: Optional[str] = None):
+    """数据集重建索引后调用，使知识检索缓存失效"""
+    version = worker_loop.run(ragflow_service.invalidate_cache(dataset))
+    return {"dataset": dataset or ragflow_service.dataset, "version": version}
+
+
+# 持有后台刷新任务的引用，避免被垃圾回收
+_summary_refresh_tasks: Set[asyncio.Task] = set()
+
+
+async def _refresh_summary_inline(agent_id: str, customer_id: str):
+    try:
+        await context_compactor.refresh(agent_id, customer_id, openai_service)
+    except Exception as e:
+        logger.error(f"Error refreshing summary for session {agent_id}:{customer_id}: {e}")
+
+
+async def _schedule_summary_refresh(agent_id: str, customer_id: str):
+    """调度摘要刷新任务，同一会话已有任务在途时跳过"""
+    try:
+        if not await context_compactor.claim_refresh(agent_id, customer_id):
+            return
+        if settings.TASK_BACKEND == "stream":
+            # 原生asyncio消费者没有Celery worker，直接在当前事件循环后台执行；refresh结束时释放锁
+            task = asyncio.create_task(_refresh_summary_inline(agent_id, customer_id))
+            _summary_refresh_tasks.add(task)
+            task.add_done_callback(_summary_refresh_tasks.discard)
+            metrics.incr("context.summary_refresh_scheduled")
+            return
+        try:
+            await asyncio.to_thread(refresh_session_summary.delay, agent_id, customer_id)
+            metrics.incr("context.summary_refresh_scheduled")
+        except Exception:
+            await context_compactor.release_refresh(agent_id, customer_id)
+            raise
+    except Exception as e:
+        logger.error(f"Error scheduling summary refresh for session {agent_id}:{customer_id}: {e}")
+
+
+async def _process_batch_async(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """并发处理一批消息"""
+    results = await asyncio.gather(
+        *(_process_message_async(message_data) for message_data in messages),
+        return_exceptions=True
+    )
+
+    failed = 0
+    for message_data, result in zip(messages, results):
+        if isinstance(result, Exception):
+            failed += 1
+            logger.error(f"Error processing message {message_data.get('msg_id')} in batch: {result}")
+            process_message.apply_async((message_data,), countdown=60)
+
+    logger.info(f"Message batch processed: {len(messages) - failed} succeeded, {failed} re-queued")
+    return {"processed": len(messages) - failed, "requeued": failed}
+
+
 async def _process_message_async(message_data: Dict[str, Any]) -> Dict[str, Any]:
     """异步处理消息的核心逻辑"""
 
@@ -72,50 +192,272 @@ async def _process_message_async(message_data: Dict[str, Any]) -> Dict[str, Any]
         logger.info(f"Skipping non-text message: {msg_type}")
         return {"skipped": True, "reason": "non-text message"}
 
+    session_id = f"{to_user}:{from_user}"
+
+    # 处理截止时间自回调接收时起算，传递给本消息的所有上游调用
+    deadline_token = set_deadline(Deadline.from_received_time(
+        message_data.get("received_time"), settings.MESSAGE_DEADLINE_SECONDS, settings.MESSAGE_DEADLINE_MIN_SECONDS
+    ))
+
+    # 1. 客户消息（写入会话上下文）
+    customer_message = {
+        "content": content,
+        "from_customer": True,
+        "msg_type": msg_type
+    }
+
     try:
-        # 1. 添加客户消息到会话上下文
-        customer_message = {
-            "content": content,
-            "from_customer": True,
-            "msg_type": msg_type
-        }
-        session_manager.add_message(to_user, from_user, customer_message)
+        # 读取阶段检查点：重试时跳过已完成的阶段（避免重复写入上下文、重复调用上游）
+        checkpoint = await checkpoint_store.load(message_data.get("msg_id"))
 
-        # 2. 获取会话上下文
-        context = session_manager.get_context(to_user, from_user)
+        # 合并短时间内连续发送的多条消息，只由最后一条触发生成
+        if message_coalescer:
+            ticket = await _append_and_submit(checkpoint, session_id, to_user, from_user, customer_message)
+            query = await message_coalescer.wait_quiet(ticket)
+            if query is None:
+                await checkpoint_store.clear(message_data.get("msg_id"))
+                return {"skipped": True, "reason": "superseded"}
 
-        # 3. 使用RAGFlow搜索相关知识
-        knowledge_results = await ragflow_service.search_knowledge(content, top_k=5)
-
-        # 4. 使用OpenAI生成回复建议
-        suggestions = await openai_service.generate_suggestions(content, context, knowledge_results)
-
-        # 5. 准备推送数据
-        result_data = {
-            "session_id": f"{to_user}:{from_user}",
-            "customer_id": from_user,
-            "agent_id": to_user,
-            "customer_message": content,
-            "suggestions": suggestions,
-            "knowledge_results": knowledge_results[:3],  # 只返回前3条知识库结果
-            "context_length": len(context),
-            "timestamp": message_data.get("create_time")
-        }
-
-        # 6. 通过WebSocket推送给前端（这里先记录日志，实际推送在main.py中实现）
-        logger.info(f"Generated suggestions for agent {to_user}: {len(suggestions)} items")
-
-        # 7. 将结果存储到Redis，供WebSocket服务获取
-        import json
-        result_key = f"ai_result:{to_user}:{from_user}:{message_data.get('msg_id')}"
-        session_manager.redis_client.setex(
-            result_key,
-            300,  # 5分钟过期
-            json.dumps(result_data, ensure_ascii=False)
+            # 合并期间可能有其他worker追加了消息，重新读取完整上下文
+            async def load_context(results: Dict[str, Any]) -> List[Dict[str, Any]]:
+                return await session_manager.get_context(to_user, from_user)
+
+            result_data = await message_coalescer.run_if_current(
+                ticket, lambda: _generate_result(message_data, query, load_context, checkpoint)
+            )
+            if result_data is None or not await message_coalescer.commit(ticket):
+                await checkpoint_store.clear(message_data.get("msg_id"))
+                return {"skipped": True, "reason": "superseded"}
+        else:
+            # 追加消息并返回更新后的上下文，与知识检索并发执行
+            async def append_context(results: Dict[str, Any]) -> List[Dict[str, Any]]:
+                return await session_manager.add_message(to_user, from_user, customer_message)
+
+            result_data = await _generate_result(message_data, content, append_context, checkpoint)
+
+        logger.info(f"Generated suggestions for agent {to_user}: {len(result_data['suggestions'])} items, "
+                    f"timings={result_data['timings']}")
+
+        # 6. 推送给前端：stream模式写入结果流，由Web服务转发到坐席的WebSocket（写入失败时抛出异常，
+        #    保留检查点由任务重试）；否则将结果存储到Redis，并通过频道推送到坐席的WebSocket
+        if settings.RESULT_DELIVERY_MODE != "stream":
+            await session_manager.store_result(to_user, from_user, message_data.get("msg_id"), result_data)
+        await result_publisher.publish_result(
+            to_user, message_data.get("msg_id"), result_data, message_data.get("received_time"), from_user
         )
+        await checkpoint_store.clear(message_data.get("msg_id"))
 
         return result_data
 
     except Exception as e:
         logger.error(f"Error in async message processing: {e}")
         raise
+
+    finally:
+        reset_deadline(deadline_token)
+
+
+async def _append_and_submit(checkpoint: Optional[StageCheckpoint], session_id: str, to_user: str,
+                             from_user: str, customer_message: Dict[str, Any]) -> CoalesceTicket:
+    """写入上下文并登记合并（重试时复用检查点中的结果，不重复写入）"""
+
+    async def append():
+        if checkpoint and checkpoint.has("appended"):
+            return
+        await session_manager.add_message(to_user, from_user, customer_message)
+        if checkpoint:
+            await checkpoint.save("appended", True)
+
+    async def submit() -> CoalesceTicket:
+        if checkpoint and checkpoint.has("coalesce_seq"):
+            return CoalesceTicket(session_id, checkpoint.get("coalesce_seq"))
+        ticket = await message_coalescer.submit(session_id, customer_message["content"])
+        if checkpoint:
+            await checkpoint.save("coalesce_seq", ticket.seq)
+        return ticket
+
+    _, ticket = await asyncio.gather(append(), submit())
+    return ticket
+
+
+class _SuggestionPusher:
+    """逐条推送本条消息的建议，并记录首条建议的耗时（推测生成与正式生成共用）"""
+
+    def __init__(self, message_data: Dict[str, Any]):
+        self.message_data = message_data
+        self.agent_id = message_data.get("to_user_name")
+        self.session_id = f"{self.agent_id}:{message_data.get('from_user_name')}"
+        self.started_at = time.perf_counter()
+        self.pushed = False
+        self.pushed_suggestions: Dict[Optional[str], Dict[int, str]] = {}
+
+    def callback(self, variant: Optional[str] = None):
+        async def push(index: int, suggestion: str):
+            if not self.pushed:
+                self.pushed = True
+                metrics.observe("suggestions.ttfs_ms", (time.perf_counter() - self.started_at) * 1000)
+                if self.message_data.get("received_time"):
+                    metrics.observe("suggestions.ttfs_from_received_ms",
+                                    (time.time() - self.message_data["received_time"]) * 1000)
+            self.pushed_suggestions.setdefault(variant, {})[index] = suggestion
+            await result_publisher.publish_suggestion(
+                self.agent_id, self.session_id, self.message_data.get("msg_id"), index, suggestion, variant
+            )
+
+        return push
+
+    def pushed_for(self, variant: Optional[str]) -> List[str]:
+        """已推送给坐席的某一变体的建议（按序号）"""
+        pushed = self.pushed_suggestions.get(variant, {})
+        return [pushed[index] for index in sorted(pushed)]
+
+
+async def _generate_result(message_data: Dict[str, Any], query: str, context_stage: StageFunc,
+                           checkpoint: Optional[StageCheckpoint] = None) -> Dict[str, Any]:
+    """
+    检索知识并生成回复建议
+
+    上下文读取与知识检索互不依赖，并发执行；生成阶段等待两者完成
+    推测生成模式下生成阶段只等待上下文，知识检索超过期限时先生成并推送不带知识的建议
+    """
+    from_user = message_data.get("from_user_name")
+    to_user = message_data.get("to_user_name")
+    generation_meta: Dict[str, Any] = {}
+    variant_meta: Dict[Optional[str], Dict[str, Any]] = {}
+    pusher = _SuggestionPusher(message_data)
+
+    # 重试时知识已在检查点中，无需推测
+    speculative = settings.SPECULATIVE_GENERATION_ENABLED and not (checkpoint and checkpoint.has("knowledge"))
+    knowledge_task = asyncio.ensure_future(ragflow_service.search_knowledge(query, top_k=5)) if speculative else None
+    started_at = time.perf_counter()
+
+    async def search_knowledge(results: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if knowledge_task:
+            return await knowledge_task
+        return await ragflow_service.search_knowledge(query, top_k=5)
+
+    async def load_summary(results: Dict[str, Any]) -> Dict[str, str]:
+        return await context_compactor.load_summary(to_user, from_user)
+
+    async def compact_context(results: Dict[str, Any]) -> CompactedContext:
+        compacted = context_compactor.compact(results["context"], results["summary"])
+        metrics.observe("context.raw_tokens", compacted.raw_tokens)
+        metrics.observe("context.prompt_tokens", compacted.tokens)
+        return compacted
+
+    async def generate(results: Dict[str, Any], knowledge: List[Dict[str, Any]],
+                       variant: Optional[str] = None) -> List[str]:
+        compacted = results.get("compaction")
+        if compacted:
+            context, summary = compacted.recent, compacted.summary
+        else:
+            context, summary = results["context"], None
+
+        meta: Dict[str, Any] = {}
+        streaming = settings.OPENAI_STREAM_ENABLED
+        suggestions = await openai_service.generate_suggestions(
+            query, context, knowledge, summary, on_suggestion=pusher.callback(variant) if streaming else None,
+            agent_id=to_user, meta=meta
+        )
+        # 非流式模式下推测/正式生成的建议在生成完成后一次推送
+        if variant and not streaming:
+            for index, suggestion in enumerate(suggestions):
+                await pusher.callback(variant)(index, suggestion)
+        variant_meta[variant] = {**meta, "variant": variant}
+        generation_meta.update(variant_meta[variant])
+        return suggestions
+
+    async def generate_suggestions(results: Dict[str, Any]) -> List[str]:
+        return await generate(results, results["knowledge"])
+
+    def shown_speculation(speculation: asyncio.Task) -> List[str]:
+        """推测生成的结果；已被取消时为流式推送中已送达坐席的部分"""
+        if speculation.done() and not speculation.cancelled() and speculation.exception() is None:
+            return speculation.result()
+        return pusher.pushed_for("speculative")
+
+    async def generate_speculatively(results: Dict[str, Any]) -> List[str]:
+        """
+        知识检索在期限内返回时与普通生成相同；否则先用上下文生成推测建议并推送，
+        知识返回后：无命中则沿用推测建议，有命中则取消尚未完成的推测生成，重新生成并覆盖已推送的建议；
+        重新生成失败（上游错误、熔断、限流时返回空）或条数少于已推送的推测建议时，沿用推测建议
+        """
+        wait = settings.SPECULATIVE_RETRIEVAL_DEADLINE_MS / 1000 - (time.perf_counter() - started_at)
+        try:
+            knowledge = await asyncio.wait_for(asyncio.shield(knowledge_task), max(wait, 0))
+            return await generate(results, knowledge)
+        except asyncio.TimeoutError:
+            pass
+
+        metrics.incr("speculation.started")
+        speculation = asyncio.create_task(generate(results, [], variant="speculative"))
+        try:
+            knowledge = await knowledge_task
+            if not knowledge:
+                suggestions = await speculation
+                metrics.incr("speculation.final.speculative")
+                return suggestions
+
+            if not speculation.done():
+                speculation.cancel()
+                metrics.incr("speculation.cancelled")
+            suggestions = await generate(results, knowledge, variant="grounded")
+            speculative_suggestions = shown_speculation(speculation)
+            if len(suggestions) < len(speculative_suggestions):
+                metrics.incr("speculation.final.speculative_fallback")
+                generation_meta.clear()
+                generation_meta.update(variant_meta.get("speculative", {"variant": "speculative"}))
+                return speculative_suggestions
+            metrics.incr("speculation.final.grounded")
+            return suggestions
+        finally:
+            if not speculation.done():
+                speculation.cancel()
+            await asyncio.gather(speculation, return_exceptions=True)
+
+    stages = [
+        # 2. 获取会话上下文
+        Stage("context", context_stage, checkpoint=True),
+        # 3. 使用RAGFlow搜索相关知识
+        Stage("knowledge", search_knowledge, checkpoint=True),
+    ]
+    if context_compactor:
+        # 按token预算压缩：摘要 + 最近几轮原文
+        stages.append(Stage("summary", load_summary))
+        stages.append(Stage("compaction", compact_context, deps=("context", "summary")))
+        suggestion_deps = ("compaction", "knowledge")
+    else:
+        suggestion_deps = ("context", "knowledge")
+    # 4. 使用OpenAI生成回复建议
+    if speculative:
+        suggestion_deps = tuple(dep for dep in suggestion_deps if dep != "knowledge")
+        stages.append(Stage("suggestions", generate_speculatively, deps=suggestion_deps, checkpoint=True))
+    else:
+        stages.append(Stage("suggestions", generate_suggestions, deps=suggestion_deps, checkpoint=True))
+
+    pipeline = Pipeline(stages)
+    try:
+        results = await pipeline.run(checkpoint=checkpoint)
+    finally:
+        if knowledge_task and not knowledge_task.done():
+            knowledge_task.cancel()
+
+    # 移出窗口的消息在后台并入摘要，下一条消息即可使用
+    if context_compactor and results["compaction"].pending:
+        await _schedule_summary_refresh(to_user, from_user)
+
+    # 5. 准备推送数据
+    return {
+        "session_id": f"{to_user}:{from_user}",
+        "customer_id": from_user,
+        "agent_id": to_user,
+        "customer_message": query,
+        "suggestions": results["suggestions"],
+        "cached": generation_meta.get("cache") is not None,
+        "model": generation_meta.get("model"),
+        "variant": generation_meta.get("variant"),
+        "knowledge_results": results["knowledge"][:3],  # 只返回前3条知识库结果
+        "context_length": len(results["context"]),
+        "timestamp": message_data.get("create_time"),
+        "timings": pipeline.timings
+    }
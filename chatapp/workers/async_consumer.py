@@ -0,0 +1,291 @@
+#原生asyncio任务消费者 - Celery prefork worker的替代入口
+#
+# 从Redis Streams（消费者组）读取与process_message相同的任务负载，
+# 在单个进程中并发运行数百个 _process_message_async 协程。
+#
+# 启动:
+#     python -m chatapp.workers.async_consumer --concurrency 200
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from redis.exceptions import ResponseError
+from chatapp.config import settings
+from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.utils.metrics_export import start_metrics_pusher
+from chatapp.utils.redis_client import get_async_redis, close_async_redis
+from chatapp.utils.http_transport import close_all_transports, transport_stats
+from chatapp.utils.resilience import resilience_stats
+
+MessageHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+async def enqueue_message(message_data: Dict[str, Any], attempt: int = 0) -> str:
+    """将消息任务写入任务流，返回条目ID"""
+    redis_client = get_async_redis()
+    return await redis_client.xadd(
+        settings.STREAM_TASK_KEY,
+        {"payload": json.dumps(message_data, ensure_ascii=False), "attempt": attempt},
+        maxlen=settings.STREAM_TASK_MAXLEN,
+        approximate=True
+    )
+
+
+class AsyncStreamConsumer:
+    """
+    基于Redis Streams消费者组的异步任务消费者
+
+    - 并发度由信号量限制
+    - 处理成功后XACK
+    - 失败按退避时间重新入流，超过最大重试次数写入死信流
+    - 处理中的条目定期续期；超过可见性超时仍未确认的条目（消费者崩溃）由其他消费者认领，
+      认领计为一次失败尝试，超过最大重试次数写入死信流
+    """
+
+    def __init__(self, handler: Optional[MessageHandler] = None, concurrency: int = 200,
+                 consumer_name: Optional[str] = None):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.stream_key = settings.STREAM_TASK_KEY
+        self.group = settings.STREAM_CONSUMER_GROUP
+        self.dead_letter_key = f"{self.stream_key}:dead"
+        self.consumer_name = consumer_name or f"{socket.gethostname()}-{os.getpid()}"
+        self.visibility_timeout_ms = settings.STREAM_VISIBILITY_TIMEOUT_MS
+        self.max_retries = settings.STREAM_MAX_RETRIES
+        self.block_ms = 1000
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._in_flight: Set[str] = set()
+        self._retrying = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.reclaimed = 0
+
+    async def ensure_group(self):
+        """创建消费者组（已存在时忽略）"""
+        try:
+            await get_async_redis().xgroup_create(self.stream_key, self.group, id="0", mkstream=True)
+            logger.info(f"Created consumer group {self.group} on {self.stream_key}")
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def run(self):
+        """消费主循环，直到stop()被调用"""
+        if self.handler is None:
+            from chatapp.workers.ai_worker import _process_message_async
+            self.handler = _process_message_async
+
+        await self.ensure_group()
+        logger.info(f"Async consumer {self.consumer_name} started: concurrency={self.concurrency}")
+        if self.concurrency > settings.REDIS_MAX_CONNECTIONS:
+            # 每条消息处理中会占用Redis连接，连接池不足时请求排队等待空闲连接
+            logger.warning(f"Consumer concurrency {self.concurrency} exceeds REDIS_MAX_CONNECTIONS="
+                           f"{settings.REDIS_MAX_CONNECTIONS}, Redis calls will queue for free connections")
+
+        maintenance = asyncio.create_task(self._maintenance_loop())
+        try:
+            while not self._stopping.is_set():
+                free_slots = self._free_slots()
+                if free_slots <= 0:
+                    await asyncio.sleep(0.01)
+                    continue
+
+                response = await get_async_redis().xreadgroup(
+                    self.group, self.consumer_name, {self.stream_key: ">"},
+                    count=free_slots, block=self.block_ms
+                )
+                for _, entries in response or []:
+                    self._dispatch(entries)
+        finally:
+            maintenance.cancel()
+            await asyncio.gather(maintenance, return_exceptions=True)
+            if self._tasks:
+                logger.info(f"Waiting for {len(self._tasks)} in-flight tasks")
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            logger.info(f"Async consumer {self.consumer_name} stopped")
+
+    def _free_slots(self) -> int:
+        """可接收的新任务数（等待重试退避的条目不占用并发槽位）"""
+        return self.concurrency - (len(self._in_flight) - self._retrying)
+
+    def stop(self):
+        """停止读取新任务，等待处理中的任务完成"""
+        self._stopping.set()
+
+    def _dispatch(self, entries: List[Tuple[str, Dict[str, str]]]):
+        for entry_id, fields in entries:
+            if entry_id in self._in_flight:
+                continue
+            self._in_flight.add(entry_id)
+            task = asyncio.create_task(self._handle(entry_id, fields))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, entry_id: str, fields: Dict[str, str]):
+        redis_client = get_async_redis()
+        try:
+            message_data = json.loads(fields["payload"])
+            attempt = int(fields.get("attempt", 0))
+        except (KeyError, ValueError) as e:
+            logger.error(f"Dropping malformed task entry {entry_id}: {e}")
+            await self._dead_letter(entry_id, fields, str(e))
+            self._in_flight.discard(entry_id)
+            return
+
+        try:
+            async with self._semaphore:
+                await self.handler(message_data)
+            await redis_client.xack(self.stream_key, self.group, entry_id)
+            self.processed += 1
+            metrics.incr("async_consumer.processed")
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error processing message {message_data.get('msg_id')} (entry {entry_id}): {e}")
+            await self._retry(entry_id, fields, message_data, attempt, str(e))
+        finally:
+            self._in_flight.discard(entry_id)
+
+    async def _retry(self, entry_id: str, fields: Dict[str, str], message_data: Dict[str, Any],
+                     attempt: int, error: str):
+        """按退避时间重新入流；原条目在新条目写入后再确认，崩溃时由可见性超时兜底"""
+        if attempt >= self.max_retries:
+            await self._dead_letter(entry_id, fields, error)
+            return
+
+        # 与Celery任务一致的退避：60s, 120s, 180s；退出时不再等待，条目留待其他消费者认领
+        self._retrying += 1
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=60 * (attempt + 1))
+            return
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._retrying -= 1
+        if await self._requeue(entry_id, fields, attempt + 1):
+            self.retried += 1
+            logger.info(f"Retrying message {message_data.get('msg_id')}, attempt {attempt + 1}")
+
+    async def _requeue(self, entry_id: str, fields: Dict[str, str], attempt: int) -> bool:
+        """以新的attempt重新入流并确认原条目；失败时原条目留在待确认列表，由可见性超时兜底"""
+        try:
+            async with get_async_redis().pipeline(transaction=True) as pipe:
+                pipe.xadd(self.stream_key, {"payload": fields["payload"], "attempt": attempt},
+                          maxlen=settings.STREAM_TASK_MAXLEN, approximate=True)
+                pipe.xack(self.stream_key, self.group, entry_id)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Error requeueing task entry {entry_id}: {e}")
+            return False
+
+    async def _dead_letter(self, entry_id: str, fields: Dict[str, str], error: str):
+        try:
+            async with get_async_redis().pipeline(transaction=True) as pipe:
+                pipe.xadd(self.dead_letter_key, {**fields, "error": error}, maxlen=10000, approximate=True)
+                pipe.xack(self.stream_key, self.group, entry_id)
+                await pipe.execute()
+        except Exception as e:
+            # 条目留在待确认列表，超时后再次认领时重新写入死信流
+            logger.error(f"Error dead-lettering task entry {entry_id}: {e}")
+            return
+        self.dead_lettered += 1
+        metrics.incr("async_consumer.dead_lettered")
+
+    async def _maintenance_loop(self):
+        """定期为处理中的条目续期，并认领超时未确认的条目"""
+        interval = self.visibility_timeout_ms / 3000
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._refresh_in_flight()
+                await self._reclaim_stale()
+            except Exception as e:
+                logger.error(f"Error in async consumer maintenance: {e}")
+
+    async def _refresh_in_flight(self):
+        """XCLAIM给自己以重置空闲时间，避免长任务被其他消费者认领"""
+        if not self._in_flight:
+            return
+        await get_async_redis().xclaim(
+            self.stream_key, self.group, self.consumer_name,
+            min_idle_time=0, message_ids=list(self._in_flight), justid=True
+        )
+
+    async def _reclaim_stale(self):
+        free_slots = self._free_slots()
+        if free_slots <= 0 or self._stopping.is_set():
+            return
+        _, entries, *_ = await get_async_redis().xautoclaim(
+            self.stream_key, self.group, self.consumer_name,
+            min_idle_time=self.visibility_timeout_ms, start_id="0-0", count=free_slots
+        )
+        # 已被MAXLEN裁剪的条目没有内容，直接确认，移出待确认列表
+        trimmed = [entry_id for entry_id, fields in entries if not fields]
+        if trimmed:
+            await get_async_redis().xack(self.stream_key, self.group, *trimmed)
+
+        entries = [(entry_id, fields) for entry_id, fields in entries if fields]
+        if entries:
+            self.reclaimed += len(entries)
+            logger.info(f"Reclaimed {len(entries)} stale task entries")
+        for entry_id, fields in entries:
+            # 超时未确认说明上次处理时消费者崩溃或卡死，计为一次失败：递增attempt重新入流，
+            # 反复导致消费者退出的消息超过最大重试次数后进入死信流，不再被无限认领
+            try:
+                attempt = int(fields.get("attempt", 0))
+            except ValueError:
+                attempt = self.max_retries
+            if attempt >= self.max_retries or "payload" not in fields:
+                await self._dead_letter(entry_id, fields, "consumer timed out processing entry")
+            else:
+                await self._requeue(entry_id, fields, attempt + 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "consumer": self.consumer_name,
+            "concurrency": self.concurrency,
+            "in_flight": len(self._in_flight),
+            "processed": self.processed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "reclaimed": self.reclaimed,
+        }
+
+
+async def _main(concurrency: int):
+    consumer = AsyncStreamConsumer(concurrency=concurrency)
+    metrics.register_provider("async_consumer", consumer.stats)
+    metrics.register_provider("http_transports", transport_stats)
+    metrics.register_provider("resilience", resilience_stats)
+    metrics_pusher = start_metrics_pusher("async_consumer")
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, consumer.stop)
+
+    try:
+        await consumer.run()
+    finally:
+        if metrics_pusher is not None:
+            metrics_pusher.stop()
+        await close_all_transports()
+        await close_async_redis()
+        logger.info(f"Async consumer final stats: {consumer.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AI task asyncio consumer")
+    parser.add_argument("--concurrency", type=int, default=settings.STREAM_CONSUMER_CONCURRENCY)
+    args = parser.parse_args()
+    asyncio.run(_main(args.concurrency))
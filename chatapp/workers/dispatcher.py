@@ -0,0 +1,148 @@
+#Celery任务微批量派发 - 在Webhook进程中合并多条消息为一次broker发布
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from chatapp.utils.logger import logger
+from chatapp.utils.metrics import metrics
+from chatapp.workers.ai_worker import process_message, process_message_batch
+
+# 停止信号
+_STOP = object()
+
+
+class CeleryBatchDispatcher:
+    """
+    缓冲解析后的消息，达到批量上限或等待超过延迟上限后，
+    作为一个批量任务发布，由ai_worker在单个任务内扇出处理
+
+    submit()等待消息所在的批次发布到broker后才返回，回调在消息进入broker后才应答success；
+    发布失败或进程在发布前退出时回调未应答成功，由企业微信重试
+    """
+
+    def __init__(self, max_batch_size: int = 50, max_latency_ms: int = 10, max_queue_size: int = 10000,
+                 publish_retries: int = 3, retry_backoff_ms: int = 100):
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.max_queue_size = max_queue_size
+        self.publish_retries = publish_retries
+        self.retry_backoff = retry_backoff_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.messages_submitted = 0
+        self.messages_published = 0
+        self.batches_published = 0
+        self.publish_retried = 0
+        self.publish_failures = 0
+
+    async def start(self):
+        """启动后台派发任务"""
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Celery batch dispatcher started: batch_size={self.max_batch_size}, "
+                    f"latency={self.max_latency * 1000:.0f}ms")
+
+    async def submit(self, message_data: Dict[str, Any]):
+        """提交消息并等待所在批次发布完成，队列满时等待（反压）；发布失败时抛出异常"""
+        if self._queue is None:
+            raise RuntimeError("Celery batch dispatcher is not started")
+        published = asyncio.get_running_loop().create_future()
+        await self._queue.put((message_data, published))
+        self.messages_submitted += 1
+        await published
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.max_latency
+
+            # 在延迟上限内尽量凑满一批
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._publish(batch)
+
+    async def _publish(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        """
+        发布一批消息（broker调用在线程中执行，避免阻塞事件循环）
+
+        失败时按指数退避重试，重试耗尽后将异常传给各条消息的submit()调用方
+        """
+        messages = [message_data for message_data, _ in batch]
+        error: Optional[Exception] = None
+        for attempt in range(self.publish_retries + 1):
+            try:
+                if len(messages) == 1:
+                    await asyncio.to_thread(process_message.delay, messages[0])
+                else:
+                    await asyncio.to_thread(process_message_batch.delay, messages)
+                self.batches_published += 1
+                self.messages_published += len(messages)
+                metrics.observe("dispatcher.batch_size", len(messages))
+                error = None
+                break
+            except Exception as e:
+                error = e
+                if attempt < self.publish_retries:
+                    self.publish_retried += 1
+                    metrics.incr("dispatcher.publish_retried")
+                    logger.warning(f"Error publishing batch of {len(messages)} messages, "
+                                   f"retrying (attempt {attempt + 1}): {e}")
+                    await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+                else:
+                    self.publish_failures += 1
+                    metrics.incr("dispatcher.publish_failures")
+                    logger.error(f"Error publishing batch of {len(messages)} messages, giving up: {e}")
+
+        for _, published in batch:
+            # 调用方（回调请求）可能已断开
+            if published.done():
+                continue
+            if error is None:
+                published.set_result(None)
+            else:
+                published.set_exception(error)
+
+    async def stop(self):
+        """停止派发，发布队列中剩余的消息后退出"""
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+        remaining = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        for i in range(0, len(remaining), self.max_batch_size):
+            await self._publish(remaining[i:i + self.max_batch_size])
+        logger.info("Celery batch dispatcher stopped")
+
+    def stats(self) -> Dict[str, Any]:
+        """派发统计"""
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "messages_submitted": self.messages_submitted,
+            "messages_published": self.messages_published,
+            "batches_published": self.batches_published,
+            "publish_retried": self.publish_retried,
+            "publish_failures": self.publish_failures,
+            "avg_batch_size": round(self.messages_published / self.batches_published, 2)
+            if self.batches_published else 0.0,
+        }
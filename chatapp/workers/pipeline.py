@@ -0,0 +1,88 @@
+#AI处理流水线 - 按依赖关系并发执行各阶段
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from chatapp.services.checkpoint_store import StageCheckpoint
+from chatapp.utils.metrics import metrics
+
+StageFunc = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class Stage:
+    """
+    流水线阶段：依赖的阶段全部完成后执行，入参为已完成阶段的结果
+
+    checkpoint为True时，非空结果会写入检查点，重试时直接复用而不再执行
+    （空结果通常表示上游调用失败，不写入，以便重试时重新执行）
+    """
+
+    def __init__(self, name: str, func: StageFunc, deps: Iterable[str] = (), checkpoint: bool = False):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.checkpoint = checkpoint
+
+
+class Pipeline:
+    """
+    由阶段组成的小型DAG
+
+    没有依赖关系的阶段并发执行，每个阶段记录开始时间与耗时（毫秒），
+    任一阶段失败时取消其余阶段并抛出异常
+    """
+
+    def __init__(self, stages: List[Stage]):
+        names = set()
+        for stage in stages:
+            missing = [dep for dep in stage.deps if dep not in names]
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on unknown or later stages: {missing}")
+            names.add(stage.name)
+        self.stages = stages
+        self.timings: Dict[str, Dict[str, Any]] = {}
+
+    async def run(self, results: Optional[Dict[str, Any]] = None,
+                  checkpoint: Optional[StageCheckpoint] = None) -> Dict[str, Any]:
+        """执行流水线，返回各阶段结果；传入检查点时跳过已完成的阶段"""
+        results = dict(results or {})
+        started_at = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage):
+            if stage.deps:
+                await asyncio.gather(*(tasks[dep] for dep in stage.deps))
+            if stage.checkpoint and checkpoint and checkpoint.has(stage.name):
+                results[stage.name] = checkpoint.get(stage.name)
+                self.timings[stage.name] = {"checkpointed": True}
+                return results[stage.name]
+
+            stage_start = time.perf_counter()
+            value = await stage.func(results)
+            stage_end = time.perf_counter()
+            if stage.checkpoint and checkpoint and value:
+                await checkpoint.save(stage.name, value)
+
+            results[stage.name] = value
+            duration_ms = (stage_end - stage_start) * 1000
+            self.timings[stage.name] = {
+                "start_ms": round((stage_start - started_at) * 1000, 2),
+                "duration_ms": round(duration_ms, 2),
+            }
+            metrics.observe(f"pipeline.{stage.name}_ms", duration_ms)
+            return value
+
+        for stage in self.stages:
+            tasks[stage.name] = asyncio.create_task(run_stage(stage))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        total_ms = (time.perf_counter() - started_at) * 1000
+        self.timings["total"] = {"start_ms": 0.0, "duration_ms": round(total_ms, 2)}
+        metrics.observe("pipeline.total_ms", total_ms)
+        return results
@@ -0,0 +1,55 @@
+#Worker运行时 - 每个worker进程一个长期存活的事件循环
+import asyncio
+from typing import Any, Awaitable, Callable, Coroutine, List, Optional
+from chatapp.utils.logger import logger
+
+
+class WorkerLoop:
+    """
+    为同步的Celery任务提供长期存活的事件循环
+
+    事件循环在首次使用时创建（prefork子进程fork之后），任务之间复用，
+    使服务中的长连接HTTP客户端可以跨任务保持keep-alive连接。
+    进程退出时执行注册的关闭钩子并关闭事件循环。
+    """
+
+    def __init__(self, persistent: bool = True):
+        self.persistent = persistent
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._shutdown_hooks: List[Callable[[], Awaitable[None]]] = []
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            logger.info("Worker event loop created")
+        return self._loop
+
+    def run(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        """在worker事件循环中运行协程并返回结果"""
+        if not self.persistent:
+            return asyncio.run(coro)
+        return self._get_loop().run_until_complete(coro)
+
+    def register_shutdown(self, hook: Callable[[], Awaitable[None]]):
+        """注册进程退出时执行的异步关闭钩子（如关闭HTTP客户端）"""
+        self._shutdown_hooks.append(hook)
+
+    def shutdown(self):
+        """执行关闭钩子并关闭事件循环"""
+        if self._loop is None or self._loop.is_closed():
+            return
+
+        loop = self._loop
+        for hook in self._shutdown_hooks:
+            try:
+                loop.run_until_complete(hook())
+            except Exception as e:
+                logger.error(f"Error running worker shutdown hook: {e}")
+
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            loop.close()
+            self._loop = None
+            logger.info("Worker event loop closed")
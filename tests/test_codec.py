@@ -0,0 +1,78 @@
+"""Redis值编解码：各编码方式往返一致，且兼容旧的JSON值"""
+import json
+import pytest
+from chatapp.utils.codec import MAGIC, FLAG_ZSTD, RedisCodec
+
+CONTEXT = [
+    {"content": "请问这套房子还在吗？", "from_customer": True, "msg_type": "text",
+     "timestamp": "2024-05-01T10:15:30.123456"},
+    {"content": "在的，您方便什么时候看房？", "from_customer": False, "msg_type": "text",
+     "timestamp": "2024-05-01T10:16:02"},
+    # 非text类型、带时区或非ISO格式的时间戳、额外字段都需原样保留
+    {"content": "[图片]", "from_customer": True, "msg_type": "image", "timestamp": "2024-05-01T10:17:00+08:00"},
+    {"content": "好的", "from_customer": 1, "timestamp": "昨天", "media_id": "m-1"},
+    {"content": None},
+]
+
+RESULT = {"status": "completed", "suggestions": ["建议一", "建议二"], "latency": 1.25, "meta": {"cached": False}}
+
+CODECS = [("json", 0), ("json", 64), ("msgpack", 0), ("msgpack", 64), ("compact", 0), ("compact", 64)]
+
+
+@pytest.mark.parametrize("name,threshold", CODECS)
+def test_value_round_trip(name, threshold):
+    codec = RedisCodec(name, threshold)
+    assert codec.decode(codec.encode(RESULT)) == RESULT
+
+
+@pytest.mark.parametrize("name,threshold", CODECS)
+def test_message_round_trip(name, threshold):
+    codec = RedisCodec(name, threshold)
+    for message in CONTEXT:
+        assert codec.decode(codec.encode_message(message)) == message
+
+
+@pytest.mark.parametrize("name,threshold", CODECS)
+def test_context_round_trip(name, threshold):
+    codec = RedisCodec(name, threshold)
+    assert codec.decode(codec.encode_context(CONTEXT)) == CONTEXT
+    items = [codec.encode_message(message) for message in CONTEXT]
+    assert codec.decode_context_items(items) == CONTEXT
+
+
+def test_json_codec_writes_plain_json():
+    codec = RedisCodec("json")
+    encoded = codec.encode(RESULT)
+    assert isinstance(encoded, str)
+    assert json.loads(encoded) == RESULT
+    assert not codec.binary
+
+
+def test_compression_above_threshold_only():
+    codec = RedisCodec("compact", compress_threshold=64)
+    small = codec.encode_message({"content": "短"})
+    large = codec.encode_context(CONTEXT * 10)
+    assert small[:1] == MAGIC and not small[1] & FLAG_ZSTD
+    assert large[:1] == MAGIC and large[1] & FLAG_ZSTD
+    assert codec.binary
+
+
+@pytest.mark.parametrize("name", ["json", "msgpack", "compact"])
+def test_decodes_legacy_json(name):
+    codec = RedisCodec(name, 64)
+    legacy = json.dumps(CONTEXT, ensure_ascii=False)
+    assert codec.decode(legacy) == CONTEXT
+    assert codec.decode(legacy.encode("utf-8")) == CONTEXT
+    assert codec.decode(None) is None
+
+
+def test_decode_context_items_expands_legacy_context():
+    # 迁移时整段写入列表的旧上下文与新写入的单条消息混合
+    codec = RedisCodec("compact")
+    items = [json.dumps(CONTEXT[:2], ensure_ascii=False), codec.encode_message(CONTEXT[2])]
+    assert codec.decode_context_items(items) == CONTEXT[:3]
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        RedisCodec("pickle")
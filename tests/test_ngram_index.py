@@ -0,0 +1,112 @@
+"""本地知识检索索引：构建、mmap加载与BM25检索"""
+import os
+import pytest
+from chatapp.utils.ngram_index import LocalIndexHandle, NGramIndex, build_index, load_documents, tokenize
+
+DOCUMENTS = [
+    {"content": "本小区二手房均价每平方米六万元，学区为实验小学", "document_keyword": "price.md"},
+    {"content": "三室两厅户型建筑面积120平方米，南北通透", "document_keyword": "layout.md"},
+    {"content": "首付比例首套房30%，二套房40%，公积金贷款额度上限120万", "document_keyword": "loan.md"},
+    {"content": "Parking: 200 spaces, monthly fee 500 yuan"},
+]
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    path = str(tmp_path / "kb.idx")
+    build_index(DOCUMENTS, path)
+    return path
+
+
+def test_tokenize():
+    assert tokenize("首付比例") == ["首付", "付比", "比例"]
+    assert tokenize("房") == ["房"]
+    assert tokenize("ＡＢＣ 120万 Parking") == ["abc", "120", "万", "parking"]
+
+
+def test_build_summary(tmp_path):
+    summary = build_index(DOCUMENTS, str(tmp_path / "nested" / "kb.idx"))
+    assert summary["documents"] == len(DOCUMENTS)
+    assert summary["terms"] > 0
+    assert os.path.getsize(tmp_path / "nested" / "kb.idx") == summary["bytes"]
+    assert not os.path.exists(tmp_path / "nested" / "kb.idx.tmp")
+
+
+def test_load_and_read_documents(index_path):
+    index = NGramIndex(index_path)
+    try:
+        assert index.n_docs == len(DOCUMENTS)
+        for doc_id, document in enumerate(DOCUMENTS):
+            assert index.document(doc_id) == document
+    finally:
+        index.close()
+
+
+def test_search_ranks_matching_document_first(index_path):
+    index = NGramIndex(index_path)
+    try:
+        result = index.search("首付比例是多少", top_k=2)
+        top = result.results[0]
+        assert top["document_keyword"] == "loan.md"
+        assert top["source"] == "local"
+        assert top["score"] > 0
+        assert len(result.results) <= 2
+        assert 0 < result.confidence < 1
+
+        # 查询词全部命中同一文档时置信度为1
+        assert index.search("公积金贷款").confidence == pytest.approx(1.0)
+        assert index.search("parking fee").results[0]["content"].startswith("Parking")
+    finally:
+        index.close()
+
+
+def test_search_without_match(index_path):
+    index = NGramIndex(index_path)
+    try:
+        result = index.search("地铁线路")
+        assert result.results == [] and result.confidence == 0.0
+        assert index.search("？！").results == []
+    finally:
+        index.close()
+
+
+def test_empty_index(tmp_path):
+    path = str(tmp_path / "empty.idx")
+    build_index([], path)
+    index = NGramIndex(path)
+    try:
+        assert index.search("首付").results == []
+    finally:
+        index.close()
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "not_an_index"
+    path.write_bytes(b"\0" * 128)
+    with pytest.raises(ValueError):
+        NGramIndex(str(path))
+
+
+def test_handle_reloads_rebuilt_index(index_path):
+    handle = LocalIndexHandle(index_path, check_interval=0)
+    first = handle.get()
+    assert handle.get() is first
+
+    build_index(DOCUMENTS[:1], index_path)
+    os.utime(index_path, (0, os.stat(index_path).st_mtime + 10))
+    second = handle.get()
+    assert second is not first
+    assert second.n_docs == 1
+
+
+def test_handle_missing_file(tmp_path):
+    assert LocalIndexHandle(str(tmp_path / "missing.idx")).get() is None
+
+
+def test_load_documents_formats(tmp_path):
+    jsonl = tmp_path / "export.jsonl"
+    jsonl.write_text('{"content": "a"}\n\n{"content": "b"}\n', encoding="utf-8")
+    response = tmp_path / "export.json"
+    response.write_text('{"data": {"chunks": [{"content": "c"}]}}', encoding="utf-8")
+    assert [d["content"] for d in load_documents(str(jsonl))] == ["a", "b"]
+    assert [d["content"] for d in load_documents(str(response))] == ["c"]
@@ -0,0 +1,132 @@
+"""令牌桶限流：扣减、等待、拒绝、退还与429暂停（fakeredis执行Lua脚本）"""
+import asyncio
+import time
+import fakeredis
+import pytest
+from chatapp.utils import rate_limiter
+from chatapp.utils.rate_limiter import RateLimitedError, RateLimiter, parse_retry_after
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(rate_limiter, "get_async_redis", lambda binary=False: client)
+    return client
+
+
+async def _tpm(redis, limiter):
+    return float(await redis.hget(limiter.key, "tpm"))
+
+
+def test_acquire_deducts_tokens(redis):
+    async def main():
+        limiter = RateLimiter("test", rpm=60, tpm=6000)
+        await limiter.acquire(1000)
+        state = await redis.hgetall(limiter.key)
+        assert float(state["rpm"]) == pytest.approx(59, abs=0.1)
+        assert float(state["tpm"]) == pytest.approx(5000, abs=10)
+        assert limiter.acquired == 1 and limiter.waited == 0
+        assert limiter.tpm_utilization == pytest.approx(1 / 6, abs=0.01)
+
+    asyncio.run(main())
+
+
+def test_acquire_waits_for_refill(redis):
+    async def main():
+        # 600 tpm = 每秒回填10个token，5个token约需等待0.5秒
+        limiter = RateLimiter("test", rpm=60, tpm=600, max_wait=2)
+        await limiter.acquire(600)
+        started_at = time.monotonic()
+        await limiter.acquire(5)
+        assert 0.4 < time.monotonic() - started_at < 1.5
+        assert limiter.acquired == 2 and limiter.waited == 1
+
+    asyncio.run(main())
+
+
+def test_acquire_rejects_beyond_max_wait(redis):
+    async def main():
+        limiter = RateLimiter("test", rpm=60, tpm=600, max_wait=0.1)
+        await limiter.acquire(600)
+        with pytest.raises(RateLimitedError):
+            await limiter.acquire(100)
+        assert limiter.rejected == 1
+        # 被拒绝的请求不扣减配额
+        assert await _tpm(redis, limiter) < 5
+
+    asyncio.run(main())
+
+
+def test_cost_is_capped_at_bucket_capacity(redis):
+    async def main():
+        limiter = RateLimiter("test", rpm=60, tpm=600, max_wait=0.1)
+        await limiter.acquire(10000)
+        assert limiter.acquired == 1
+
+    asyncio.run(main())
+
+
+def test_refund_returns_tokens_up_to_capacity(redis):
+    async def main():
+        limiter = RateLimiter("test", rpm=60, tpm=600, max_wait=0.1)
+        await limiter.acquire(500)
+        await limiter.refund(300)
+        assert await _tpm(redis, limiter) == pytest.approx(400, abs=5)
+
+        await limiter.refund(10000)
+        assert await _tpm(redis, limiter) == 600
+
+        # 退还后的配额可立即使用
+        await limiter.acquire(600)
+        assert limiter.rejected == 0
+
+    asyncio.run(main())
+
+
+def test_refund_ignores_non_positive_and_missing_bucket(redis):
+    async def main():
+        limiter = RateLimiter("test", rpm=60, tpm=600)
+        await limiter.refund(100)
+        await limiter.refund(0)
+        assert not await redis.exists(limiter.key)
+
+    asyncio.run(main())
+
+
+def test_throttled_blocks_all_callers(redis):
+    async def main():
+        limiter = RateLimiter("test", rpm=60, tpm=600, max_wait=0.2)
+        other = RateLimiter("test", rpm=60, tpm=600, max_wait=0.2)
+        await limiter.throttled(5)
+        with pytest.raises(RateLimitedError):
+            await other.acquire(1)
+
+        await limiter.throttled(0.1)
+        # 更短的暂停不会覆盖已有的暂停时间
+        with pytest.raises(RateLimitedError):
+            await other.acquire(1)
+
+    asyncio.run(main())
+
+
+def test_fails_open_when_redis_unavailable(monkeypatch):
+    class Unavailable:
+        async def eval(self, *args):
+            raise ConnectionError("redis down")
+
+    monkeypatch.setattr(rate_limiter, "get_async_redis", lambda binary=False: Unavailable())
+
+    async def main():
+        limiter = RateLimiter("test", rpm=1, tpm=1, max_wait=0)
+        await limiter.acquire(100)
+        await limiter.refund(10)
+
+    asyncio.run(main())
+
+
+def test_parse_retry_after():
+    assert parse_retry_after({"retry-after-ms": "1500"}, 9) == 1.5
+    assert parse_retry_after({"retry-after": "3"}, 9) == 3
+    assert parse_retry_after({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}, 9) == 0
+    assert parse_retry_after({"retry-after": "soon"}, 9) == 9
+    assert parse_retry_after({}, 9) == 9
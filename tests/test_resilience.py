@@ -0,0 +1,157 @@
+"""熔断器状态转换与弹性策略对熔断器的记录"""
+import asyncio
+import pytest
+from chatapp.utils import resilience
+from chatapp.utils.metrics import metrics
+from chatapp.utils.resilience import (
+    CircuitBreaker, CircuitOpenError, Deadline, ResiliencePolicy, reset_deadline, set_deadline
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(resilience.time, "monotonic", fake.monotonic)
+    return fake
+
+
+def _state_gauge(name):
+    return metrics.snapshot()["gauges"][f"breaker.{name}.state"]
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("b1", failure_threshold=3, recovery_timeout=10)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened == 1
+    assert _state_gauge("b1") == 2
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker("b2", failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_allows_single_probe(clock):
+    breaker = CircuitBreaker("b3", failure_threshold=1, recovery_timeout=10)
+    breaker.record_failure()
+    clock.now += 9.9
+    assert not breaker.allow()
+
+    clock.now += 0.1
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert _state_gauge("b3") == 1
+    assert not breaker.allow()
+
+
+def test_probe_success_closes(clock):
+    breaker = CircuitBreaker("b4", failure_threshold=1, recovery_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert _state_gauge("b4") == 0
+    assert breaker.allow() and breaker.allow()
+
+
+def test_probe_failure_reopens(clock):
+    breaker = CircuitBreaker("b5", failure_threshold=3, recovery_timeout=10)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened == 2
+
+    # 重新打开后重新计算恢复时间
+    clock.now += 5
+    assert not breaker.allow()
+    clock.now += 5
+    assert breaker.allow()
+
+
+def test_release_probe_frees_half_open_slot(clock):
+    breaker = CircuitBreaker("b6", failure_threshold=1, recovery_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_policy_records_upstream_failures():
+    async def main():
+        policy = ResiliencePolicy("p1", timeout=1, failure_threshold=2)
+
+        async def server_error():
+            return _Response(503)
+
+        for _ in range(2):
+            assert (await policy.call(server_error)).status_code == 503
+        with pytest.raises(CircuitOpenError):
+            await policy.call(server_error)
+
+    asyncio.run(main())
+
+
+def test_policy_deadline_timeout_is_not_a_failure():
+    async def main():
+        policy = ResiliencePolicy("p2", timeout=5, failure_threshold=1)
+
+        async def slow():
+            await asyncio.sleep(1)
+            return _Response(200)
+
+        token = set_deadline(Deadline.from_received_time(None, budget=0.05, min_budget=0))
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await policy.call(slow)
+        finally:
+            reset_deadline(token)
+        assert policy.breaker.state == CircuitBreaker.CLOSED
+        assert policy.timeouts == 1
+
+    asyncio.run(main())
+
+
+def test_disabled_policy_bypasses_breaker():
+    async def main():
+        policy = ResiliencePolicy("p3", timeout=1, enabled=False, failure_threshold=1)
+
+        async def server_error():
+            return _Response(500)
+
+        for _ in range(3):
+            await policy.call(server_error)
+        assert policy.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""增量建议解析与原有非流式parse_suggestions结果一致"""
+from typing import List
+import pytest
+from chatapp.services.openai_service import OpenAIService, SuggestionStreamParser
+
+
+def legacy_parse_suggestions(content: str) -> List[str]:
+    """流式解析引入前的parse_suggestions实现，作为对照"""
+    suggestions = []
+    lines = content.split('\n')
+    current_suggestion = ""
+
+    for line in lines:
+        line = line.strip()
+        if line.startswith(('建议1:', '建议2:', '建议3:')):
+            if current_suggestion:
+                suggestions.append(current_suggestion.strip())
+            current_suggestion = line[3:].strip()
+        elif current_suggestion and line:
+            current_suggestion += " " + line
+
+    if current_suggestion:
+        suggestions.append(current_suggestion.strip())
+
+    return suggestions
+
+
+def expected_suggestions(content: str) -> List[str]:
+    """原实现的结果去掉残留的冒号（"建议X:"为4个字符，原实现只移除了3个），并丢弃因此为空的建议"""
+    suggestions = (suggestion[1:].strip() for suggestion in legacy_parse_suggestions(content))
+    return [suggestion for suggestion in suggestions if suggestion]
+
+
+OUTPUTS = [
+    "建议1: 您好，这套房子还在售\n建议2: 周末可以安排看房\n建议3: 首付三成即可",
+    "建议1: 第一条\n  补充说明\n\n建议2: 第二条\n建议3: 第三条\n",
+    "好的，以下是建议：\n建议1: 第一条\n建议2: 第二条\n建议3: 第三条",
+    # 标记行为空时，后续的续行仍属于该建议
+    "建议1:\n续行一\n续行二\n建议2: 第二条\n建议3:",
+    "建议1:   \n建议2: 第二条\n后续说明\n建议3: 第三条",
+    "建议1: 第一条\r\n建议2: 第二条\r\n建议3: 第三条\r\n",
+    "建议3: 只有一条\n建议4: 不识别的编号\n建议2: 乱序",
+    "没有任何建议",
+    "",
+]
+
+
+def _parse(content: str) -> List[str]:
+    return OpenAIService.parse_suggestions(None, content)
+
+
+@pytest.mark.parametrize("content", OUTPUTS)
+def test_matches_legacy_parser(content):
+    assert _parse(content) == expected_suggestions(content)
+
+
+@pytest.mark.parametrize("content", OUTPUTS)
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7])
+def test_chunked_stream_matches_legacy_parser(content, chunk_size):
+    parser = SuggestionStreamParser()
+    streamed = []
+    for i in range(0, len(content), chunk_size):
+        streamed.extend(parser.feed(content[i:i + chunk_size]))
+    streamed.extend(parser.finish())
+    assert streamed == parser.suggestions == expected_suggestions(content)
+
+
+def test_continuation_after_empty_marker():
+    assert _parse("建议1:\n续行一\n续行二\n建议2: 第二条") == ["续行一 续行二", "第二条"]
+    assert legacy_parse_suggestions("建议1:\n续行一") == [": 续行一"]
+
+
+def test_suggestion_completes_when_next_marker_arrives():
+    parser = SuggestionStreamParser()
+    assert parser.feed("建议1: 第一条\n补充") == []
+    assert parser.feed("\n建议2: 第") == []
+    assert parser.feed("二条\n") == ["第一条 补充"]
+    # 标记行完整（收到换行）后才能确定上一条结束
+    assert parser.feed("建议3: 第三条") == []
+    assert parser.feed("\n") == ["第二条"]
+    assert parser.finish() == ["第三条"]
+    assert parser.finish() == []